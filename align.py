@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from framedecoder import SAMPLES_PER_FRAME
+from longaudio import SAMPLE_RATE, WavMap
+from resample import PolyphaseDecimator, to_int16
+from wavsink import StreamingWavWriter
+
+COARSE_RATE = 2000        # Hz; windows are correlated at this rate first
+WINDOW = 10.0             # Seconds of BLE audio per alignment window
+HOP = 30.0                # Seconds between window starts
+MAX_OFFSET = 30.0         # Search range (s) until the first window locks
+SEARCH = 0.25             # Search range (s) around the predicted offset afterwards
+FINE_WINDOW = 2.0         # Seconds correlated at the full rate to refine a window
+MIN_CORRELATION = 0.5     # Normalized peak below this rejects a window
+MIN_RMS = 1e-3            # Quieter windows are skipped (full scale = 1.0)
+MAX_RESIDUAL = 0.002      # Seconds a window may sit off the drift fit
+XFADE = 32                # Samples of crossfade at both ends of a patched gap
+BLOCK = 10 * SAMPLE_RATE  # Samples per output block
+GAPS_SUFFIX = ".gaps.json"
+MERGED_PREFIX = "merged_recording"
+
+def gap_map_path(ble_path):
+    return os.path.splitext(ble_path)[0] + GAPS_SUFFIX
+
+def write_gap_map(ble_path, gaps, samples_per_frame, sample_rate=SAMPLE_RATE):
+    """Store the [start, end) frame ranges the receiver filled in"""
+    with open(gap_map_path(ble_path), 'w') as f:
+        json.dump({'samples_per_frame': samples_per_frame, 'sample_rate': sample_rate,
+                   'gaps': gaps}, f)
+
+def read_gap_map(ble_path):
+    """Filled ranges as [start, end) sample pairs, or None without a gap map"""
+    try:
+        with open(gap_map_path(ble_path)) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    spf = info['samples_per_frame']
+    return [(start * spf, end * spf) for start, end in info['gaps']]
+
+def detect_gaps(wav, samples_per_frame=SAMPLES_PER_FRAME, block_frames=100000):
+    """Find silence-filled frames (all zero) when no gap map was saved"""
+    samples = wav.samples[:, 0]
+    frames = len(samples) // samples_per_frame
+    found = []
+    for first in range(0, frames, block_frames):
+        last = min(first + block_frames, frames)
+        block = np.asarray(samples[first * samples_per_frame:last * samples_per_frame])
+        silent = ~block.reshape(-1, samples_per_frame).any(axis=1)
+        found.append(np.flatnonzero(silent) + first)
+    frames = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+    if not frames.size:
+        return []
+    breaks = np.flatnonzero(np.diff(frames) != 1)
+    starts = frames[np.concatenate(([0], breaks + 1))]
+    ends = frames[np.concatenate((breaks, [len(frames) - 1]))] + 1
+    return [(int(s) * samples_per_frame, int(e) * samples_per_frame) for s, e in zip(starts, ends)]
+
+def read_samples(wav, first, last):
+    """Samples [first, last) at SAMPLE_RATE as float32, zero outside the file"""
+    out = np.zeros(max(0, last - first), dtype=np.float32)
+    if wav.rate == SAMPLE_RATE:
+        lo, hi = max(first, 0), min(last, len(wav.samples))
+        if hi > lo:
+            block = wav.samples[lo:hi]
+            block = block.mean(axis=1) if wav.channels > 1 else block[:, 0]
+            out[lo - first:hi - first] = block * wav.scale
+        return out
+    # Other rates go through WavMap's resampler with a margin for the filter edges
+    margin = SAMPLE_RATE // 100
+    lo = max(first - margin, 0)
+    audio = wav.segment(lo / SAMPLE_RATE, (last + margin) / SAMPLE_RATE)[first - lo:last - lo]
+    out[:len(audio)] = audio
+    return out
+
+def decimate(audio, factor):
+    if factor <= 1:
+        return audio
+    decimator = PolyphaseDecimator(factor)
+    return np.concatenate((decimator.process(audio), decimator.flush()))
+
+def correlate(reference, search):
+    """Normalized cross-correlation of `reference` at every lag within `search`
+
+    Computed with one real FFT product; the sliding energy of `search`
+    comes from a cumulative sum. Returns (best lag, peak value, fractional
+    lag refined by a parabola through the peak).
+    """
+    m, n = len(reference), len(search)
+    if m == 0 or n < m:
+        return 0, 0.0, 0.0
+    size = 1 << (n + m - 1).bit_length()
+    spectrum = np.fft.rfft(search, size) * np.conj(np.fft.rfft(reference, size))
+    corr = np.fft.irfft(spectrum, size)[:n - m + 1]
+    energy = np.concatenate(([0.0], np.cumsum(np.square(search, dtype=np.float64))))
+    window_energy = energy[m:] - energy[:-m]
+    denom = np.sqrt(np.maximum(window_energy, 0) * np.dot(reference, reference))
+    ncc = corr / np.maximum(denom, 1e-12)
+    lag = int(np.argmax(ncc))
+    fraction = 0.0
+    if 0 < lag < len(ncc) - 1:
+        left, mid, right = ncc[lag - 1:lag + 2]
+        curvature = left - 2 * mid + right
+        if curvature < 0:
+            fraction = float(np.clip(0.5 * (left - right) / curvature, -0.5, 0.5))
+    return lag, float(ncc[lag]), lag + fraction
+
+def fractional_shift(audio, shift, margin):
+    """Advance `audio` by a fraction of a sample with a linear-phase FFT shift
+
+    `margin` samples at both ends absorb the circular wrap and are cut off.
+    """
+    if not shift:
+        return audio[margin:len(audio) - margin]
+    size = len(audio)
+    spectrum = np.fft.rfft(audio) * np.exp(2j * np.pi * np.fft.rfftfreq(size) * shift)
+    return np.fft.irfft(spectrum, size)[margin:size - margin].astype(np.float32)
+
+class Alignment:
+    """Mapping from BLE sample index to SD sample index
+
+    `centers` and `offsets` are the inlier windows (both in samples at
+    SAMPLE_RATE). Between windows the offset is interpolated, so slow
+    drift and isolated timeline jumps are both followed; outside them the
+    drift fit extrapolates.
+    """
+
+    def __init__(self, centers, offsets, scores, gain, offset, drift):
+        self.centers = centers
+        self.offsets = offsets
+        self.scores = scores
+        self.gain = gain          # SD -> BLE level
+        self.offset = offset      # SD index of BLE sample 0 from the fit
+        self.drift = drift        # Extra SD samples per BLE sample
+
+    def offset_at(self, index):
+        index = np.asarray(index, dtype=np.float64)
+        inside = np.interp(index, self.centers, self.offsets)
+        before = index < self.centers[0]
+        after = index > self.centers[-1]
+        inside = np.where(before, self.offsets[0] + (index - self.centers[0]) * self.drift, inside)
+        inside = np.where(after, self.offsets[-1] + (index - self.centers[-1]) * self.drift, inside)
+        return inside
+
+def fit_drift(centers, offsets, weights, max_residual=MAX_RESIDUAL * SAMPLE_RATE):
+    """Weighted line fit of offset against time, dropping outlier windows"""
+    inliers = np.ones(len(centers), dtype=bool)
+    slope, intercept = 0.0, float(np.median(offsets))
+    for _ in range(3):
+        if inliers.sum() >= 2:
+            slope, intercept = np.polyfit(centers[inliers], offsets[inliers], 1, w=weights[inliers])
+        residual = np.abs(offsets - (intercept + slope * centers))
+        spread = 3 * np.median(residual[inliers]) if inliers.any() else 0.0
+        inliers = residual <= max(max_residual, spread)
+    # Windows inconsistent with their neighbours are left out of the mapping too
+    return float(intercept), float(slope), inliers
+
+def estimate_alignment(ble, sd, window=WINDOW, hop=HOP, max_offset=MAX_OFFSET, search=SEARCH,
+                       gaps=()):
+    """Measure the SD offset of BLE windows by coarse-then-fine cross-correlation"""
+    factor = max(1, SAMPLE_RATE // COARSE_RATE)
+    length = int(window * SAMPLE_RATE)
+    fine = int(FINE_WINDOW * SAMPLE_RATE)
+    total = int(ble.duration * SAMPLE_RATE)
+    gap_starts = np.array([start for start, _ in gaps], dtype=np.int64)
+    centers, offsets, scores, gains = [], [], [], []
+    predicted = None
+    for start in range(0, max(total - length, 0) + 1, int(hop * SAMPLE_RATE)):
+        reference = read_samples(ble, start, start + length)
+        if np.sqrt(np.mean(np.square(reference))) < MIN_RMS:
+            continue
+        # Windows that are mostly fill say little about the offset
+        if filled_samples(gaps, gap_starts, start, start + length) > length // 2:
+            continue
+        result = None
+        for reach in ((search, max_offset) if predicted is not None else (max_offset,)):
+            guess = start if predicted is None else start + predicted
+            lo = max(0, guess - int(reach * SAMPLE_RATE))
+            candidate = read_samples(sd, lo, guess + length + int(reach * SAMPLE_RATE))
+            lag, score, _ = correlate(decimate(reference, factor), decimate(candidate, factor))
+            if score >= MIN_CORRELATION:
+                result = lo + lag * factor - start
+                break
+        if result is None:
+            continue
+        # Refine at the full rate on the middle of the window
+        mid = start + (length - fine) // 2
+        reference = read_samples(ble, mid, mid + fine)
+        lo = mid + result - 2 * factor
+        candidate = read_samples(sd, lo, mid + result + fine + 2 * factor)
+        lag, score, exact = correlate(reference, candidate)
+        if score < MIN_CORRELATION:
+            continue
+        # Level ratio over the samples that actually arrived
+        matched = candidate[lag:lag + fine]
+        received = reference != 0
+        power = float(np.dot(matched[received], matched[received]))
+        centers.append(start + length // 2)
+        offsets.append(lo + exact - mid)
+        scores.append(score)
+        gains.append(float(np.dot(reference[received], matched[received])) / power if power else 1.0)
+        predicted = lo + lag - mid
+    if not centers:
+        raise ValueError("Could not align the recordings (no window correlated)")
+    centers = np.array(centers, dtype=np.float64)
+    offsets = np.array(offsets, dtype=np.float64)
+    scores = np.array(scores)
+    intercept, slope, inliers = fit_drift(centers, offsets, scores)
+    return Alignment(centers[inliers], offsets[inliers], scores[inliers],
+                     float(np.median(np.array(gains)[inliers])), intercept, slope)
+
+def filled_samples(gaps, gap_starts, first, last):
+    """How many samples of sorted, disjoint `gaps` fall inside [first, last)"""
+    i = int(np.searchsorted(gap_starts, last))
+    total = 0
+    while i > 0:
+        i -= 1
+        start, end = gaps[i]
+        if end <= first:
+            break
+        total += min(end, last) - max(start, first)
+    return total
+
+def merge_close(gaps, distance=2 * XFADE):
+    """Join gaps so close that their crossfades would overlap"""
+    merged = []
+    for start, end in sorted(gaps):
+        if merged and start - merged[-1][1] < distance:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def crossfade_weights(length, before, after, xfade=XFADE):
+    """1 inside the gap, ramping over `before`/`after` samples at the edges"""
+    weights = np.ones(length, dtype=np.float32)
+    if before:
+        weights[:before] = (np.arange(before, dtype=np.float32) + 1) / (before + 1)
+    if after:
+        weights[length - after:] = (np.arange(after, 0, -1, dtype=np.float32)) / (after + 1)
+    return weights
+
+def repair(ble_path, sd_path, output=None, gaps=None, extend=True):
+    """Write one gap-free recording from a session's BLE and SD captures
+
+    The BLE audio is kept wherever it arrived; frames the receiver filled
+    in are replaced with the aligned, level-matched SD audio, crossfaded
+    over XFADE samples at each edge. With `extend`, SD audio from before
+    the first and after the last BLE frame is added too. Returns a report.
+    """
+    started = time.perf_counter()
+    ble, sd = WavMap(ble_path), WavMap(sd_path)
+    if ble.rate != SAMPLE_RATE:
+        raise ValueError(f"{ble_path} must be {SAMPLE_RATE} Hz")
+    if gaps is None:
+        gaps = read_gap_map(ble_path)
+    if gaps is None:
+        gaps = detect_gaps(ble)
+    alignment = estimate_alignment(ble, sd, gaps=gaps)
+    total = len(ble.samples)
+    sd_total = int(round(sd.duration * SAMPLE_RATE))
+
+    patches, repaired, unrepaired = [], 0, 0
+    for start, end in merge_close(gaps):
+        start, end = max(start, 0), min(end, total)
+        if end <= start:
+            continue
+        first, last = max(start - XFADE, 0), min(end + XFADE, total)
+        exact = float(alignment.offset_at((start + end) // 2))
+        offset = int(np.floor(exact))
+        if first + offset < 0 or last + offset + 1 > sd_total:
+            unrepaired += end - start
+            continue
+        source = read_samples(sd, first + offset - XFADE, last + offset + XFADE)
+        source = fractional_shift(source, exact - offset, XFADE) * alignment.gain
+        weights = crossfade_weights(last - first, start - first, last - end)
+        patches.append((first, last, source, weights))
+        repaired += end - start
+
+    if output is None:
+        name = os.path.basename(ble_path).replace("ble_recording", MERGED_PREFIX, 1)
+        output = os.path.join(os.path.dirname(ble_path), name)
+    head = tail = 0
+    with StreamingWavWriter(output, SAMPLE_RATE) as writer:
+        if extend:
+            head = max(0, int(round(float(alignment.offset_at(0)))))
+            for lo in range(0, head, BLOCK):
+                hi = min(lo + BLOCK, head)
+                writer.write(to_int16(read_samples(sd, lo, hi) * alignment.gain * 32768).tobytes())
+        patch = 0
+        for lo in range(0, total, BLOCK):
+            hi = min(lo + BLOCK, total)
+            block = np.asarray(ble.samples[lo:hi, 0]).astype(np.float32)
+            while patch < len(patches) and patches[patch][1] <= lo:
+                patch += 1
+            for first, last, source, weights in patches[patch:]:
+                if first >= hi:
+                    break
+                a, b = max(first, lo), min(last, hi)
+                w = weights[a - first:b - first]
+                block[a - lo:b - lo] = (block[a - lo:b - lo] * (1 - w)
+                                        + source[a - first:b - first] * w * 32768)
+            writer.write(to_int16(block).tobytes())
+        if extend:
+            tail_start = total + int(round(float(alignment.offset_at(total))))
+            tail = max(0, sd_total - tail_start)
+            for lo in range(tail_start, sd_total, BLOCK):
+                hi = min(lo + BLOCK, sd_total)
+                writer.write(to_int16(read_samples(sd, lo, hi) * alignment.gain * 32768).tobytes())
+    elapsed = time.perf_counter() - started
+    return {
+        'output': output,
+        'offset_seconds': alignment.offset / SAMPLE_RATE,
+        'drift_ppm': alignment.drift * 1e6,
+        'windows': len(alignment.centers),
+        'correlation': float(np.median(alignment.scores)),
+        'gain': alignment.gain,
+        'repaired_frames': repaired // SAMPLES_PER_FRAME,
+        'unrepaired_frames': unrepaired // SAMPLES_PER_FRAME,
+        'head_seconds': head / SAMPLE_RATE,
+        'tail_seconds': tail / SAMPLE_RATE,
+        'audio_seconds': ble.duration,
+        'elapsed_seconds': elapsed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Align a BLE recording with its SD card copy and fill its gaps")
+    parser.add_argument('ble', help="16 kHz BLE recording (ble_recording_*.wav)")
+    parser.add_argument('sd', help="SD card recording of the same session")
+    parser.add_argument('-o', '--output', help="Merged output (default merged_recording_*.wav)")
+    parser.add_argument('--no-extend', action='store_true',
+                        help="Do not add SD audio from before/after the BLE stream")
+    args = parser.parse_args()
+    report = repair(args.ble, args.sd, args.output, extend=not args.no_extend)
+    print(f"Wrote {report['output']}")
+    print(f"Offset {report['offset_seconds']:.4f}s, drift {report['drift_ppm']:.1f} ppm "
+          f"({report['windows']} windows, median correlation {report['correlation']:.2f})")
+    print(f"Repaired {report['repaired_frames']:.0f} frames, {report['unrepaired_frames']:.0f} not covered by SD; "
+          f"{report['audio_seconds'] / report['elapsed_seconds']:.0f}x real time")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import fnmatch
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from catalog import CATALOG_FILE, Catalog
+from longaudio import WavMap, soundfile_module
+from wavsink import needs_recovery
+
+ARCHIVE_FORMAT = "flac"   # "flac" (lossless) or "opus" (lossy, several times smaller again)
+FORMATS = {               # Extension, libsndfile container and subtype
+    'flac': ('.flac', 'FLAC', 'PCM_16'),
+    'opus': ('.opus', 'OGG', 'OPUS'),
+}
+COMPRESSION_LEVEL = None  # libsndfile level from 0 to 1 (for Opus, lower means a higher bitrate); None keeps its default
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+MIN_OPUS_SNR_DB = 6.0     # Opus is not sample-exact, but a broken or shifted stream scores 0 dB or below
+WORKERS = 2               # Files transcoded at once
+BLOCK = 60.0              # Seconds transcoded and verified at a time
+MIN_AGE = 60.0            # Seconds since a file last changed before the CLI treats it as finished
+PATTERNS = ("ble_recording_*.wav", "sdcard_recording_*.wav", "merged_recording_*.wav")
+PARTIAL_SUFFIX = ".part"  # Archive being written; renamed over once verified
+
+ARCHIVED = metrics.counter('archive_files_total', "Recordings transcoded, by format and result")
+BYTES_SAVED = metrics.counter('archive_bytes_saved_total', "WAV bytes freed by archiving, net of the archives")
+
+class ArchiveError(Exception):
+    """Raised when a recording cannot be archived or its archive fails verification"""
+
+def archive_path(path, fmt=ARCHIVE_FORMAT):
+    return os.path.splitext(path)[0] + FORMATS[fmt][0]
+
+def transcode(wav, target, fmt, level=COMPRESSION_LEVEL, block=BLOCK):
+    """Encode a WavMap block by block, so memory stays flat for long files"""
+    _, container, subtype = FORMATS[fmt]
+    options = {} if level is None else {'compression_level': level}
+    step = int(block * wav.rate)
+    with soundfile_module().SoundFile(target, 'w', wav.rate, wav.channels, subtype, format=container,
+                                      **options) as out:
+        for first in range(0, len(wav.samples), step):
+            out.write(np.asarray(wav.samples[first:first + step]))
+
+def verify(wav, target, fmt, block=BLOCK):
+    """Decode the archive against the WAV; returns the SNR in dB (inf when exact)
+
+    FLAC must match sample for sample. Opus must have the same length and
+    come within MIN_OPUS_SNR_DB of the original waveform.
+    """
+    step = int(block * wav.rate)
+    signal = error = 0.0
+    with soundfile_module().SoundFile(target) as f:
+        if (f.frames, f.samplerate, f.channels) != (len(wav.samples), wav.rate, wav.channels):
+            raise ArchiveError(f"{target} holds {f.frames} frames at {f.samplerate} Hz, "
+                               f"expected {len(wav.samples)} at {wav.rate} Hz")
+        for first in range(0, len(wav.samples), step):
+            original = np.asarray(wav.samples[first:first + step])
+            decoded = f.read(len(original), dtype='int16', always_2d=True)
+            if fmt == 'flac':
+                if not np.array_equal(original, decoded):
+                    raise ArchiveError(f"{target} differs from the WAV near {first / wav.rate:.0f}s")
+                continue
+            original = original.astype(np.float64)
+            signal += float(np.einsum('ij,ij->', original, original))
+            difference = original - decoded
+            error += float(np.einsum('ij,ij->', difference, difference))
+    if not error:
+        return float('inf')
+    snr = 10 * np.log10(max(signal, 1.0) / error)
+    if snr < MIN_OPUS_SNR_DB:
+        raise ArchiveError(f"{target} decodes at {snr:.1f} dB SNR, below {MIN_OPUS_SNR_DB} dB")
+    return snr
+
+def archive_file(path, fmt=ARCHIVE_FORMAT, level=COMPRESSION_LEVEL, catalog=None, block=BLOCK):
+    """Transcode a finished WAV, verify the archive and replace the WAV with it; returns a report
+
+    The archive keeps the WAV's modification time, so comparisons such as
+    "is the transcript newer than the recording" still hold. A catalog
+    has its references to the WAV moved to the archive.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown archive format {fmt!r}; choose from {', '.join(FORMATS)}")
+    started = time.perf_counter()
+    wav = WavMap(path)
+    if wav.scale != 1 / 32768.0:
+        raise ArchiveError(f"{path} is not 16-bit PCM")
+    if fmt == 'opus' and wav.rate not in OPUS_RATES:
+        raise ArchiveError(f"Opus cannot store {wav.rate} Hz audio ({path})")
+    duration = wav.duration
+    target = archive_path(path, fmt)
+    partial = target + PARTIAL_SUFFIX
+    try:
+        transcode(wav, partial, fmt, level, block)
+        snr = verify(wav, partial, fmt, block)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        del wav  # Unmap before the WAV is removed
+
+    stat = os.stat(path)
+    os.utime(partial, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(partial, target)
+    if catalog is not None:
+        catalog.move_file(path, target)
+    os.remove(path)
+    size = os.path.getsize(target)
+    ARCHIVED.inc(format=fmt, result="ok")
+    BYTES_SAVED.inc(stat.st_size - size)
+    return {
+        'path': target,
+        'wav_bytes': stat.st_size,
+        'archive_bytes': size,
+        'snr_db': snr,
+        'audio_seconds': duration,
+        'elapsed_seconds': time.perf_counter() - started
+    }
+
+class Archiver:
+    """Transcodes finished recordings on a bounded thread pool
+
+    libsndfile releases the GIL while it encodes and decodes, so threads
+    run in parallel without shipping audio to worker processes. A path is
+    queued at most once at a time; failures leave the WAV in place.
+    """
+
+    def __init__(self, fmt=ARCHIVE_FORMAT, workers=WORKERS, level=COMPRESSION_LEVEL):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown archive format {fmt!r}; choose from {', '.join(FORMATS)}")
+        soundfile_module()  # Fail now rather than on every file
+        self.fmt = fmt
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archive")
+        self.lock = threading.Lock()
+        self.queued = set()
+
+    def submit(self, path, catalog=None):
+        """Queue a finished WAV; returns a Future for its report, or None if it is already queued"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if path in self.queued:
+                return None
+            self.queued.add(path)
+        return self.pool.submit(self.run, path, catalog)
+
+    def run(self, path, catalog):
+        try:
+            report = archive_file(path, self.fmt, self.level, catalog)
+        except Exception as e:
+            ARCHIVED.inc(format=self.fmt, result="error")
+            print(f"Could not archive {path}: {e}")
+            raise
+        finally:
+            with self.lock:
+                self.queued.discard(path)
+        print(f"Archived {os.path.basename(path)} as {report['path']} "
+              f"({report['wav_bytes'] / 2**20:.1f} MB -> {report['archive_bytes'] / 2**20:.1f} MB)")
+        return report
+
+    def shutdown(self, wait=True):
+        """Finish the files being transcoded; queued ones are left for the next run"""
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+def finished_recordings(directory, min_age=MIN_AGE):
+    """WAV recordings in directory that have not changed for min_age seconds"""
+    now = time.time()
+    found = []
+    for name in sorted(os.listdir(directory)):
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in PATTERNS):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) < min_age or needs_recovery(path):
+                continue
+        except OSError:
+            continue
+        found.append(path)
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Replace finished WAV recordings with verified FLAC or Opus archives")
+    parser.add_argument('directory', nargs='?', default=".")
+    parser.add_argument('--format', default=ARCHIVE_FORMAT, choices=sorted(FORMATS))
+    parser.add_argument('--level', type=float, default=COMPRESSION_LEVEL,
+                        help="Compression level from 0 to 1 (default: libsndfile's)")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--min-age', type=float, default=MIN_AGE,
+                        help="Seconds a file must be unchanged to count as finished")
+    parser.add_argument('--catalog', help=f"Catalog to update (default: {CATALOG_FILE} in the directory, if any)")
+    parser.add_argument('--dry-run', action='store_true', help="List what would be archived")
+    args = parser.parse_args()
+
+    paths = finished_recordings(args.directory, args.min_age)
+    if args.dry_run:
+        for path in paths:
+            print(path)
+        return
+    catalog = None
+    catalog_file = args.catalog or os.path.join(args.directory, CATALOG_FILE)
+    if args.catalog or os.path.exists(catalog_file):
+        catalog = Catalog(catalog_file)
+    archiver = Archiver(args.format, args.workers, args.level)
+    started = time.perf_counter()
+    futures = [archiver.submit(path, catalog) for path in paths]
+    reports = []
+    for future in futures:
+        try:
+            reports.append(future.result())
+        except Exception:
+            pass  # Already reported; the WAV stays
+    archiver.shutdown()
+    if catalog is not None:
+        catalog.close()
+    before = sum(report['wav_bytes'] for report in reports)
+    after = sum(report['archive_bytes'] for report in reports)
+    audio = sum(report['audio_seconds'] for report in reports)
+    print(f"Archived {len(reports)}/{len(paths)} recordings: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB, "
+          f"{audio / max(time.perf_counter() - started, 1e-9):.0f}x real time")
+
+if __name__ == "__main__":
+    main()
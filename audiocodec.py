@@ -0,0 +1,178 @@
+import numpy as np
+
+# Codec ids carried in the third header byte of every BLE notification
+CODEC_PCM16 = 0
+CODEC_MULAW = 1
+CODEC_IMA_ADPCM = 2
+CODEC_OPUS = 3
+CODECS = {'pcm16': CODEC_PCM16, 'mulaw': CODEC_MULAW, 'adpcm': CODEC_IMA_ADPCM, 'opus': CODEC_OPUS}
+
+ADPCM_HEADER_SIZE = 4     # predictor (int16 LE), step index, reserved
+OPUS_SAMPLE_RATE = 16000
+
+class CodecError(Exception):
+    """Raised when a codec is unknown or its decoder is unavailable"""
+
+def payload_size(codec, samples_per_frame):
+    """Bytes of payload per frame, or None for variable-size codecs"""
+    if codec == CODEC_PCM16:
+        return samples_per_frame * 2
+    if codec == CODEC_MULAW:
+        return samples_per_frame
+    if codec == CODEC_IMA_ADPCM:
+        return ADPCM_HEADER_SIZE + samples_per_frame // 2
+    if codec == CODEC_OPUS:
+        return None
+    raise CodecError(f"Unknown codec {codec}")
+
+# --- G.711 mu-law -----------------------------------------------------------
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+def build_mulaw_table():
+    code = ~np.arange(256) & 0xFF
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    magnitude = (((mantissa << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return np.where(code & 0x80, -magnitude, magnitude).astype(np.int16)
+
+MULAW_TABLE = build_mulaw_table()
+
+def mulaw_decode(payload):
+    """uint8 mu-law bytes (any shape) to int16 PCM via one table lookup"""
+    return MULAW_TABLE[payload]
+
+def mulaw_encode(pcm):
+    """int16 PCM to mu-law bytes, vectorized"""
+    pcm = np.asarray(pcm, dtype=np.int32)
+    sign = (pcm < 0).astype(np.int32) << 7
+    magnitude = np.minimum(np.abs(pcm), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.clip(np.floor(np.log2(magnitude)).astype(np.int32) - 7, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+# --- IMA-ADPCM --------------------------------------------------------------
+
+ADPCM_STEPS = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+], dtype=np.int32)
+ADPCM_INDEX_SHIFT = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+def build_adpcm_tables():
+    """Per (step index, nibble) lookups for the signed delta and the next index"""
+    step = ADPCM_STEPS[:, None]
+    code = np.arange(16)[None, :]
+    delta = step >> 3
+    delta = delta + np.where(code & 1, step >> 2, 0)
+    delta = delta + np.where(code & 2, step >> 1, 0)
+    delta = delta + np.where(code & 4, step, 0)
+    delta = np.where(code & 8, -delta, delta).astype(np.int32)
+    next_index = np.clip(np.arange(len(ADPCM_STEPS))[:, None] + ADPCM_INDEX_SHIFT[None, :],
+                         0, len(ADPCM_STEPS) - 1).astype(np.int32)
+    return delta, next_index
+
+ADPCM_DELTA, ADPCM_NEXT_INDEX = build_adpcm_tables()
+
+def adpcm_decode(payload, samples_per_frame):
+    """Decode (frames, 4 + samples/2) IMA-ADPCM payloads to (frames, samples) int16
+
+    Every frame carries its own predictor and step index, so frames decode
+    independently and a lost frame never corrupts the next one. The sample
+    recurrence is serial, so the loop runs over sample positions with all
+    frames of the batch advanced together.
+    """
+    payload = np.asarray(payload, dtype=np.uint8)
+    predictor = (payload[:, 0].astype(np.int32) | (payload[:, 1].astype(np.int32) << 8))
+    predictor = np.where(predictor >= 0x8000, predictor - 0x10000, predictor)
+    index = np.minimum(payload[:, 2].astype(np.int32), len(ADPCM_STEPS) - 1)
+    data = payload[:, ADPCM_HEADER_SIZE:ADPCM_HEADER_SIZE + samples_per_frame // 2]
+    nibbles = np.empty((len(payload), samples_per_frame), dtype=np.int32)
+    nibbles[:, 0::2] = data & 0x0F   # Low nibble first, as in IMA WAV
+    nibbles[:, 1::2] = data >> 4
+    out = np.empty((len(payload), samples_per_frame), dtype=np.int16)
+    for i in range(samples_per_frame):
+        code = nibbles[:, i]
+        predictor = np.clip(predictor + ADPCM_DELTA[index, code], -32768, 32767)
+        index = ADPCM_NEXT_INDEX[index, code]
+        out[:, i] = predictor
+    return out
+
+class AdpcmEncoder:
+    """IMA-ADPCM frame encoder matching the firmware; state carries across frames"""
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, pcm):
+        pcm = np.asarray(pcm, dtype=np.int32)
+        header = np.array([self.predictor & 0xFF, (self.predictor >> 8) & 0xFF, self.index, 0],
+                          dtype=np.uint8)
+        codes = np.empty(len(pcm), dtype=np.uint8)
+        for i, sample in enumerate(pcm.tolist()):
+            step = int(ADPCM_STEPS[self.index])
+            diff = sample - self.predictor
+            code = 8 if diff < 0 else 0
+            diff = abs(diff)
+            for bit in (4, 2, 1):
+                if diff >= step:
+                    code |= bit
+                    diff -= step
+                step >>= 1
+            self.predictor = int(np.clip(self.predictor + ADPCM_DELTA[self.index, code], -32768, 32767))
+            self.index = int(ADPCM_NEXT_INDEX[self.index, code])
+            codes[i] = code
+        packed = codes[0::2] | (codes[1::2] << 4)
+        return np.concatenate((header, packed)).tobytes()
+
+# --- Opus (optional) --------------------------------------------------------
+
+class OpusFrameDecoder:
+    """Stateful Opus decoder for one stream; needs the opuslib package"""
+
+    def __init__(self, samples_per_frame, sample_rate=OPUS_SAMPLE_RATE):
+        try:
+            import opuslib
+        except ImportError:
+            raise CodecError("Opus frames need the opuslib package (pip install opuslib)")
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+        self.error = opuslib.OpusError
+        self.samples_per_frame = samples_per_frame
+
+    def decode(self, packet):
+        """Decode one packet; returns None if it is corrupt"""
+        if not len(packet):
+            return None
+        try:
+            data = self.decoder.decode(bytes(packet), self.samples_per_frame)
+        except self.error:
+            return None
+        pcm = np.frombuffer(data, dtype='<i2')
+        out = np.zeros(self.samples_per_frame, dtype=np.int16)
+        out[:min(len(pcm), self.samples_per_frame)] = pcm[:self.samples_per_frame]
+        return out
+
+# --- Frame fixtures ---------------------------------------------------------
+
+def encode_frame(count, pcm, codec=CODEC_PCM16, adpcm=None):
+    """Build a BLE notification the way the firmware does
+
+    `adpcm` is an AdpcmEncoder holding the stream's state; a fresh one is
+    used when omitted. Opus is receive-only here.
+    """
+    header = bytes((count & 0xFF, (count >> 8) & 0xFF, codec))
+    pcm = np.asarray(pcm, dtype=np.int16)
+    if codec == CODEC_PCM16:
+        return header + pcm.astype('<i2').tobytes()
+    if codec == CODEC_MULAW:
+        return header + mulaw_encode(pcm).tobytes()
+    if codec == CODEC_IMA_ADPCM:
+        return header + (adpcm or AdpcmEncoder()).encode(pcm)
+    raise CodecError(f"No encoder for codec {codec}")
@@ -0,0 +1,692 @@
+import argparse
+import asyncio
+import contextlib
+import functools
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from audiocodec import CODECS, CODEC_OPUS
+from fake_ble import (FakeBleakClient, FakeBleakScanner, FakeUnit, impair, synthetic_frames, synthetic_pcm,
+                      wav_frames)
+from framedecoder import SAMPLES_PER_FRAME
+from wavsink import StreamingWavWriter
+
+BASELINE_FILE = "bench_baseline.json"
+TOLERANCE = 0.10          # Relative change against the baseline that counts as a regression
+REPEATS = 3               # Unthrottled replays per run; the fastest one is reported
+PARTS = ('startup', 'ingest', 'reconnect', 'codecs', 'download', 'align', 'vad', 'diarize', 'whisper')
+# The whisper part runs real models on a reference clip, so it is only run when asked for
+DEFAULT_PARTS = tuple(part for part in PARTS if part != 'whisper')
+VAD_STUB_RTF = 0.1        # Whisper cost assumed by the vad part when --stub-rtf is 0
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+STARTUP_COMMANDS = {       # Metric: arguments timed by the startup part
+    'startup_help_ms': (CLI, '--help'),
+    'startup_ingest_ms': (CLI, 'ingest', '--help'),
+    'startup_download_ms': (CLI, 'download', '--help'),
+    'startup_transcribe_ms': (CLI, 'transcribe', '--help'),
+    # Everything ingest imports before it starts scanning, metrics endpoint included
+    'startup_ingest_imports_ms': ('-c', 'import bluetooth, bleak, aiohttp.web'),
+}
+# Slow imports that only the code paths needing them may pay for
+HEAVY_MODULES = ('torch', 'whisper', 'pyannote.audio', 'bleak', 'aiohttp', 'requests', 'soundfile')
+
+# Direction of improvement for every metric that is compared against the baseline
+HIGHER_IS_BETTER = {
+    'startup_help_ms': False,
+    'startup_ingest_ms': False,
+    'startup_download_ms': False,
+    'startup_transcribe_ms': False,
+    'startup_ingest_imports_ms': False,
+    'ingest_frames_per_sec': True,
+    'ingest_cpu_per_stream': False,
+    'ingest_latency_p50_ms': False,
+    'ingest_latency_p95_ms': False,
+    'reconnect_scan_first_frame_ms': False,
+    'reconnect_known_first_frame_ms': False,
+    'reconnect_resume_ms': False,
+    'reconnect_coverage': True,
+    'codec_pcm16_cpu_per_stream': False,
+    'codec_mulaw_cpu_per_stream': False,
+    'codec_adpcm_cpu_per_stream': False,
+    'codec_opus_cpu_per_stream': False,
+    'download_mbps': True,
+    'align_x_realtime': True,
+    'align_gap_snr_db': True,
+    'vad_x_realtime': True,
+    'vad_speech_recall': True,
+    'vad_off_rtf': False,
+    'vad_on_rtf': False,
+    'diarize_x_realtime': True,
+    'diarize_rerun_x_realtime': True,
+    'diarize_grown_x_realtime': True,
+    'whisper_float32_rtf': False,
+    'whisper_int8_rtf': False,
+    'whisper_float32_wer': False,
+    'whisper_int8_wer': False,
+    'whisper_int8_speedup': True
+}
+
+Segment = namedtuple('Segment', 'start end')
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """Silence the per-frame and per-chunk prints of the code under test"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def write_test_wav(path, seconds, sample_rate, seed=0):
+    """Write a noisy tone WAV to serve or diarize"""
+    rng = np.random.default_rng(seed)
+    with StreamingWavWriter(path, sample_rate) as writer:
+        block = sample_rate * 10
+        for start in range(0, int(seconds * sample_rate), block):
+            t = (start + np.arange(block)) / sample_rate
+            pcm = 6000 * np.sin(2 * np.pi * 220 * t) + rng.normal(0, 300, block)
+            writer.write(np.clip(pcm, -32768, 32767).astype('<i2').tobytes())
+    return path
+
+class LatencyProbe:
+    """PCM consumer timing each block from capture on the device to delivery"""
+
+    def __init__(self, client, latencies, samples_per_frame=SAMPLES_PER_FRAME):
+        self.client = client
+        self.latencies = latencies
+        self.samples_per_frame = samples_per_frame
+        self.samples = 0
+
+    def __call__(self, pcm):
+        self.samples += len(pcm)
+        newest = (self.samples - 1) // self.samples_per_frame
+        self.latencies.append(time.perf_counter() - self.client.due_time(newest))
+
+async def replay_streams(frames, streams, rate, loss, reorder, jitter, output_dir, seed=0):
+    """Replay `frames` into one AudioStreamReceiver per stream; returns timings"""
+    import bluetooth
+    from netcontrol import FakeBackend
+
+    receivers, clients, latencies = [], [], []
+    for n in range(streams):
+        receiver = bluetooth.AudioStreamReceiver(address=f"FA:KE:00:00:00:{n:02X}",
+                                                 output_dir=output_dir,
+                                                 network_backend=FakeBackend())
+        schedule = impair(frames, loss, reorder, jitter=jitter, seed=seed + n)
+        client = FakeBleakClient(receiver.address, schedule, rate=rate)
+        receiver.pcm_consumers.append(LatencyProbe(client, latencies))
+        receivers.append(receiver)
+        clients.append(client)
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    for receiver, client in zip(receivers, clients):
+        await client.connect()
+        await client.start_notify(bluetooth.CHARACTERISTIC_UUID, receiver.notification_handler)
+    await asyncio.gather(*(client.finished.wait() for client in clients))
+    for receiver in receivers:
+        receiver.save_wav_file()
+    # Count the writer thread's disk work too
+    await asyncio.get_running_loop().run_in_executor(None, bluetooth.get_disk_writer().join)
+    return {
+        'frames': sum(client.sent for client in clients),
+        'wall': time.perf_counter() - wall,
+        'cpu': time.process_time() - cpu,
+        'latencies': latencies,
+        'drops': sum(receiver.frame_stats['drops'] for receiver in receivers)
+    }
+
+async def bench_ingest(args, workdir):
+    codec = CODECS[args.codec]
+    frames = wav_frames(args.replay, codec=codec) if args.replay else synthetic_frames(args.seconds, codec=codec)
+    impairments = (args.loss, args.reorder, args.jitter)
+    with quiet(args.verbose):
+        # Warm-up so first-call costs don't land in the measurement
+        await replay_streams(frames[:500], 1, 0, *impairments, workdir)
+        # Unthrottled: how many frames per second the ingest path can absorb
+        runs = [await replay_streams(frames, args.streams, 0, *impairments, workdir)
+                for _ in range(REPEATS)]
+        frames_per_sec = max(run['frames'] / run['wall'] for run in runs)
+        # Real time: what each live stream costs and how late its audio lands
+        live = await replay_streams(frames, args.streams, 1.0, *impairments, workdir)
+    latencies = np.array(live['latencies']) * 1000
+    return {
+        'ingest_frames_per_sec': frames_per_sec,
+        'ingest_cpu_per_stream': live['cpu'] / live['wall'] / args.streams,
+        'ingest_latency_p50_ms': float(np.percentile(latencies, 50)),
+        'ingest_latency_p95_ms': float(np.percentile(latencies, 95)),
+        'ingest_filled_frames': live['drops']
+    }
+
+async def run_unit(unit, output_dir, done, timeout=60.0):
+    """Run an IngestManager against one FakeUnit until done(unit); returns (launch time, stats)"""
+    import bluetooth
+
+    launched = time.perf_counter()
+    manager = bluetooth.IngestManager(output_dir, client_class=unit.client,
+                                      scanner_class=functools.partial(FakeBleakScanner, units=[unit]))
+    scanner = await manager.start_ingest()
+    try:
+        deadline = launched + timeout
+        while not done(unit) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        stats = manager.devices[unit.device.address].receiver.stats_snapshot()
+    finally:
+        await manager.stop_ingest(scanner)
+    await asyncio.get_running_loop().run_in_executor(None, bluetooth.get_disk_writer().join)
+    return launched, stats
+
+def streamed(unit):
+    """The unit's connections that got as far as streaming"""
+    return [client for client in unit.clients if client.started_at]
+
+async def bench_reconnect(args, workdir):
+    """Launch to first frame with and without a remembered address, and one session across a dropped link"""
+    import bluetooth
+
+    frames = synthetic_frames(10)
+
+    def unit(connections):
+        return FakeUnit("FA:KE:00:00:01:00", frames, connections, service_uuids=[bluetooth.SERVICE_UUID],
+                        connect_delay=args.connect_delay, discover_delay=args.scan_delay)
+
+    known_dir = os.path.join(workdir, "reconnect_known")
+    drop_dir = os.path.join(workdir, "reconnect_drop")
+    os.makedirs(known_dir)
+    os.makedirs(drop_dir)
+    with quiet(args.verbose):
+        # First launch has to find the unit by scanning; it is remembered for the next one
+        first = unit([0.5])
+        launched, _ = await run_unit(first, known_dir, streamed)
+        scan_ms = (streamed(first)[0].started_at - launched) * 1000
+        second = unit([0.5])
+        launched, _ = await run_unit(second, known_dir, streamed)
+        known_ms = (streamed(second)[0].started_at - launched) * 1000
+        # The link drops mid-recording and comes back
+        dropped = unit([args.drop_after, args.drop_after])
+        _, stats = await run_unit(dropped, drop_dir,
+                                  lambda u: len(streamed(u)) == 2 and streamed(u)[-1].finished_at)
+    before, after = streamed(dropped)[:2]
+    recordings = glob.glob(os.path.join(drop_dir, "ble_recording_*.wav"))
+    with wave.open(recordings[0], 'rb') as f:
+        samples = f.getnframes()
+    spanned = (after.schedule[-1][1] + 1 - before.schedule[0][1]) * SAMPLES_PER_FRAME
+    return {
+        'reconnect_scan_first_frame_ms': scan_ms,
+        'reconnect_known_first_frame_ms': known_ms,
+        'reconnect_resume_ms': (after.started_at - before.finished_at) * 1000,
+        'reconnect_recordings': len(recordings),
+        'reconnect_resumes': stats['resumes'],
+        'reconnect_coverage': samples / spanned
+    }
+
+def opus_frames(seconds, samples_per_frame=SAMPLES_PER_FRAME, sample_rate=16000):
+    """Opus notifications, or None without opuslib (the firmware does not encode Opus)"""
+    try:
+        import opuslib
+    except ImportError:
+        return None
+    encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+    return [bytes((i & 0xFF, (i >> 8) & 0xFF, CODEC_OPUS)) + encoder.encode(block.tobytes(), samples_per_frame)
+            for i, block in enumerate(synthetic_pcm(seconds, samples_per_frame, sample_rate))]
+
+def bench_codecs(args, workdir):
+    """Decoder CPU per real-time stream for each payload codec"""
+    from framedecoder import FrameDecoder
+
+    results = {}
+    for name, codec in CODECS.items():
+        frames = opus_frames(args.seconds) if codec == CODEC_OPUS else synthetic_frames(args.seconds, codec=codec)
+        if frames is None:
+            print(f"Skipping {name}: no encoder available")
+            continue
+        best = float('inf')
+        for _ in range(REPEATS):
+            decoder = FrameDecoder()
+            start = time.process_time()
+            for packet in frames:
+                if decoder.push(packet):
+                    decoder.flush()
+            decoder.flush()
+            best = min(best, time.process_time() - start)
+        audio_seconds = len(frames) * SAMPLES_PER_FRAME / 16000
+        results[f'codec_{name}_cpu_per_stream'] = best / audio_seconds
+        results[f'codec_{name}_bytes_per_frame'] = sum(map(len, frames)) / len(frames)
+    return results
+
+async def bench_download(args, workdir):
+    from download import ResumableDownloader
+    from fake_esp32 import FakeESP32Server, serve
+    from resample import ResamplingWavSink
+
+    # The SD card records at 48 kHz; 192 KB per second of audio
+    source = write_test_wav(os.path.join(workdir, "sdcard.wav"), args.download_mb * 1e6 / 96000, 48000)
+    bandwidth = args.bandwidth_mbps * 1e6 / 8 if args.bandwidth_mbps else None
+    server = FakeESP32Server(source, args.drop_rate, bandwidth=bandwidth, seed=0)
+    runner = await serve(server, port=0)
+    port = runner.addresses[0][1]
+    output = os.path.join(workdir, "download.wav")
+    try:
+        downloader = ResumableDownloader(f"http://127.0.0.1:{port}/file", output + ".native",
+                                         sink=ResamplingWavSink(output))
+        with quiet(args.verbose):
+            start = time.perf_counter()
+            await downloader.run()
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    return {
+        'download_mbps': downloader.total_size * 8 / elapsed / 1e6,
+        'download_requests': server.requests,
+        'download_drops': server.drops
+    }
+
+class StubAnnotation:
+    def __init__(self, turns):
+        self.turns = turns
+
+    def itertracks(self, yield_label=False):
+        for start, end, label in self.turns:
+            yield Segment(start, end), None, label
+
+class StubPipeline:
+    """pyannote stand-in: alternating speakers, optionally costing `rtf` x audio time"""
+
+    def __init__(self, turn_seconds=4.0, speakers=2, rtf=0.0):
+        self.turn_seconds = turn_seconds
+        self.speakers = speakers
+        self.rtf = rtf
+
+    def __call__(self, audio):
+        if isinstance(audio, dict):
+            duration = audio['waveform'].shape[-1] / audio['sample_rate']
+        else:
+            from longaudio import WavMap
+            duration = WavMap(audio).duration
+        time.sleep(duration * self.rtf)
+        turns = []
+        for i, start in enumerate(np.arange(0.0, duration, self.turn_seconds)):
+            end = min(start + self.turn_seconds * 0.9, duration)
+            turns.append((float(start), float(end), f"SPEAKER_{i % self.speakers:02d}"))
+        return StubAnnotation(turns)
+
+class StubWhisper:
+    """Whisper model stand-in that only costs `rtf` x the segment length"""
+
+    def __init__(self, rtf=0.0, sample_rate=16000):
+        self.rtf = rtf
+        self.sample_rate = sample_rate
+
+    def transcribe(self, audio, **kwargs):
+        time.sleep(len(audio) / self.sample_rate * self.rtf)
+        return {'text': f" {len(audio)} samples"}
+
+def write_align_pair(workdir, seconds, offset=1.25, loss=0.05, seed=0, sample_rate=16000):
+    """SD recording plus a BLE copy starting `offset` s into it with lost frames zeroed
+
+    Returns (ble_path, sd_path, truth, lost) where truth is the BLE audio
+    before loss and lost marks the dropped frames. Noise bursts rather than
+    a tone, so the correlation peak is unambiguous.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    noise = rng.normal(0, 1, total + 8)
+    colored = np.convolve(noise, np.ones(8) / 8, mode='valid')[:total]
+    envelope = np.abs(np.sin(2 * np.pi * 3.3 * np.arange(total) / sample_rate))
+    envelope *= np.repeat(rng.random(total // sample_rate + 1) > 0.25, sample_rate)[:total]
+    sd = np.clip(colored * envelope * 8000, -32768, 32767).astype('<i2')
+    shift = int(offset * sample_rate)
+    truth = sd[shift:total - sample_rate]
+    truth = truth[:len(truth) // SAMPLES_PER_FRAME * SAMPLES_PER_FRAME]
+    lost = rng.random(len(truth) // SAMPLES_PER_FRAME) < loss
+    ble = truth.copy().reshape(-1, SAMPLES_PER_FRAME)
+    ble[lost] = 0
+    sd_path = os.path.join(workdir, "sdcard_recording_align.wav")
+    ble_path = os.path.join(workdir, "ble_recording_align.wav")
+    with StreamingWavWriter(sd_path, sample_rate) as writer:
+        writer.write(sd.tobytes())
+    with StreamingWavWriter(ble_path, sample_rate) as writer:
+        writer.write(ble.tobytes())
+    return ble_path, sd_path, truth, lost
+
+def synthetic_voice(samples, rng, sample_rate=16000):
+    """Unit-RMS voiced babble: syllables of a harmonic source shaped by two formants"""
+    out = np.zeros(samples, dtype=np.float32)
+    position = 0
+    while position < samples:
+        length = min(int(rng.uniform(0.12, 0.3) * sample_rate), samples - position)
+        f0, f1, f2 = rng.uniform(100, 240), rng.uniform(350, 850), rng.uniform(900, 2300)
+        harmonics = np.arange(1, int(4000 / f0))[:, None] * f0
+        gain = 1 / (1 + ((harmonics - f1) / 120) ** 2) + 0.5 / (1 + ((harmonics - f2) / 200) ** 2) + 0.02
+        t = np.arange(length) / sample_rate
+        phase = rng.uniform(0, 2 * np.pi, (len(harmonics), 1))
+        syllable = (gain * np.sin(2 * np.pi * harmonics * t + phase)).sum(axis=0)
+        out[position:position + length] = syllable * np.hanning(length)
+        position += length + int(rng.uniform(0.02, 0.08) * sample_rate)
+    return out / (np.sqrt(np.mean(out ** 2)) + 1e-9)
+
+def write_pocket_wav(path, seconds, speech_share=0.3, seed=0, sample_rate=16000):
+    """A pocket recording: hum and hiss, rustles, clicks, lost-frame gaps and some talk
+
+    Returns a boolean array marking the samples that hold speech.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    audio = rng.normal(0, 10 ** (-55 / 20), total).astype(np.float32)
+    audio += 10 ** (-40 / 20) * np.sin(2 * np.pi * 50 * np.arange(total) / sample_rate).astype(np.float32)
+    speech = np.zeros(total, dtype=bool)
+    position = int(rng.uniform(1, 5) * sample_rate)
+    while position < total:
+        if rng.random() < speech_share / (speech_share + 0.5):
+            length = min(int(rng.uniform(1, 6) * sample_rate), total - position)
+            level = 10 ** (rng.uniform(-30, -15) / 20)
+            audio[position:position + length] += level * synthetic_voice(length, rng, sample_rate)
+            speech[position:position + length] = True
+        else:
+            length = min(int(rng.uniform(2, 12) * sample_rate), total - position)
+            kind = rng.integers(3)
+            if kind == 0:
+                rustle = min(length, sample_rate // 2)
+                audio[position:position + rustle] += (rng.normal(0, 10 ** (-25 / 20), rustle)
+                                                      * np.hanning(rustle)).astype(np.float32)
+            elif kind == 1:
+                click = min(length, 80)
+                audio[position:position + click] += rng.normal(0, 0.5, click).astype(np.float32)
+            else:
+                audio[position:position + length] = 0
+        position += length + int(rng.uniform(0.3, 3) * sample_rate)
+    with StreamingWavWriter(path, sample_rate) as writer:
+        writer.write((np.clip(audio, -1, 1) * 32767).astype('<i2').tobytes())
+    return speech
+
+def bench_vad(args, workdir):
+    """Speech gating speed and recall, and the transcription cost with and without it"""
+    import diarize
+    from longaudio import WavMap
+    from vad import speech_regions
+
+    path = os.path.join(workdir, "pocket.wav")
+    truth = write_pocket_wav(path, args.vad_minutes * 60)
+    wav = WavMap(path)
+    start = time.perf_counter()
+    regions = speech_regions(wav)
+    elapsed = time.perf_counter() - start
+    found = np.zeros(len(truth), dtype=bool)
+    for first, last in regions:
+        found[int(first * 16000):int(last * 16000)] = True
+
+    rtf = args.stub_rtf or VAD_STUB_RTF
+    results = {}
+    for gated in (False, True):
+        with quiet(args.verbose):
+            begin = time.perf_counter()
+            summary = diarize.process_file(path, os.path.join(workdir, "pocket.txt"),
+                                           pipeline=StubPipeline(), model=StubWhisper(rtf=rtf),
+                                           long_audio=args.long_audio, vad=gated)
+            results[gated] = (summary, (time.perf_counter() - begin) / summary['audio_seconds'])
+    summary = results[True][0]
+    return {
+        'vad_x_realtime': wav.duration / elapsed,
+        'vad_speech_recall': found[truth].mean(),
+        'vad_false_speech': found[~truth].mean(),
+        'vad_skipped_share': summary['skipped_seconds'] / (summary['skipped_seconds'] + summary['speech_seconds']),
+        'vad_off_rtf': results[False][1],
+        'vad_on_rtf': results[True][1]
+    }
+
+def bench_align(args, workdir):
+    """Time align.repair on a synthetic session and score the patched frames"""
+    import align
+
+    offset = 1.25
+    ble, sd, truth, lost = write_align_pair(workdir, args.align_minutes * 60, offset)
+    frames = np.flatnonzero(lost)
+    align.write_gap_map(ble, [[int(f), int(f) + 1] for f in frames], SAMPLES_PER_FRAME)
+    with quiet(args.verbose):
+        report = align.repair(ble, sd, extend=False)
+    with open(report['output'], 'rb') as f:
+        f.seek(44)
+        merged = np.frombuffer(f.read(), dtype='<i2').reshape(-1, SAMPLES_PER_FRAME).astype(np.float64)
+    expected = truth.reshape(-1, SAMPLES_PER_FRAME)[lost].astype(np.float64)
+    error = merged[lost] - expected
+    return {
+        'align_x_realtime': report['audio_seconds'] / report['elapsed_seconds'],
+        'align_offset_error_ms': abs(report['offset_seconds'] - offset) * 1000,
+        'align_gap_snr_db': 10 * np.log10(np.sum(expected ** 2) / max(np.sum(error ** 2), 1e-9)),
+        'align_repaired_frames': report['repaired_frames']
+    }
+
+def bench_diarize(args, workdir):
+    """Time diarize.process_file with the models stubbed out
+
+    The file is processed with an empty transcript cache, then again
+    unchanged, then as a copy that grew by a tenth (same seed, so the
+    first part is identical) to show what the cache saves. The tone has no
+    speech, so gating is off here; the vad part measures it.
+    """
+    import diarize
+    from turncache import TranscriptCache
+
+    cache = TranscriptCache(os.path.join(workdir, "transcript_cache.db"))
+    audio = write_test_wav(os.path.join(workdir, "diarize.wav"), args.diarize_minutes * 60, 16000)
+    grown = write_test_wav(os.path.join(workdir, "diarize_grown.wav"), args.diarize_minutes * 66, 16000)
+    speeds = []
+    for path in (audio, audio, grown):
+        with quiet(args.verbose):
+            start = time.perf_counter()
+            summary = diarize.process_file(path, os.path.join(workdir, "diarize.txt"),
+                                           pipeline=StubPipeline(rtf=args.stub_rtf),
+                                           model=StubWhisper(rtf=args.stub_rtf),
+                                           long_audio=args.long_audio, cache=cache, vad=False)
+            speeds.append(summary['audio_seconds'] / (time.perf_counter() - start))
+        if path == audio:
+            turns = summary['turns']
+    cache.close()
+    return {
+        'diarize_x_realtime': speeds[0],
+        'diarize_rerun_x_realtime': speeds[1],
+        'diarize_grown_x_realtime': speeds[2],
+        'diarize_turns': turns
+    }
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance over the reference length, ignoring case and punctuation"""
+    from live_transcribe import words
+
+    reference = [word for word in words(reference) if word]
+    hypothesis = [word for word in words(hypothesis) if word]
+    if not reference:
+        return float(bool(hypothesis))
+    hypothesis = np.array(hypothesis, dtype=object)
+    steps = np.arange(len(hypothesis) + 1)
+    row = steps.copy()
+    for i, word in enumerate(reference, 1):
+        # Deletions and substitutions from the previous row, then insertions along this one
+        best = np.empty_like(row)
+        best[0] = i
+        best[1:] = np.minimum(row[1:] + 1, row[:-1] + (hypothesis != word))
+        row = np.minimum.accumulate(best - steps) + steps
+    return row[-1] / len(reference)
+
+def bench_whisper(args, workdir):
+    """Real-time factor and word error rate of each Whisper precision on a reference clip
+
+    Without a reference transcript the float32 output is the reference, so
+    the int8 WER measures how far quantization moves the transcript.
+    """
+    import torch
+    import whisper
+    import diarize
+
+    audio = whisper.load_audio(args.whisper_reference)
+    seconds = len(audio) / whisper.audio.SAMPLE_RATE
+    torch.set_num_threads(args.whisper_threads or os.cpu_count() or 1)
+    texts, metrics = {}, {}
+    for precision in diarize.PRECISIONS:
+        model = diarize.load_model(args.whisper_model, precision)
+        with quiet(args.verbose):
+            # Warm up allocators and kernels outside the timed run
+            model.transcribe(audio[:5 * whisper.audio.SAMPLE_RATE], fp16=False, temperature=0.0)
+            start = time.perf_counter()
+            texts[precision] = model.transcribe(audio, fp16=False, temperature=0.0)['text']
+            metrics[f'whisper_{precision}_rtf'] = (time.perf_counter() - start) / seconds
+        del model
+    reference = texts['float32']
+    if args.whisper_reference_text:
+        with open(args.whisper_reference_text) as f:
+            reference = f.read()
+        metrics['whisper_float32_wer'] = word_error_rate(reference, texts['float32'])
+    metrics['whisper_int8_wer'] = word_error_rate(reference, texts['int8'])
+    metrics['whisper_int8_speedup'] = metrics['whisper_float32_rtf'] / metrics['whisper_int8_rtf']
+    return metrics
+
+def launch_ms(argv, repeats=REPEATS):
+    """Fastest wall time of a fresh interpreter running argv, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *argv], stdout=subprocess.DEVNULL, check=True, cwd=os.path.dirname(CLI))
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def bench_startup(args, workdir):
+    """Time from launch to each command's help, in fresh interpreters
+
+    Printing a command's help imports its module, so this is the import
+    cost the command pays before doing any work; the bare interpreter is
+    reported for scale. startup_heavy_imports counts HEAVY_MODULES loaded
+    by importing every command module, which should stay 0.
+    """
+    metrics = {'startup_interpreter_ms': launch_ms(('-c', 'pass'))}
+    for name, argv in STARTUP_COMMANDS.items():
+        metrics[name] = launch_ms(argv)
+    probe = ("import sys, bench, bluetooth, diarize, download; "
+             f"print(sum(name in sys.modules for name in {HEAVY_MODULES!r}))")
+    result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(CLI))
+    metrics['startup_heavy_imports'] = int(result.stdout)
+    return metrics
+
+def compare(metrics, baseline, tolerance=TOLERANCE):
+    """Print each metric against the baseline; returns the names that regressed"""
+    regressions = []
+    for name, value in metrics.items():
+        line = f"{name:<26} {value:>12.4g}"
+        base = baseline.get(name)
+        if base and name in HIGHER_IS_BETTER:
+            change = (value - base) / base
+            worse = -change if HIGHER_IS_BETTER[name] else change
+            line += f"   baseline {base:>10.4g}  {change:+.1%}"
+            if worse > tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+def config_of(args):
+    return {key: value for key, value in vars(args).items()
+            if key not in ('baseline', 'save_baseline', 'tolerance', 'verbose', 'parts')}
+
+async def run(args):
+    metrics = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        if 'startup' in args.parts:
+            metrics.update(bench_startup(args, workdir))
+        if 'ingest' in args.parts:
+            metrics.update(await bench_ingest(args, workdir))
+        if 'reconnect' in args.parts:
+            metrics.update(await bench_reconnect(args, workdir))
+        if 'codecs' in args.parts:
+            metrics.update(bench_codecs(args, workdir))
+        if 'download' in args.parts:
+            metrics.update(await bench_download(args, workdir))
+        if 'align' in args.parts:
+            metrics.update(bench_align(args, workdir))
+        if 'vad' in args.parts:
+            metrics.update(bench_vad(args, workdir))
+        if 'diarize' in args.parts:
+            metrics.update(bench_diarize(args, workdir))
+        if 'whisper' in args.parts:
+            metrics.update(bench_whisper(args, workdir))
+    return metrics
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay benchmarks for ingest, download and diarization")
+    parser.add_argument('--parts', default=",".join(DEFAULT_PARTS),
+                        help=f"Comma-separated subset of {', '.join(PARTS)} (whisper only when named)")
+    parser.add_argument('--streams', type=int, default=4, help="Concurrent BLE streams")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Seconds of synthetic audio per stream")
+    parser.add_argument('--replay', help="16-bit mono WAV to replay instead of synthetic audio")
+    parser.add_argument('--codec', default='pcm16', choices=[name for name in CODECS if name != 'opus'],
+                        help="Payload codec of the replayed BLE stream")
+    parser.add_argument('--loss', type=float, default=0.01, help="Probability a frame is lost")
+    parser.add_argument('--reorder', type=float, default=0.02, help="Probability a frame is held back")
+    parser.add_argument('--jitter', type=float, default=0.005, help="Max extra delay per frame (s)")
+    parser.add_argument('--scan-delay', type=float, default=1.0,
+                        help="Seconds a scan takes to see an advertising unit")
+    parser.add_argument('--connect-delay', type=float, default=0.3, help="Seconds a BLE connection takes")
+    parser.add_argument('--drop-after', type=float, default=1.5, help="Seconds streamed before the link drops")
+    parser.add_argument('--download-mb', type=float, default=20.0)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0, help="0 leaves the link unshaped")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Fake server drops per 32KB chunk")
+    parser.add_argument('--align-minutes', type=float, default=60.0, help="Length of the aligned session")
+    parser.add_argument('--vad-minutes', type=float, default=10.0, help="Length of the gated pocket recording")
+    parser.add_argument('--diarize-minutes', type=float, default=10.0)
+    parser.add_argument('--stub-rtf', type=float, default=0.0,
+                        help="Simulated model cost as a fraction of audio time")
+    parser.add_argument('--long-audio', action='store_true', default=None,
+                        help="Force the windowed long-audio path")
+    parser.add_argument('--whisper-reference', help="Speech clip for the whisper part")
+    parser.add_argument('--whisper-reference-text', help="Correct transcript of the reference clip")
+    parser.add_argument('--whisper-model', default="base", help="Whisper model size to compare")
+    parser.add_argument('--whisper-threads', type=int, help="Torch threads (default: all cores)")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="Record this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Relative change that fails the run")
+    parser.add_argument('--verbose', action='store_true', help="Show output of the code under test")
+    args = parser.parse_args(argv)
+    args.parts = [part.strip() for part in args.parts.split(",") if part.strip()]
+    unknown = set(args.parts) - set(PARTS)
+    if unknown:
+        parser.error(f"Unknown parts: {', '.join(sorted(unknown))}")
+    if 'whisper' in args.parts and not args.whisper_reference:
+        parser.error("The whisper part needs --whisper-reference")
+
+    metrics = asyncio.run(run(args))
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved['metrics']
+        if saved.get('config') != config_of(args):
+            print(f"Warning: {args.baseline} was recorded with different settings")
+    regressions = compare(metrics, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'machine': platform.platform(),
+                'python': platform.python_version(),
+                'config': config_of(args),
+                'metrics': metrics
+            }, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
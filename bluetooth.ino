@@ -21,6 +21,7 @@
 #include <esp_wifi.h>
 #include "time.h"
 #include "ESP32Time.h"
+#include "mbedtls/sha256.h"
 
 // Hardware Pin Definitions
 #define I2S_WS      D0    // I2S Word Select
@@ -56,6 +57,14 @@ const int BufferSizeInBytes = 1024;  // Recording buffer size for crystal clear
 static size_t recording_buffer_size = BufferSizeInBytes;
 static size_t compressed_buffer_size = BLE_FRAME_SIZE * 2 + 3;  // BLE frame + header
 
+// BLE payload codecs (third header byte of every frame)
+#define CODEC_PCM16 0
+#define CODEC_MULAW 1
+#define CODEC_IMA_ADPCM 2
+#define ADPCM_HEADER_SIZE 4        // Predictor (int16 LE), step index, reserved
+#define MULAW_BIAS 0x84
+#define MULAW_CLIP 32635
+
 // WiFi and Time Configuration
 const char* ssid = "mango";
 const char* password = "peterpeel";
@@ -72,15 +81,18 @@ const char* ap_password = "12345678";
 #define DEVICE_NAME "ESP32WAV"
 static BLEUUID serviceUUID("4fafc201-1fb5-459e-8fcc-c5c9c331914b");
 static BLEUUID audioCharacteristicUUID("beb5483e-36e1-4688-b7f5-ea07361b26a8");
+static BLEUUID codecCharacteristicUUID("beb5483f-36e1-4688-b7f5-ea07361b26a8");
 
 // Timing Constants
 const unsigned long FRAME_INTERVAL = 10;    // 10ms between frames
 const unsigned long STATS_INTERVAL = 1000;  // 1 second between stats
+const unsigned long RESUME_WINDOW_MS = 30000;  // Keep recording this long for a dropped client to return
 
 // Global Objects
 ESP32Time rtc;
 WebServer server(80);
 BLECharacteristic *audioCharacteristic;
+BLECharacteristic *codecCharacteristic;
 File wavFile;
 
 // Buffer Pointers
@@ -91,9 +103,16 @@ static uint8_t *s_compressed_frame = nullptr;
 bool timeInitialized = false;
 bool wifi_active = false;
 bool connected = false;        // BLE connection state
+unsigned long disconnected_at = 0;  // millis() when the client dropped mid-recording
+volatile bool client_lost = false;  // The client dropped while recording and has not come back
 bool isRecording = false;     // Recording state
 bool isStreaming = false;     // Streaming state
 bool stringComplete = false;  // Serial input state
+uint8_t stream_codec = CODEC_PCM16;  // Codec of the frames being sent; only loop() changes it
+// Set by the BLE callback task, applied by loop() between frames so the
+// encoder state is never reset while a frame is being encoded
+volatile uint8_t requested_codec = CODEC_PCM16;
+volatile bool codec_change_pending = false;
 
 // Button States
 int buttonState = 0;
@@ -114,6 +133,7 @@ unsigned long last_stats_time = 0;
 // String Storage
 String inputString = "";       // Serial input buffer
 String currentWavFile = "";    // Current recording filename
+String currentWavDigest = "";  // Hex SHA-256 of currentWavFile; also its ETag
 
 void setupWiFiDirect() {
     Serial.println("\nInitializing WiFi Direct...");
@@ -161,6 +181,10 @@ void setupWiFiDirect() {
     
     server.on("/file", HTTP_GET, handleFileDownload);
     
+    // Keep the Range header so interrupted downloads can resume
+    const char *collected_headers[] = {"Range", "If-Range"};
+    server.collectHeaders(collected_headers, 2);
+    
     // Start server
     Serial.println("Starting HTTP server...");
     server.begin();
@@ -213,6 +237,29 @@ void handleRoot() {
     server.send(200, "text/html", html);
 }
 
+// SHA-256 of a finished recording as lowercase hex, or "" if it cannot be read
+String fileSha256(const char *path) {
+    File file = SD.open(path, FILE_READ);
+    if (!file) return "";
+    static uint8_t block[4096];
+    mbedtls_sha256_context ctx;
+    mbedtls_sha256_init(&ctx);
+    mbedtls_sha256_starts(&ctx, 0);  // 0 selects SHA-256, not SHA-224
+    size_t n;
+    while ((n = file.read(block, sizeof(block))) > 0) {
+        mbedtls_sha256_update(&ctx, block, n);
+    }
+    file.close();
+    uint8_t digest[32];
+    mbedtls_sha256_finish(&ctx, digest);
+    mbedtls_sha256_free(&ctx);
+    char hex[65];
+    for (int i = 0; i < 32; i++) {
+        sprintf(hex + i * 2, "%02x", digest[i]);
+    }
+    return String(hex);
+}
+
 // Improved file download handler with better buffering and error handling
 void handleFileDownload() {
     Serial.println("\nInitiating high-speed file transfer...");
@@ -229,6 +276,34 @@ void handleFileDownload() {
     }
     
     size_t fileSize = file.size();
+    String etag = "\"" + currentWavDigest + "\"";
+    
+    // Honour a single "bytes=start-end" range so the client can resume, unless
+    // its If-Range names an earlier recording: then it gets the whole new file
+    size_t rangeStart = 0;
+    size_t rangeEnd = fileSize;  // Exclusive
+    bool partial = false;
+    bool sameFile = !server.hasHeader("If-Range") || server.header("If-Range") == etag;
+    if(server.hasHeader("Range") && sameFile) {
+        String range = server.header("Range");
+        int dash = range.indexOf('-');
+        if(range.startsWith("bytes=") && dash > 6) {
+            size_t start = range.substring(6, dash).toInt();
+            String last = range.substring(dash + 1);
+            size_t end = last.length() > 0 ? (size_t)last.toInt() + 1 : fileSize;
+            if(start < fileSize) {
+                rangeStart = start;
+                rangeEnd = end < fileSize ? end : fileSize;
+                partial = true;
+            }
+        }
+    }
+    if(partial && !file.seek(rangeStart)) {
+        file.close();
+        server.send(500, "text/plain", "Seek failed");
+        return;
+    }
+    size_t sendSize = rangeEnd - rangeStart;
     
     WiFiClient client = server.client();
     client.setNoDelay(true);     // Disable Nagle's algorithm
@@ -237,10 +312,19 @@ void handleFileDownload() {
     int tcp_mss = 1460;
     
     // Minimal headers for reduced overhead
-    String headers = "HTTP/1.1 200 OK\r\n"
-                    "Content-Type: audio/wav\r\n"
-                    "Content-Length: " + String(fileSize) + "\r\n"
-                    "Connection: keep-alive\r\n\r\n";
+    String headers = partial ? "HTTP/1.1 206 Partial Content\r\n" : "HTTP/1.1 200 OK\r\n";
+    headers += "Content-Type: audio/wav\r\n"
+               "Accept-Ranges: bytes\r\n"
+               "Content-Length: " + String(sendSize) + "\r\n";
+    if(currentWavDigest.length() > 0) {
+        headers += "X-Content-SHA256: " + currentWavDigest + "\r\n"
+                   "ETag: " + etag + "\r\n";
+    }
+    if(partial) {
+        headers += "Content-Range: bytes " + String(rangeStart) + "-" + String(rangeEnd - 1) +
+                   "/" + String(fileSize) + "\r\n";
+    }
+    headers += "Connection: keep-alive\r\n\r\n";
     
     client.print(headers);
     
@@ -264,8 +348,10 @@ void handleFileDownload() {
     // Pre-calculate TCP segment size for optimal network packets
     size_t optimalChunkSize = (CHUNK_SIZE / tcp_mss) * tcp_mss;
     
-    while(file.available() && client.connected()) {
-        size_t bytesRead = file.read(buffer, TRANSFER_BUFFER_SIZE);
+    while(bytesSent < sendSize && file.available() && client.connected()) {
+        size_t toRead = sendSize - bytesSent;
+        if(toRead > TRANSFER_BUFFER_SIZE) toRead = TRANSFER_BUFFER_SIZE;
+        size_t bytesRead = file.read(buffer, toRead);
         if(bytesRead == 0) break;
         
         size_t bytesRemaining = bytesRead;
@@ -290,13 +376,13 @@ void handleFileDownload() {
         if(currentTime - lastProgressTime >= 1000) {  // Update every second
             float elapsedSecs = (currentTime - startTime) / 1000.0;
             float speedMbps = (bytesSent * 8.0) / (elapsedSecs * 1000000.0);  // Convert to Mbps
-            float progress = (bytesSent * 100.0) / fileSize;
+            float progress = (bytesSent * 100.0) / sendSize;
             
             Serial.printf("Progress: %.1f%% Speed: %.2f Mbps\n", progress, speedMbps);
             lastProgressTime = currentTime;
             
             // Calculate estimated completion time
-            float remainingBytes = fileSize - bytesSent;
+            float remainingBytes = sendSize - bytesSent;
             float estimatedSeconds = remainingBytes / (bytesSent / elapsedSecs);
             Serial.printf("Estimated completion in: %.1f seconds\n", estimatedSeconds);
         }
@@ -378,6 +464,9 @@ void setupTime() {
 void startRecording() {
     if (isStreaming || isRecording) return;
     
+    // A drop before this recording started must not end it
+    client_lost = false;
+
     // Reset all counters
     audio_frame_count = 0;
     last_frame_time = millis();
@@ -462,6 +551,10 @@ void stopRecording() {
         wavFile.flush();
         wavFile.close();
         
+        // Hash once here so every download can be verified without rereading the card
+        currentWavDigest = fileSha256(currentWavFile.c_str());
+        Serial.printf("SHA-256: %s\n", currentWavDigest.c_str());
+        
         isRecording = false;
         Serial.printf("Recording stopped. File saved as: %s\n", currentWavFile.c_str());
         
@@ -539,20 +632,104 @@ void processSerialCommand(String command) {
     }
 }
 
+// G.711 mu-law, same segment layout as the receiver's decoder table
+static uint8_t mulaw_encode(int16_t sample) {
+    int32_t pcm = sample;
+    uint8_t sign = 0;
+    if (pcm < 0) {
+        pcm = -pcm;
+        sign = 0x80;
+    }
+    if (pcm > MULAW_CLIP) pcm = MULAW_CLIP;
+    pcm += MULAW_BIAS;
+    uint8_t exponent = 7;
+    for (int32_t mask = 0x4000; exponent > 0 && !(pcm & mask); mask >>= 1) {
+        exponent--;
+    }
+    uint8_t mantissa = (pcm >> (exponent + 3)) & 0x0F;
+    return ~(sign | (exponent << 4) | mantissa);
+}
+
+static const int16_t adpcm_steps[89] = {
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+};
+static const int8_t adpcm_index_shift[8] = {-1, -1, -1, -1, 2, 4, 6, 8};
+static int32_t adpcm_predictor = 0;
+static int adpcm_index = 0;
+
+// IMA-ADPCM: the header carries the state before the frame, so the
+// receiver can decode every frame on its own. Low nibble first.
+static size_t adpcm_encode_frame(const int16_t *pcm, size_t count, uint8_t *out) {
+    out[0] = adpcm_predictor & 0xFF;
+    out[1] = (adpcm_predictor >> 8) & 0xFF;
+    out[2] = adpcm_index;
+    out[3] = 0;
+    uint8_t *data = out + ADPCM_HEADER_SIZE;
+    for (size_t i = 0; i < count; i++) {
+        int32_t step = adpcm_steps[adpcm_index];
+        int32_t diff = pcm[i] - adpcm_predictor;
+        uint8_t code = 0;
+        if (diff < 0) {
+            code = 8;
+            diff = -diff;
+        }
+        int32_t delta = step >> 3;
+        if (diff >= step) { code |= 4; diff -= step; delta += step; }
+        if (diff >= (step >> 1)) { code |= 2; diff -= step >> 1; delta += step >> 1; }
+        if (diff >= (step >> 2)) { code |= 1; delta += step >> 2; }
+        adpcm_predictor += (code & 8) ? -delta : delta;
+        if (adpcm_predictor > 32767) adpcm_predictor = 32767;
+        if (adpcm_predictor < -32768) adpcm_predictor = -32768;
+        adpcm_index += adpcm_index_shift[code & 7];
+        if (adpcm_index < 0) adpcm_index = 0;
+        if (adpcm_index > 88) adpcm_index = 88;
+        if (i & 1) {
+            data[i / 2] |= code << 4;
+        } else {
+            data[i / 2] = code;
+        }
+    }
+    return ADPCM_HEADER_SIZE + count / 2;
+}
+
+class CodecCallbacks: public BLECharacteristicCallbacks {
+    void onWrite(BLECharacteristic *characteristic) {
+        uint8_t *value = characteristic->getData();
+        if (characteristic->getLength() < 1 || value[0] > CODEC_IMA_ADPCM) {
+            Serial.println("Ignoring unsupported codec request");
+            return;
+        }
+        requested_codec = value[0];
+        codec_change_pending = true;
+    }
+};
+
 class ServerCallbacks: public BLEServerCallbacks {
     void onConnect(BLEServer* server) {
         connected = true;
+        client_lost = false;
         Serial.println("\n=== Client Connected ===");
         Serial.println("Type 'start' to begin streaming/recording or 'stop' to end");
     }
 
     void onDisconnect(BLEServer* server) {
         connected = false;
+        disconnected_at = millis();
         Serial.println("\n=== Client Disconnected ===");
         if (isRecording) {
-            stopRecording();
+            // Keep recording to SD and counting frames; the client resumes the
+            // session if it reconnects within RESUME_WINDOW_MS
+            client_lost = true;
+            Serial.println("Recording continues while the client reconnects");
         }
-        isStreaming = false;  // Stop streaming on disconnect
+        requested_codec = CODEC_PCM16;  // The next client negotiates again
+        codec_change_pending = true;
         BLEDevice::startAdvertising();
     }
 };
@@ -576,6 +753,13 @@ void configure_ble() {
     ccc->setNotifications(true);
     audioCharacteristic->addDescriptor(ccc);
 
+    // Codec selection, written by the client before it subscribes
+    codecCharacteristic = service->createCharacteristic(
+        codecCharacteristicUUID,
+        BLECharacteristic::PROPERTY_READ | BLECharacteristic::PROPERTY_WRITE
+    );
+    codecCharacteristic->setCallbacks(new CodecCallbacks());
+
     // Start the service
     service->start();
 
@@ -754,12 +938,19 @@ void loop() {
         lastServerCheck = current_time;
     }
 
-    // If not connected or not streaming, wait with reduced delay
-    if (!connected || !isStreaming) {
+    // If not streaming, wait with reduced delay
+    if (!isStreaming) {
         delay(50);  // Reduced from 100ms to improve responsiveness
         return;
     }
 
+    // The client dropped and never came back: end the recording
+    if (!connected && client_lost && current_time - disconnected_at >= RESUME_WINDOW_MS) {
+        Serial.println("Client did not reconnect, stopping recording");
+        stopRecording();
+        return;
+    }
+
     // Audio streaming section
     
     // Check if it's time to print stats
@@ -795,27 +986,54 @@ void loop() {
 
         // Process for BLE streaming - downsample to 16kHz for BLE
         int16_t* samples = (int16_t*)s_recording_buffer;
+        int16_t frame[BLE_FRAME_SIZE];
+        if (codec_change_pending) {
+            // Clear first: a request arriving now is applied with the next frame
+            codec_change_pending = false;
+            stream_codec = requested_codec;
+            adpcm_predictor = 0;
+            adpcm_index = 0;
+            Serial.printf("Streaming codec set to %u\n", stream_codec);
+        }
+        uint8_t codec = stream_codec;
         uint8_t* output = s_compressed_frame + 3;
+        size_t payload_size;
         
         // Take every third sample to downsample from 48kHz to 16kHz
         for (size_t i = 0; i < BLE_FRAME_SIZE; i++) {
-            int16_t sample = samples[i * 3] << VOLUME_GAIN;  // Take every 3rd sample
-            *output++ = sample & 0xFF;         // Low byte
-            *output++ = (sample >> 8) & 0xFF;  // High byte
+            frame[i] = samples[i * 3] << VOLUME_GAIN;  // Take every 3rd sample
+        }
+
+        if (codec == CODEC_MULAW) {
+            for (size_t i = 0; i < BLE_FRAME_SIZE; i++) {
+                output[i] = mulaw_encode(frame[i]);
+            }
+            payload_size = BLE_FRAME_SIZE;
+        } else if (codec == CODEC_IMA_ADPCM) {
+            payload_size = adpcm_encode_frame(frame, BLE_FRAME_SIZE, output);
+        } else {
+            for (size_t i = 0; i < BLE_FRAME_SIZE; i++) {
+                *output++ = frame[i] & 0xFF;         // Low byte
+                *output++ = (frame[i] >> 8) & 0xFF;  // High byte
+            }
+            payload_size = BLE_FRAME_SIZE * 2;
         }
 
         // Add frame header
         s_compressed_frame[0] = audio_frame_count & 0xFF;
         s_compressed_frame[1] = (audio_frame_count >> 8) & 0xFF;
-        s_compressed_frame[2] = 0;
-
-        // Send the audio data
-        audioCharacteristic->setValue(s_compressed_frame, compressed_buffer_size);
-        audioCharacteristic->notify();
+        s_compressed_frame[2] = codec;
+
+        // Send the audio data; while the link is down the frame number still
+        // advances so the client can place the gap when it resumes
+        if (connected) {
+            audioCharacteristic->setValue(s_compressed_frame, payload_size + 3);
+            audioCharacteristic->notify();
+            frames_sent++;
+            bytes_sent += payload_size + 3;
+        }
         
         audio_frame_count++;
-        frames_sent++;
-        bytes_sent += compressed_buffer_size;
         last_frame_time = current_time;
     }
 
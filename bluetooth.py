@@ -1,17 +1,24 @@
+import argparse
 import asyncio
-from bleak import BleakClient, BleakScanner
-import struct
-import wave
+import glob
+import json
 import time
 import os
 from datetime import datetime
-import requests
-import wifi
-import subprocess
-import platform
-from urllib.parse import urljoin
-import time
-import aiohttp
+import numpy as np
+
+import align
+import metrics
+from archive import Archiver
+from audiocodec import CODECS
+from catalog import Catalog
+from framedecoder import FrameDecoder
+from jitterbuffer import JitterBuffer
+from download import DIGEST_SUFFIX, NATIVE_SUFFIX, DownloadError, ResumableDownloader, file_sha256
+from live_transcribe import LiveTranscriber, TranscriptionWorker
+from netcontrol import NetworkError, WiFiHandover
+from resample import ResamplingWavSink
+from wavsink import BackgroundWavWriter, DiskWriter, needs_recovery, recover_wav
 
 #for wifi direct
 WIFI_SSID = "ESP32_Audio"
@@ -21,6 +28,7 @@ ESP32_IP = "192.168.4.1"  # Default AP IP for ESP32
 # BLE UUIDs (must match ESP32)
 SERVICE_UUID = "4fafc201-1fb5-459e-8fcc-c5c9c331914b"
 CHARACTERISTIC_UUID = "beb5483e-36e1-4688-b7f5-ea07361b26a8"
+CODEC_CHARACTERISTIC_UUID = "beb5483f-36e1-4688-b7f5-ea07361b26a8"  # Writable; selects the payload codec
 
 # Device name as advertised
 DEVICE_NAME = "ESP32WAV"
@@ -29,361 +37,334 @@ DEVICE_NAME = "ESP32WAV"
 SAMPLE_RATE = 16000
 SAMPLE_WIDTH = 2  # 16-bit audio
 CHANNELS = 1
+GAP_FILL = "silence"  # How lost frames are filled: "silence" or "interpolate"
+JITTER_LATENCY_FRAMES = 20  # Reorder window in frames (10 ms each)
+BLE_CODEC = "pcm16"  # Codec requested from the device: "pcm16", or the lossy "mulaw"/"adpcm" to save airtime
+KEEP_SD_ORIGINAL = False  # Keep the SD card's native-rate (48 kHz) file next to the 16 kHz one
+ALIGN_RECORDINGS = True  # Merge each BLE recording with its SD copy into a gap-free file
+ARCHIVE_FORMAT = "flac"  # Replace a finished session's WAVs with "flac" or "opus" archives; None keeps WAVs
+ARCHIVE_WORKERS = 2      # Sessions transcoded at once, in the background
 
-class WiFiConnector:
-    def __init__(self):
-        self.original_wifi = None
-    
-    def connect_to_esp32(self):
-        """Connect to ESP32's WiFi Direct network"""
-        system = platform.system()
-        
-        if system == "Darwin":  # macOS
-            # Store current WiFi info
-            try:
-                result = subprocess.run(['networksetup', '-getairportnetwork', 'en0'], 
-                                     capture_output=True, text=True)
-                self.original_wifi = result.stdout.strip().split(': ')[-1]
-            except:
-                self.original_wifi = None
-            
-            # Connect to ESP32
-            try:
-                subprocess.run(['networksetup', '-setairportnetwork', 'en0', 
-                              WIFI_SSID, WIFI_PASSWORD], check=True)
-                time.sleep(2)  # Wait for connection
-                return True
-            except subprocess.CalledProcessError:
-                print("Failed to connect to ESP32 WiFi")
-                return False
-                
-        elif system == "Linux":
-            try:
-                subprocess.run(['nmcli', 'device', 'wifi', 'connect', WIFI_SSID, 
-                              'password', WIFI_PASSWORD], check=True)
-                time.sleep(2)
-                return True
-            except subprocess.CalledProcessError:
-                print("Failed to connect to ESP32 WiFi")
-                return False
-                
-        else:
-            print(f"Automatic WiFi connection not supported on {system}")
-            print(f"Please connect manually to {WIFI_SSID} with password {WIFI_PASSWORD}")
-            input("Press Enter when connected...")
-            return True
+# Multi-device ingest settings
+OUTPUT_DIR = "."
+CATALOG_FILE = "catalog.db"   # Session index inside OUTPUT_DIR; None disables it
+MAX_CONCURRENT_CONNECTS = 1   # Most adapters only handle one connection attempt at a time
+RECONNECT_MIN_DELAY = 1.0     # Seconds before the first reconnect attempt
+RECONNECT_MAX_DELAY = 30.0    # Upper bound for reconnect backoff
+KNOWN_DEVICES_FILE = "known_devices.json"  # Addresses connected before, inside OUTPUT_DIR; None disables it
+MAX_KNOWN_DEVICES = 16        # Most recently connected addresses kept in KNOWN_DEVICES_FILE
+CONNECT_TIMEOUT = 20.0        # Seconds for a connect to a device we just saw advertising
+DIRECT_CONNECT_TIMEOUT = 5.0  # Seconds for a connect by remembered address alone
+SCAN_TIMEOUT = 5.0            # Seconds find_device() scans before giving up
+RESUME_TIMEOUT = 30.0         # Seconds a dropped link holds its session open; the firmware's RESUME_WINDOW_MS
+LINK_PROBE_TIMEOUT = 1.0      # Seconds a read may take before a silent link counts as lost
+STATS_INTERVAL = 5.0          # Seconds between per-device stats reports
+SESSION_IDLE_TIMEOUT = 1.0    # Seconds without notifications that end a recording session
 
-    def restore_original_wifi(self):
-        """Restore original WiFi connection"""
-        system = platform.system()
-        
-        if system == "Darwin" and self.original_wifi:  # macOS
-            try:
-                subprocess.run(['networksetup', '-setairportnetwork', 'en0', 
-                              self.original_wifi], check=True)
-            except:
-                print("Failed to restore original WiFi connection")
-                
-        elif system == "Linux":
-            try:
-                subprocess.run(['nmcli', 'device', 'wifi', 'connect', 
-                              self.original_wifi], check=True)
-            except:
-                print("Failed to restore original WiFi connection")
+# Live transcription of the BLE stream (Whisper runs in a worker process)
+LIVE_TRANSCRIPTION = False
+LIVE_MODEL = "base"
+
+# Telemetry
+METRICS_PORT = metrics.METRICS_PORT  # Prometheus /metrics endpoint; None disables it
+METRICS_JSONL = None          # Append JSON-lines snapshots here, e.g. "metrics.jsonl"
+CONSOLE_STATS = True          # Rate-limited human-readable status on stdout
+INTERARRIVAL_BUCKETS = (0.005, 0.0075, 0.01, 0.0125, 0.015, 0.02, 0.03, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+FRAMES_RECEIVED = metrics.counter('ble_frames_received_total', "BLE audio notifications received")
+FRAMES_DROPPED = metrics.counter('ble_frames_dropped_total', "Frames lost in transit and filled in")
+FRAMES_OUT_OF_ORDER = metrics.counter('ble_frames_out_of_order_total', "Frames that arrived out of sequence")
+FRAMES_LATE = metrics.counter('ble_frames_late_total', "Frames discarded because their slot was already written")
+FRAMES_INVALID = metrics.counter('ble_frames_invalid_size_total', "Frames with an unexpected length")
+FRAMES_TRUNCATED = metrics.counter('ble_frames_truncated_total', "Notifications too short to carry a header")
+FRAMES_UNSUPPORTED = metrics.counter('ble_frames_unsupported_total', "Frames in a codec that could not be decoded")
+AUDIO_BYTES = metrics.counter('ble_audio_bytes_total', "PCM bytes written to BLE recordings")
+SESSIONS = metrics.counter('ble_sessions_total', "Finished BLE recording sessions")
+RESUMES = metrics.counter('ble_session_resumes_total', "Sessions continued after the link dropped and came back")
+FRAME_RATE = metrics.gauge('ble_frames_per_second', "Notifications per second over the last second")
+CONNECTED = metrics.gauge('ble_connected', "1 while the device is connected")
+INTERARRIVAL = metrics.histogram('ble_interarrival_seconds', "Time between consecutive notifications",
+                                 INTERARRIVAL_BUCKETS)
+DISK_QUEUE = metrics.gauge('ble_disk_queue_depth', "File operations waiting for the disk writer thread")
+
+# Every pocket unit runs the same AP (same SSID and IP), so only one
+# device's SD card can be downloaded at a time. Created lazily so it binds
+# to the running event loop.
+_wifi_handover_lock = None
+
+def get_wifi_handover_lock():
+    """Return the process-wide lock guarding the WiFi handover"""
+    global _wifi_handover_lock
+    if _wifi_handover_lock is None:
+        _wifi_handover_lock = asyncio.Lock()
+    return _wifi_handover_lock
+
+# All recording file I/O goes through one thread so the BLE callbacks and
+# the event loop never wait on the disk.
+_disk_writer = None
+
+def get_disk_writer():
+    """Return the process-wide disk writer thread"""
+    global _disk_writer
+    if _disk_writer is None:
+        _disk_writer = DiskWriter()
+    return _disk_writer
+
+# Finished sessions are transcoded off the event loop on a bounded pool.
+# False once creating it failed (e.g. soundfile is not installed).
+_archiver = None
+
+def get_archiver():
+    """Return the process-wide archiver, or None when archiving is off or unavailable"""
+    global _archiver
+    if _archiver is None and ARCHIVE_FORMAT:
+        try:
+            _archiver = Archiver(ARCHIVE_FORMAT, ARCHIVE_WORKERS)
+        except ImportError as e:
+            print(f"Archiving disabled: {e}")
+            _archiver = False
+    return _archiver or None
+
+_catalogs = {}
+
+def get_catalog(output_dir=OUTPUT_DIR):
+    """Return the shared session catalog for an output directory, or None"""
+    if not CATALOG_FILE:
+        return None
+    path = os.path.abspath(os.path.join(output_dir, CATALOG_FILE))
+    if path not in _catalogs:
+        _catalogs[path] = Catalog(path)
+    return _catalogs[path]
 
 class AudioStreamReceiver:
-    def __init__(self):
+    def __init__(self, address=None, output_dir=OUTPUT_DIR, network_backend=None, disk=None,
+                 catalog=None):
+        self.address = address
+        self.output_dir = output_dir
+        self.disk = disk or get_disk_writer()
+        # Catalog writes run on the disk writer thread like all other file I/O
+        self.catalog = catalog or get_catalog(output_dir)
+        self.idle_timer = None
+        # Set by DeviceIngest while connected: async callable returning whether the link still answers
+        self.link_probe = None
+        # Short per-device tag used in file names and log lines
+        self.device_tag = address.replace(':', '')[-6:] if address else None
+        self.labels = {'device': self.device_tag or "local"}
+        self.totals = {
+            'sessions': 0,
+            'frames': 0,
+            'bytes': 0,
+            'drops': 0,
+            'out_of_order': 0,
+            'invalid_size': 0,
+            'truncated': 0,
+            'resumes': 0
+        }
+        self.decoder = FrameDecoder(fill=GAP_FILL)
+        self.jitter = JitterBuffer(self.decoder, latency_frames=JITTER_LATENCY_FRAMES)
+        # Callables fed the session's in-order PCM (int16 NumPy arrays)
+        self.pcm_consumers = []
         self.reset_session()
-        self.wifi_ssid = "ESP32_Audio"
-        self.wifi_password = "12345678"
-        self.original_wifi = None
+        self.handover = WiFiHandover(WIFI_SSID, WIFI_PASSWORD, ESP32_IP, backend=network_backend)
+
+    def output_path(self, prefix, timestamp=None):
+        """Build the output file name for the current (or a given) session"""
+        name = f"{prefix}_{timestamp or self.current_file_timestamp}"
+        if self.device_tag:
+            name += f"_{self.device_tag}"
+        return os.path.join(self.output_dir, name + ".wav")
+
+    def stats_snapshot(self):
+        """Return cumulative counters including the in-progress session"""
+        stats = dict(self.totals)
+        stats['frames'] += self.frames_received
+        stats['bytes'] += self.bytes_received
+        for key, value in self.frame_stats.items():
+            stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def publish_metrics(self):
+        """Mirror the cumulative counters into the metrics registry"""
+        stats = self.stats_snapshot()
+        FRAMES_RECEIVED.set(stats['frames'], **self.labels)
+        FRAMES_DROPPED.set(stats['drops'], **self.labels)
+        FRAMES_OUT_OF_ORDER.set(stats['out_of_order'], **self.labels)
+        FRAMES_LATE.set(stats.get('late', 0), **self.labels)
+        FRAMES_INVALID.set(stats['invalid_size'], **self.labels)
+        FRAMES_TRUNCATED.set(stats['truncated'], **self.labels)
+        FRAMES_UNSUPPORTED.set(stats.get('unsupported', 0), **self.labels)
+        AUDIO_BYTES.set(stats['bytes'], **self.labels)
+        SESSIONS.set(stats['sessions'], **self.labels)
+        RESUMES.set(stats['resumes'], **self.labels)
+        DISK_QUEUE.set(self.disk.pending)
+
+    def record_arrivals(self):
+        """Feed the batch's notification arrival gaps into the histogram"""
+        if len(self.arrivals) > 1:
+            INTERARRIVAL.observe_many(np.diff(self.arrivals), **self.labels)
+            del self.arrivals[:-1]
         
     def reset_session(self):
         """Reset all session variables for a new recording"""
-        self.audio_data = bytearray()
+        if getattr(self, 'frames_received', 0):
+            # Fold the finished session into the cumulative counters
+            self.totals['sessions'] += 1
+            self.totals['frames'] += self.frames_received
+            self.totals['bytes'] += self.bytes_received
+            for key, value in self.frame_stats.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+        if getattr(self, 'wav_writer', None):
+            self.wav_writer.close()
+        self.wav_writer = None
+        self.bytes_received = 0
         self.start_time = None
         self.last_progress_time = None
+        self.last_progress_frames = 0
+        self.arrivals = []  # Notification times not yet in the histogram
         self.frames_received = 0
-        self.last_frame_count = None
         self.last_data_time = None
+        self.link_down_at = None  # time.time() the link dropped while the session is held open
         self.is_receiving = False
         self.samples_per_frame = 160  # Match ESP32's FRAME_SIZE
-        self.frame_stats = {
-            'drops': 0,
-            'out_of_order': 0,
-            'invalid_size': 0
-        }
+        # Header parsing, drop accounting and gap filling happen in batches
+        self.decoder.reset()
+        self.jitter.reset()
+        self.frame_stats = self.decoder.stats
         self.current_file_timestamp = None
+        self.publish_metrics()
     
-    async def test_server_connection(self):
-        """Test connection to ESP32 server with detailed debugging"""
-        print("\nTesting connection to ESP32 server...")
-        
-        try:
-            # Try ping first
-            print("Testing ping to ESP32...")
-            ping_result = subprocess.run(['ping', '-c', '1', '-t', '1', '192.168.4.1'], 
-                                      capture_output=True, text=True)
-            print(f"Ping result: {ping_result.stdout}")
-            
-            # Try netcat to test port 80
-            print("Testing HTTP port with netcat...")
-            try:
-                nc_result = subprocess.run(['nc', '-zv', '-G', '1', '192.168.4.1', '80'],
-                                         capture_output=True, text=True)
-                print(f"Netcat port test result: {nc_result.stderr}")
-            except:
-                print("Netcat test failed")
-            
-            # Try HTTP connection
-            print("Testing HTTP connection...")
-            async with aiohttp.ClientSession() as session:
-                async with session.get('http://192.168.4.1', 
-                                     timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    print(f"HTTP Response status: {response.status}")
-                    text = await response.text()
-                    print(f"Response content: {text[:200]}...")  # First 200 chars
-                    return response.status == 200
-                    
-        except aiohttp.ClientError as e:
-            print(f"HTTP connection error: {e}")
-        except Exception as e:
-            print(f"Connection test error: {e}")
-            print(f"Error type: {type(e)}")
-        
-        return False
+    async def download_wav_file(self, timestamp=None):
+        """Download the WAV file from ESP32, one device at a time
 
-    async def connect_to_esp32_wifi(self):
-        """Connect to ESP32's WiFi network"""
-        print("\nAttempting to connect to ESP32 WiFi...")
-        max_retries = 3
-        
-        for attempt in range(max_retries):
-            try:
-                # Store current WiFi
-                print("Getting current WiFi network...")
-                result = subprocess.run(['networksetup', '-getairportnetwork', 'en0'], 
-                                     capture_output=True, text=True)
-                self.original_wifi = result.stdout.strip().split(': ')[-1]
-                print(f"Current WiFi network: {self.original_wifi}")
-                
-                # Turn WiFi off and on to refresh networks
-                print("Cycling WiFi to refresh networks...")
-                subprocess.run(['networksetup', '-setairportpower', 'en0', 'off'])
-                await asyncio.sleep(1)
-                subprocess.run(['networksetup', '-setairportpower', 'en0', 'on'])
-                await asyncio.sleep(2)
-                
-                # List available networks
-                print("Scanning for available networks...")
-                result = subprocess.run(['airport', '-s'], 
-                                     capture_output=True, text=True)
-                print("Available networks:")
-                print(result.stdout)
-                
-                # Connect to ESP32
-                print(f"Attempting to connect to {self.wifi_ssid} (Attempt {attempt + 1}/{max_retries})")
-                subprocess.run(['networksetup', '-setairportnetwork', 'en0', 
-                              self.wifi_ssid, self.wifi_password], check=True)
-                
-                # Wait longer for connection to establish and stabilize
-                print("Waiting for connection to establish and stabilize...")
-                await asyncio.sleep(10)  # Increased from 5 to 10 seconds
-                
-                # Verify connection
-                print("Verifying connection...")
-                result = subprocess.run(['networksetup', '-getairportnetwork', 'en0'], 
-                                     capture_output=True, text=True)
-                current_network = result.stdout.strip().split(': ')[-1]
-                print(f"Currently connected to: {current_network}")
-                
-                if current_network == self.wifi_ssid:
-                    print(f"Successfully connected to {self.wifi_ssid}")
-                    
-                    # Extended connection testing
-                    if await self.test_server_connection():
-                        print("Server connection tests successful!")
-                        return True
-                    else:
-                        print("Connected to WiFi but server tests failed")
-                        print("Waiting additional 5 seconds and retrying server test...")
-                        await asyncio.sleep(5)
-                        if await self.test_server_connection():
-                            print("Server connection successful on second attempt!")
-                            return True
-                else:
-                    print(f"Failed to connect. Current network is {current_network}")
-                    
-            except subprocess.CalledProcessError as e:
-                print(f"Connection attempt {attempt + 1} failed: {e}")
-                print(f"Error output: {e.stderr}")
-                await asyncio.sleep(2)
-                
-        print(f"Failed to connect to {self.wifi_ssid} after {max_retries} attempts")
-        return False
-    
-    async def restore_wifi(self):
-        """Restore original WiFi connection"""
-        if not self.original_wifi:
-            return
+        `timestamp` names the BLE session the SD card file belongs to; by
+        the time this task runs the receiver may have reset or started the
+        next session.
+        """
+        timestamp = timestamp or self.current_file_timestamp
+        lock = get_wifi_handover_lock()
+        if lock.locked():
+            print(f"\n[{self.device_tag}] Waiting for another device's download to finish...")
+        async with lock:
+            return await self._download_wav_file(timestamp)
 
-        system = platform.system()
-        if system == "Darwin" and self.original_wifi:  # macOS
-            try:
-                subprocess.run(['networksetup', '-setairportnetwork', 'en0', 
-                              self.original_wifi], check=True)
-                await asyncio.sleep(2)
-                print(f"Restored original WiFi connection to: {self.original_wifi}")
-            except subprocess.CalledProcessError as e:
-                print(f"Failed to restore original WiFi: {e}")
-        
-    async def download_wav_file(self):
+    async def _download_wav_file(self, timestamp):
         """Download the WAV file from ESP32 over WiFi with maximum speed optimizations"""
+        import aiohttp
         print("\nInitiating high-speed WiFi Direct transfer...")
         
         CHUNK_SIZE = 32768  # 32KB to match server's chunk size
         MAX_RETRIES = 3
-        STABILITY_WAIT = 2  # Seconds to wait for connection stability
+        # One name for every attempt so later attempts resume the .part file
+        output = self.output_path("sdcard_recording", timestamp)
         
-        async def verify_connection():
-            """Verify connection stability"""
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get('http://192.168.4.1', 
-                                        timeout=aiohttp.ClientTimeout(total=5)) as response:
-                        return response.status == 200
-            except:
-                return False
-        
-        for attempt in range(MAX_RETRIES):
-            try:
-                print(f"\nAttempt {attempt + 1}/{MAX_RETRIES}")
-                
-                if not await self.connect_to_esp32_wifi():
-                    print(f"Failed to establish WiFi connection on attempt {attempt + 1}")
-                    if attempt < MAX_RETRIES - 1:
-                        await asyncio.sleep(2)
-                    continue
-                
-                # Wait for connection stability
-                print("Waiting for connection stability...")
-                await asyncio.sleep(STABILITY_WAIT)
-                if not await verify_connection():
-                    print("Connection not stable, retrying...")
-                    continue
-                
-                # Configure optimized aiohttp session
-                timeout = aiohttp.ClientTimeout(
-                    total=300,      # 5 minutes total timeout
-                    connect=10,     # 10 seconds connect timeout
-                    sock_read=10,   # 10 seconds read timeout
-                    sock_connect=10 # 10 seconds socket connect timeout
-                )
-                
-                # TCP optimizations
-                connector = aiohttp.TCPConnector(
-                    force_close=True,
-                    enable_cleanup_closed=True,
-                    limit=1,  # Single connection for maximum throughput
-                    ttl_dns_cache=300,  # Cache DNS for 5 minutes
-                    use_dns_cache=True
-                )
-                
-                async with aiohttp.ClientSession(timeout=timeout, 
-                                            connector=connector,
-                                            raise_for_status=True) as session:
+        try:
+            for attempt in range(MAX_RETRIES):
+                try:
+                    print(f"\nAttempt {attempt + 1}/{MAX_RETRIES}")
                     
-                    # Test connection before starting download
-                    async with session.get('http://192.168.4.1') as response:
-                        if response.status != 200:
-                            raise aiohttp.ClientError(f"Server returned {response.status}")
+                    # Returns as soon as the AP is joined and the server answers
+                    if not await self.handover.connect(reset=attempt > 0):
+                        print(f"Failed to establish WiFi connection on attempt {attempt + 1}")
+                        continue
                     
+                    # Resumes from the .part file left by any earlier attempt. The
+                    # sink resamples chunks to SAMPLE_RATE as they arrive.
+                    downloader = ResumableDownloader(
+                        f"http://{self.handover.host}:{self.handover.port}/file",
+                        output + NATIVE_SUFFIX,
+                        chunk_size=CHUNK_SIZE,
+                        sink=ResamplingWavSink(output, SAMPLE_RATE),
+                        require_digest=True,
+                        disk=self.disk
+                    )
                     print("Starting file download...")
-                    async with session.get('http://192.168.4.1/file',
-                                        timeout=timeout) as response:
-                        
-                        total_size = int(response.headers.get('Content-Length', 0))
-                        if total_size == 0:
-                            raise ValueError("Content-Length header missing")
-                        
-                        filename = f"sdcard_recording_{self.current_file_timestamp}.wav"
-                        print(f"\nDownloading {total_size/1024/1024:.1f} MB to {filename}")
-                        
-                        with open(filename, 'wb') as f:
-                            received_size = 0
-                            start_time = time.time()
-                            last_progress_time = start_time
-                            last_speed_update = start_time
-                            speed_samples = []  # For calculating average speed
-                            
-                            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                                if chunk:  # Filter out empty chunks
-                                    f.write(chunk)
-                                    received_size += len(chunk)
-                                    
-                                    current_time = time.time()
-                                    elapsed = current_time - start_time
-                                    
-                                    # Update progress and speed every 0.5 seconds
-                                    if current_time - last_speed_update >= 0.5:
-                                        speed = received_size / elapsed / 1024 / 1024  # MB/s
-                                        speed_samples.append(speed)
-                                        if len(speed_samples) > 5:  # Keep last 5 samples
-                                            speed_samples.pop(0)
-                                        avg_speed = sum(speed_samples) / len(speed_samples)
-                                        
-                                        progress = (received_size / total_size) * 100
-                                        mbps = avg_speed * 8  # Convert MB/s to Mbps
-                                        
-                                        # Calculate ETA
-                                        remaining_bytes = total_size - received_size
-                                        eta_seconds = remaining_bytes / (received_size / elapsed)
-                                        
-                                        print(f"Progress: {progress:.1f}% "
-                                            f"Speed: {mbps:.1f} Mbps "
-                                            f"ETA: {eta_seconds:.1f}s", end='\r')
-                                        
-                                        last_speed_update = current_time
-                            
-                            # Final statistics
-                            total_time = time.time() - start_time
-                            avg_speed_mbps = (received_size / total_time / 1024 / 1024) * 8
-                            
-                            print(f"\n\nTransfer Complete:")
-                            print(f"Total size: {received_size/1024/1024:.2f} MB")
-                            print(f"Time: {total_time:.2f} seconds")
-                            print(f"Average speed: {avg_speed_mbps:.2f} Mbps")
-                            
-                            if received_size == total_size:
-                                print(f"\nFile saved successfully: {filename}")
-                                return True
-                            else:
-                                print(f"\nSize mismatch: {received_size}/{total_size}")
-                                if os.path.exists(filename):
-                                    os.remove(filename)
-                                
-            except aiohttp.ClientError as e:
-                print(f"Network error during attempt {attempt + 1}: {e}")
-            except Exception as e:
-                print(f"Error during attempt {attempt + 1}: {e}")
-            finally:
-                if attempt == MAX_RETRIES - 1:
-                    await self.restore_wifi()
+                    try:
+                        await downloader.run()
+                    finally:
+                        # Failed attempts that got data still count towards the metric
+                        ttfb = None
+                        if downloader.first_byte_time is not None:
+                            ttfb = self.handover.first_byte(downloader.first_byte_time)
+                    if not KEEP_SD_ORIGINAL:
+                        os.remove(downloader.filename)
+                        os.remove(downloader.filename + DIGEST_SUFFIX)
+                    print(f"\nFile saved successfully: {output}")
+                    if self.catalog:
+                        self.disk.post(self.catalog_download, timestamp, output)
+                    if ALIGN_RECORDINGS:
+                        await self.align_recordings(timestamp, output)
+                    await self.archive_session(timestamp)
+                    if ttfb is not None:
+                        print(f"WiFi handover: {self.handover.handover_time:.2f}s, "
+                              f"time to first byte: {ttfb:.2f}s")
+                    return True
+
+                except DownloadError as e:
+                    print(f"Download failed during attempt {attempt + 1}: {e}")
+                except NetworkError as e:
+                    print(f"WiFi handover failed during attempt {attempt + 1}: {e}")
+                except aiohttp.ClientError as e:
+                    print(f"Network error during attempt {attempt + 1}: {e}")
+                except Exception as e:
+                    print(f"Error during attempt {attempt + 1}: {e}")
+        finally:
+            await self.handover.restore()
         
         return False
+
+    async def align_recordings(self, timestamp, sd_file):
+        """Fill the BLE recording's lost frames from the SD copy (off the event loop)"""
+        ble_file = self.output_path("ble_recording", timestamp)
+        # The BLE file and its gap map are written by the disk writer; wait for them
+        await asyncio.wrap_future(self.disk.barrier())
+        if not os.path.exists(ble_file):
+            return None
+        try:
+            report = await asyncio.get_running_loop().run_in_executor(
+                None, align.repair, ble_file, sd_file)
+        except (OSError, ValueError) as e:
+            print(f"[{self.device_tag}] Could not align {ble_file}: {e}")
+            return None
+        print(f"[{self.device_tag}] Merged recording: {report['output']} "
+              f"(offset {report['offset_seconds']:.3f}s, drift {report['drift_ppm']:.1f} ppm, "
+              f"{report['repaired_frames']:.0f} frames repaired)")
+        if self.catalog:
+            self.disk.post(self.catalog.record_alignment, self.device_tag or "", timestamp,
+                           report['output'], report['offset_seconds'], report['drift_ppm'],
+                           int(report['repaired_frames']))
+        return report
+
+    async def archive_session(self, timestamp):
+        """Hand the session's finished recordings to the background archiver"""
+        archiver = get_archiver()
+        if archiver is None:
+            return
+        # Their last writes and catalog rows go through the disk writer; wait for them
+        await asyncio.wrap_future(self.disk.barrier())
+        for prefix in ("ble_recording", "sdcard_recording", align.MERGED_PREFIX):
+            path = self.output_path(prefix, timestamp)
+            if os.path.exists(path):
+                archiver.submit(path, self.catalog)
+
+    def catalog_download(self, timestamp, filename):
+        """Pair the SD card file with its session (runs on the disk writer)"""
+        self.catalog.attach_sdcard(self.device_tag or "", timestamp, filename, file_sha256(filename))
+
+    def catalog_session(self, timestamp, ended, duration, stats, filename):
+        """Record the finished session (runs on the disk writer after the file is closed)"""
+        self.catalog.finish_session(self.device_tag or "", timestamp, ended, duration, stats,
+                                    file_sha256(filename))
         
     def notification_handler(self, sender, data):
         """Handle incoming BLE notifications"""
         current_time = time.time()
         
-        # If we're getting data after a pause, this is a new session
-        if self.last_data_time and (current_time - self.last_data_time) > 1.0:
+        if self.link_down_at is not None:
+            self.resume_session(data, current_time)
+        # Normally the idle timer has already ended the previous session
+        elif self.last_data_time and (current_time - self.last_data_time) > SESSION_IDLE_TIMEOUT:
             if self.is_receiving:
-                # Previous session ended, save it
-                self.save_wav_file()
-                # Create task to download the SD card file
-                asyncio.create_task(self.download_wav_file())
-                self.reset_session()
+                self.end_session("Stream resumed after a pause")
         
         self.last_data_time = current_time
         self.is_receiving = True
@@ -392,172 +373,573 @@ class AudioStreamReceiver:
             self.start_time = current_time
             self.last_progress_time = current_time
             self.current_file_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Stream PCM to disk on the writer thread so memory stays flat for long sessions
+            self.wav_writer = BackgroundWavWriter(
+                self.disk, self.output_path("ble_recording"), SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+            )
+            if self.catalog:
+                self.disk.post(self.catalog.start_session, self.device_tag or "",
+                               self.current_file_timestamp, self.start_time, self.address,
+                               self.wav_writer.filename)
+            self.arm_idle_timer(SESSION_IDLE_TIMEOUT)
             
         if len(data) < 3:  # Ensure we have at least the header
-            print(f"Warning: Received incomplete frame (length: {len(data)})")
+            self.totals['truncated'] += 1
+            metrics.CONSOLE.emit(f"truncated {self.labels['device']}",
+                                 f"Warning: Received incomplete frame (length: {len(data)})")
             return
             
-        # Parse the 3-byte header from ESP32
-        frame_count = data[0] | (data[1] << 8)
-        
-        # Check for frame sequence continuity
-        if self.last_frame_count is not None:
-            expected_frame = (self.last_frame_count + 1) & 0xFFFF
-            if frame_count != expected_frame:
-                self.frame_stats['drops'] += 1
-                if frame_count < self.last_frame_count:
-                    self.frame_stats['out_of_order'] += 1
-                print(f"Frame discontinuity: Expected {expected_frame}, Got {frame_count}")
-        
-        self.last_frame_count = frame_count
-        
-        # Extract the actual audio data (skip header)
-        audio_data = data[3:]
-        
-        # Verify the data length matches our expectations
-        expected_length = self.samples_per_frame * 2  # 16-bit samples = 2 bytes per sample
-        if len(audio_data) != expected_length:
-            self.frame_stats['invalid_size'] += 1
-            print(f"Warning: Unexpected data length. Expected: {expected_length}, Got: {len(audio_data)}")
-        
-        self.audio_data.extend(audio_data)
+        # Buffer the raw frame; headers are parsed once per batch
         self.frames_received += 1
+        self.arrivals.append(current_time)
+        # Release audio as its window closes, not once per decoder batch
+        if self.decoder.push(data) or self.jitter.due:
+            self.write_pcm(self.jitter.flush())
+        if len(self.arrivals) > self.decoder.batch_frames:
+            self.record_arrivals()
+            self.publish_metrics()
         
-        # Print progress every second
+        # Update the rate gauge every second; the console copy is rate limited
         if self.last_progress_time and (current_time - self.last_progress_time) >= 1.0:
-            kb_received = len(self.audio_data) / 1024
-            duration = len(self.audio_data) / (SAMPLE_RATE * SAMPLE_WIDTH)
-            frames_per_second = self.frames_received / (current_time - self.start_time)
-            print(f"\nStatus Update:")
-            print(f"Received: {kb_received:.2f} KB ({duration:.1f} seconds)")
-            print(f"Current frame: {frame_count}")
-            print(f"Average frames/second: {frames_per_second:.1f}")
-            print(f"Frame drops: {self.frame_stats['drops']}")
-            print(f"Out of order frames: {self.frame_stats['out_of_order']}")
-            print(f"Invalid sized frames: {self.frame_stats['invalid_size']}")
+            FRAME_RATE.set((self.frames_received - self.last_progress_frames)
+                           / (current_time - self.last_progress_time), **self.labels)
+            self.last_progress_frames = self.frames_received
+            metrics.CONSOLE.emit(f"status {self.labels['device']}",
+                                 lambda: self.format_status(current_time))
             self.last_progress_time = current_time
 
-    async def check_stream_status(self):
-        """Periodically check if we've stopped receiving data"""
-        while True:
-            await asyncio.sleep(1)
-            current_time = time.time()
-            
-            if (self.is_receiving and self.last_data_time and 
-                (current_time - self.last_data_time) > 1.0):
-                print("\nStream stopped, saving recording...")
-                self.save_wav_file()
-                # Create task to download the SD card file
-                asyncio.create_task(self.download_wav_file())
-                self.reset_session()
+    def format_status(self, current_time):
+        kb_received = self.bytes_received / 1024
+        duration = self.bytes_received / (SAMPLE_RATE * SAMPLE_WIDTH)
+        frames_per_second = self.frames_received / (current_time - self.start_time)
+        return "\n".join([
+            f"\nStatus Update:",
+            f"Received: {kb_received:.2f} KB ({duration:.1f} seconds)",
+            f"Current frame: {self.decoder.last_raw}",
+            f"Average frames/second: {frames_per_second:.1f}",
+            f"Frame drops: {self.frame_stats['drops']}",
+            f"Out of order frames: {self.frame_stats['out_of_order']}",
+            f"Late frames discarded: {self.frame_stats['late']}",
+            f"Invalid sized frames: {self.frame_stats['invalid_size']}",
+            f"Undecodable frames: {self.frame_stats['unsupported']}"
+        ])
+
+    def write_pcm(self, pcm):
+        """Append in-order PCM to the session's WAV file and pass it downstream"""
+        if not pcm.size:
+            return
+        self.wav_writer.write(pcm.tobytes())
+        self.bytes_received += pcm.nbytes
+        for consumer in self.pcm_consumers:
+            consumer(pcm)
+
+    def arm_idle_timer(self, delay):
+        self.idle_timer = asyncio.get_running_loop().call_later(delay, self.check_idle)
+
+    def cancel_idle_timer(self):
+        if self.idle_timer:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def check_idle(self):
+        """Idle timer callback; re-arms itself while notifications keep arriving
+
+        Re-arming only when the timer fires costs one timer per idle
+        period instead of one per notification.
+        """
+        self.idle_timer = None
+        if not self.is_receiving:
+            return
+        remaining = self.last_data_time + SESSION_IDLE_TIMEOUT - time.time()
+        if remaining > 0:
+            self.arm_idle_timer(remaining)
+        elif self.link_probe:
+            asyncio.create_task(self.confirm_idle(self.link_probe))
+        else:
+            self.end_session("Stream stopped")
+
+    async def confirm_idle(self, probe):
+        """Tell a stopped recording from a stalled link before ending the session
+
+        A link that stops delivering looks connected until its supervision
+        timeout runs out, so the silence alone can't say which it is. The
+        device answers a read at once when only the recording stopped.
+        """
+        alive = await probe()
+        if not self.is_receiving or self.link_down_at is not None or self.idle_timer:
+            return
+        remaining = self.last_data_time + SESSION_IDLE_TIMEOUT - time.time()
+        if remaining > 0:
+            # Frames came back while we were asking
+            self.arm_idle_timer(remaining)
+        elif alive:
+            self.end_session("Stream stopped")
+        else:
+            self.link_lost()
+
+    def link_lost(self):
+        """Hold the session open while the device reconnects
+
+        The firmware keeps recording and numbering frames while the link is
+        down, so when notifications come back the outage is filled in, noted
+        in the gap map for align.py, and the recording carries on in the
+        same file. A device that stays away past RESUME_TIMEOUT ends the
+        session as usual.
+        """
+        if not self.is_receiving or self.link_down_at is not None:
+            return
+        self.cancel_idle_timer()
+        # Decode what arrived so the decoder knows the last frame before the outage
+        self.write_pcm(self.jitter.flush())
+        self.link_down_at = time.time()
+        print(f"\n[{self.device_tag}] Link lost, holding the session for {RESUME_TIMEOUT:.0f}s")
+        self.idle_timer = asyncio.get_running_loop().call_later(RESUME_TIMEOUT, self.resume_expired)
+
+    def resume_expired(self):
+        self.idle_timer = None
+        self.link_down_at = None
+        self.end_session("Device did not reconnect")
+
+    def resume_session(self, data, current_time):
+        """First notification after a reconnect: continue the held session if it belongs to it"""
+        self.cancel_idle_timer()
+        self.link_down_at = None
+        # Frames the device numbered while the link was down, with room for clock slack
+        outage = int((current_time - self.last_data_time) * SAMPLE_RATE / self.samples_per_frame)
+        allowance = outage + self.decoder.max_gap_frames
+        last_raw = self.decoder.last_raw
+        ahead = ((data[0] | data[1] << 8) - last_raw) & 0xFFFF if len(data) >= 3 and last_raw is not None else 0
+        if ahead > allowance:
+            # The numbering doesn't fit the outage: the device started a new recording
+            self.end_session("Device restarted recording")
+            return
+        self.decoder.expect_gap(allowance)
+        self.totals['resumes'] += 1
+        print(f"\n[{self.device_tag}] Link back after {current_time - self.last_data_time:.1f}s, "
+              f"continuing {os.path.basename(self.wav_writer.filename)}")
+        self.arm_idle_timer(SESSION_IDLE_TIMEOUT)
+
+    def end_session(self, reason):
+        """Finalize the current session and fetch its SD card copy"""
+        print(f"\n{reason}, saving recording...")
+        self.save_wav_file()
+        asyncio.create_task(self.download_wav_file(self.current_file_timestamp))
+        self.reset_session()
 
     def save_wav_file(self):
-        """Save the collected audio data as a WAV file"""
-        if not self.audio_data:
+        """Finalize the streamed WAV file for this session
+
+        Only queues the file work; returns a Future for the writer thread
+        finishing it, or None if there was nothing to save.
+        """
+        self.cancel_idle_timer()
+        if not self.wav_writer:
             print("No audio data collected!")
-            return
-            
-        # Use the timestamp from when we started recording
-        filename = f"ble_recording_{self.current_file_timestamp}.wav"
-            
-        with wave.open(filename, 'wb') as wav_file:
-            wav_file.setnchannels(CHANNELS)
-            wav_file.setsampwidth(SAMPLE_WIDTH)
-            wav_file.setframerate(SAMPLE_RATE)
-            wav_file.writeframes(self.audio_data)
+            return None
+
+        # Release everything still held for reordering, then patch the header sizes
+        self.write_pcm(self.jitter.drain())
+        for consumer in self.pcm_consumers:
+            end_session = getattr(consumer, 'end_session', None)
+            if end_session:
+                end_session()
+        filename = self.wav_writer.filename
+        done = self.wav_writer.close()
+        self.wav_writer = None
+        if not self.bytes_received:
+            print("No audio data collected!")
+            if self.catalog:
+                self.disk.post(self.catalog.drop_session, self.device_tag or "",
+                               self.current_file_timestamp)
+            return self.disk.submit(os.remove, filename)
             
+        self.record_arrivals()
+        self.publish_metrics()
+        # Which frames were filled in, so align.py can patch them from the SD copy
+        self.disk.post(align.write_gap_map, filename, self.decoder.gaps, self.decoder.samples_per_frame,
+                       SAMPLE_RATE)
+        if self.catalog:
+            stats = dict(self.frame_stats, frames=self.frames_received)
+            self.disk.post(self.catalog_session, self.current_file_timestamp, self.last_data_time,
+                           self.bytes_received / (SAMPLE_RATE * SAMPLE_WIDTH), stats, filename)
+        # Built now, before reset_session() clears the counters; printed off the loop
+        if metrics.CONSOLE.enabled:
+            self.disk.post(metrics.CONSOLE.emit, f"summary {self.labels['device']}",
+                             self.format_summary(filename), True)
+        return done
+
+    def format_summary(self, filename):
         duration = time.time() - self.start_time if self.start_time else 0
         expected_frames = duration * SAMPLE_RATE / self.samples_per_frame
-        
-        print("\n=== Recording Summary ===")
-        print(f"Audio saved to: {filename}")
-        print(f"Total frames received: {self.frames_received}")
-        print(f"Expected frames: {expected_frames:.0f}")
-        print(f"Recording duration: {duration:.1f} seconds")
-        print(f"File size: {len(self.audio_data)/1024:.1f} KB")
-        print(f"Average frame rate: {self.frames_received/duration:.1f} frames/second")
-        print("\nFrame Statistics:")
-        print(f"- Dropped frames: {self.frame_stats['drops']}")
-        print(f"- Out of order frames: {self.frame_stats['out_of_order']}")
-        print(f"- Invalid sized frames: {self.frame_stats['invalid_size']}")
+        lines = [
+            "\n=== Recording Summary ===",
+            f"Audio saved to: {filename}",
+            f"Total frames received: {self.frames_received}",
+            f"Expected frames: {expected_frames:.0f}",
+            f"Recording duration: {duration:.1f} seconds",
+            f"File size: {self.bytes_received/1024:.1f} KB",
+            f"Average frame rate: {self.frames_received/max(duration, 1e-6):.1f} frames/second",
+            "\nFrame Statistics:",
+            f"- Dropped frames (filled): {self.frame_stats['drops']}",
+            f"- Out of order frames: {self.frame_stats['out_of_order']}",
+            f"- Late frames discarded: {self.frame_stats['late']}",
+            f"- Invalid sized frames: {self.frame_stats['invalid_size']}",
+            f"- Undecodable frames (silenced): {self.frame_stats['unsupported']}",
+            f"- Reordered frames: {self.jitter.stats['reordered']} "
+            f"(mean depth {self.jitter.mean_reorder_depth:.1f}, "
+            f"max {self.jitter.stats['max_reorder_depth']})",
+            f"- Reorder depth histogram: {self.jitter.format_histogram()}"
+        ]
         
         # Calculate actual vs expected data rate
         expected_bytes = duration * SAMPLE_RATE * SAMPLE_WIDTH
-        actual_bytes = len(self.audio_data)
+        actual_bytes = self.bytes_received
         data_ratio = actual_bytes / expected_bytes if expected_bytes > 0 else 0
-        print(f"\nData completeness: {data_ratio:.2%}")
+        lines.append(f"\nData completeness: {data_ratio:.2%}")
         if abs(1 - data_ratio) > 0.1:  # More than 10% off
-            print("Warning: Significant difference between expected and actual data rate")
-            print("This might explain any speed issues in the recording")
+            lines.append("Warning: Significant difference between expected and actual data rate")
+            lines.append("This might explain any speed issues in the recording")
         
-        print("\nAttempting to download SD card file...")
+        lines.append("\nAttempting to download SD card file...")
+        return "\n".join(lines)
 
-async def find_device():
-    """Scan for esp32 device"""
-    print("Scanning for esp32 device...")
+async def request_codec(client, codec, tag=None):
+    """Ask the device to encode frames with `codec`
+
+    Firmware without the codec characteristic keeps sending PCM. Either
+    way every frame names its codec in the header, so the decoder follows
+    whatever actually arrives.
+    """
+    services = getattr(client, 'services', None)
+    if services is None or services.get_characteristic(CODEC_CHARACTERISTIC_UUID) is None:
+        if codec != "pcm16":
+            print(f"[{tag}] Device has no codec selection, streaming PCM")
+        return
     try:
-        devices = await BleakScanner.discover()
-        for device in devices:
-            if device.name and DEVICE_NAME in device.name:
-                print(f"Found {DEVICE_NAME} device: {device.address}")
-                return device.address
-            elif device.name:
-                print(f"Found device: {device.name} ({device.address})")
+        await client.write_gatt_char(CODEC_CHARACTERISTIC_UUID, bytes((CODECS[codec],)), response=True)
+    except Exception as e:
+        print(f"[{tag}] Could not select {codec} codec: {e}")
+
+class DeviceCache:
+    """Addresses of units connected before, so startup can connect without a scan
+
+    Kept as JSON next to the recordings; saves go through the disk writer.
+    """
+
+    def __init__(self, path, disk=None):
+        self.path = path
+        self.disk = disk or get_disk_writer()
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (OSError, ValueError):
+            self.devices = {}
+
+    def addresses(self):
+        """(address, name) pairs, most recently connected first"""
+        ranked = sorted(self.devices.items(), key=lambda item: -item[1]['last_connected'])
+        return [(address, entry['name']) for address, entry in ranked]
+
+    def remember(self, address, name):
+        self.devices[address] = {'name': name, 'last_connected': time.time()}
+        for address, _ in self.addresses()[MAX_KNOWN_DEVICES:]:
+            del self.devices[address]
+        self.disk.post(self.save, dict(self.devices))
+
+    def save(self, devices):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(devices, f, indent=2)
+        os.replace(tmp, self.path)
+
+class DeviceIngest:
+    """Keeps one pocket unit connected and streaming into its own receiver"""
+
+    def __init__(self, address, name, connect_lock, output_dir=OUTPUT_DIR, known=None,
+                 client_class=None, codec=BLE_CODEC):
+        if client_class is None:
+            from bleak import BleakClient as client_class
+        self.address = address
+        self.name = name
+        self.connect_lock = connect_lock
+        self.known = known
+        self.client_class = client_class
+        self.codec = codec
+        self.receiver = AudioStreamReceiver(address=address, output_dir=output_dir)
+        self.device = None        # Latest BLEDevice from the scanner, if it has advertised
+        self.advertised = asyncio.Event()
+        self.connected = False
+        self.connects = 0
+        self.last_error = None
+        self.last_bytes = 0
+
+    def saw_advertisement(self, device):
+        """Scanner callback for each advertisement from this unit"""
+        self.device = device
+        self.advertised.set()
+
+    async def wait_for_advertisement(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.advertised.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stream(self, loop):
+        """Connect, subscribe and stream until the link drops; True if it got that far"""
+        tag = self.receiver.device_tag
+        disconnected = asyncio.Event()
+        # The scanner's BLEDevice lets bleak connect without scanning for the address again
+        client = self.client_class(
+            self.device or self.address,
+            timeout=CONNECT_TIMEOUT if self.advertised.is_set() else DIRECT_CONNECT_TIMEOUT,
+            disconnected_callback=lambda c: loop.call_soon_threadsafe(disconnected.set)
+        )
+
+        async def link_alive():
+            try:
+                await asyncio.wait_for(client.read_gatt_char(CHARACTERISTIC_UUID), LINK_PROBE_TIMEOUT)
+                return True
+            except Exception:
+                # A stalled link: drop it rather than wait out the supervision timeout
+                disconnected.set()
+                return False
+
+        self.advertised.clear()
+        started = time.perf_counter()
+        try:
+            # Serialize connection setup; streaming itself runs concurrently
+            async with self.connect_lock:
+                print(f"[{tag}] Connecting to {self.name} at {self.address}...")
+                await client.connect()
+                await request_codec(client, self.codec, tag)
+                await client.start_notify(
+                    CHARACTERISTIC_UUID,
+                    self.receiver.notification_handler
+                )
+            self.connected = True
+            CONNECTED.set(1, **self.receiver.labels)
+            self.connects += 1
+            self.receiver.link_probe = link_alive
+            if self.known:
+                self.known.remember(self.address, self.name)
+            print(f"[{tag}] Streaming from {self.address} ({time.perf_counter() - started:.2f}s to subscribe)")
+            await disconnected.wait()
+            print(f"[{tag}] Disconnected from {self.address}")
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[{tag}] Connection error: {e}")
+            return False
+        finally:
+            self.receiver.link_probe = None
+            self.connected = False
+            CONNECTED.set(0, **self.receiver.labels)
+            if client.is_connected:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+
+    async def run(self):
+        """Connect, stream until the link drops, then reconnect
+
+        The firmware keeps recording through a dropped link, so the receiver
+        holds the session and the next attempt starts straight away. Failed
+        attempts back off, but an advertisement from the unit cuts the wait
+        short.
+        """
+        loop = asyncio.get_running_loop()
+        delay = RECONNECT_MIN_DELAY
+        try:
+            while True:
+                if await self.stream(loop):
+                    self.receiver.link_lost()
+                    delay = RECONNECT_MIN_DELAY
+                    continue
+                await asyncio.sleep(RECONNECT_MIN_DELAY)
+                await self.wait_for_advertisement(delay - RECONNECT_MIN_DELAY)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            if self.receiver.wav_writer:
+                self.receiver.save_wav_file()
+
+class IngestManager:
+    """Discovers every pocket unit and runs one DeviceIngest per device
+
+    Units connected before are remembered in KNOWN_DEVICES_FILE and
+    connected to by address at startup, while a scanner filtered on the
+    audio service picks up new units and tells known ones when they
+    advertise again.
+    """
+
+    def __init__(self, output_dir=OUTPUT_DIR, max_concurrent_connects=MAX_CONCURRENT_CONNECTS,
+                 live_transcription=LIVE_TRANSCRIPTION, client_class=None, scanner_class=None,
+                 codec=BLE_CODEC):
+        if client_class is None or scanner_class is None:
+            # bleak is only imported by code that talks to real units
+            from bleak import BleakClient, BleakScanner
+            client_class = client_class or BleakClient
+            scanner_class = scanner_class or BleakScanner
+        self.output_dir = output_dir
+        self.connect_lock = asyncio.Semaphore(max_concurrent_connects)
+        self.client_class = client_class
+        self.scanner_class = scanner_class
+        self.codec = codec
+        self.known = DeviceCache(os.path.join(output_dir, KNOWN_DEVICES_FILE)) if KNOWN_DEVICES_FILE else None
+        self.devices = {}
+        self.tasks = {}
+        self.transcription_worker = TranscriptionWorker(LIVE_MODEL) if live_transcription else None
+
+    def add_device(self, address, name):
+        ingest = DeviceIngest(address, name, self.connect_lock, self.output_dir, self.known,
+                              self.client_class, self.codec)
+        if self.transcription_worker:
+            ingest.receiver.pcm_consumers.append(
+                LiveTranscriber(self.transcription_worker, label=ingest.receiver.device_tag)
+            )
+        self.devices[address] = ingest
+        self.tasks[address] = asyncio.create_task(ingest.run())
+        return ingest
+
+    def detection_callback(self, device, advertisement_data):
+        """Start an ingest for each new unit and wake known ones waiting to reconnect"""
+        ingest = self.devices.get(device.address)
+        if ingest is None:
+            name = device.name or advertisement_data.local_name
+            if (SERVICE_UUID not in (advertisement_data.service_uuids or ())
+                    and not (name and DEVICE_NAME in name)):
+                return
+            print(f"Found {DEVICE_NAME} device: {device.address}")
+            ingest = self.add_device(device.address, name or DEVICE_NAME)
+        ingest.saw_advertisement(device)
+
+    def print_stats(self, interval):
+        """Print per-device throughput and drop counters"""
+        lines = [f"\n=== Ingest Status ({len(self.devices)} devices) ==="]
+        for address, ingest in self.devices.items():
+            stats = ingest.receiver.stats_snapshot()
+            kbps = (stats['bytes'] - ingest.last_bytes) / interval / 1024
+            ingest.last_bytes = stats['bytes']
+            state = "up" if ingest.connected else "down"
+            lines.append(f"{address} [{state}] {kbps:.1f} KB/s "
+                         f"frames={stats['frames']} drops={stats['drops']} "
+                         f"out_of_order={stats['out_of_order']} invalid={stats['invalid_size']} "
+                         f"sessions={stats['sessions']} resumes={stats['resumes']} "
+                         f"connects={ingest.connects}")
+        metrics.CONSOLE.emit("ingest", "\n".join(lines), force=True)
+
+    def recover_unfinished_recordings(self):
+        """Repair BLE recordings left with unpatched headers by a crash"""
+        for filename in glob.glob(os.path.join(self.output_dir, "ble_recording_*.wav")):
+            try:
+                if needs_recovery(filename):
+                    size = recover_wav(filename)
+                    print(f"Recovered unfinished recording {filename} ({size/1024:.1f} KB)")
+            except (OSError, ValueError) as e:
+                print(f"Could not recover {filename}: {e}")
+
+    async def start_exporters(self):
+        """Start the Prometheus endpoint and JSON-lines snapshots if configured"""
+        metrics.CONSOLE.enabled = CONSOLE_STATS
+        runner = exporter = None
+        if METRICS_PORT:
+            try:
+                runner = await metrics.serve_metrics(port=METRICS_PORT)
+                print(f"Metrics at http://{metrics.METRICS_HOST}:{METRICS_PORT}/metrics")
+            except OSError as e:
+                print(f"Could not start metrics endpoint on port {METRICS_PORT}: {e}")
+        if METRICS_JSONL:
+            exporter = asyncio.create_task(metrics.JsonLinesExporter(METRICS_JSONL).run())
+        return runner, exporter
+
+    async def start_ingest(self):
+        """Connect to known units and start scanning for the rest; returns the scanner"""
+        for address, name in self.known.addresses() if self.known else ():
+            print(f"Connecting to known {DEVICE_NAME} device: {address}")
+            self.add_device(address, name)
+        # Filtering on the service reports a unit from its first advertisement,
+        # without waiting for the scan response that carries the name
+        scanner = self.scanner_class(detection_callback=self.detection_callback, service_uuids=[SERVICE_UUID])
+        print(f"Scanning for {DEVICE_NAME} devices...")
+        await scanner.start()
+        return scanner
+
+    async def stop_ingest(self, scanner):
+        """Stop scanning and every device, saving recordings in progress"""
+        await scanner.stop()
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def run(self):
+        """Scan continuously and report stats until cancelled"""
+        self.recover_unfinished_recordings()
+        runner, exporter = await self.start_exporters()
+        if self.transcription_worker:
+            self.transcription_worker.start()
+        scanner = await self.start_ingest()
+        try:
+            while True:
+                await asyncio.sleep(STATS_INTERVAL)
+                self.print_stats(STATS_INTERVAL)
+        finally:
+            await self.stop_ingest(scanner)
+            if self.transcription_worker:
+                self.transcription_worker.stop()
+            if exporter:
+                exporter.cancel()
+                await asyncio.gather(exporter, return_exceptions=True)
+            if runner:
+                await runner.cleanup()
+            # Let queued writes and header patches reach the disk
+            await asyncio.get_running_loop().run_in_executor(None, get_disk_writer().stop)
+            if _archiver:
+                # Files already being transcoded finish; queued ones are left as WAVs
+                await asyncio.get_running_loop().run_in_executor(None, _archiver.shutdown)
+
+async def find_device(timeout=SCAN_TIMEOUT):
+    """Scan for an esp32 device, returning its address as soon as one advertises"""
+    from bleak import BleakScanner
+    print(f"Scanning for {DEVICE_NAME} device...")
+    try:
+        device = await BleakScanner.find_device_by_filter(
+            lambda d, adv: SERVICE_UUID in adv.service_uuids or DEVICE_NAME in (d.name or adv.local_name or ""),
+            timeout=timeout,
+            service_uuids=[SERVICE_UUID]
+        )
     except Exception as e:
         print(f"Error during scanning: {e}")
+        return None
+    if device:
+        print(f"Found {DEVICE_NAME} device: {device.address}")
+        return device.address
     return None
 
-async def main():
-    # Find OpenGlass device
-    address = await find_device()
-    if not address:
-        print(f"{DEVICE_NAME} device not found!")
-        return
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record every pocket unit in range over BLE and fetch its SD card copy")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR,
+                        help="Directory for recordings, the catalog and known devices")
+    parser.add_argument('--connects', type=int, default=MAX_CONCURRENT_CONNECTS,
+                        help="Connection attempts in flight at once")
+    parser.add_argument('--live-transcription', action='store_true', default=LIVE_TRANSCRIPTION,
+                        help=f"Transcribe the BLE stream as it arrives (Whisper {LIVE_MODEL})")
+    parser.add_argument('--codec', choices=('pcm16', 'mulaw', 'adpcm'), default=BLE_CODEC,
+                        help="Codec to request for the BLE stream; mulaw and adpcm are lossy")
+    args = parser.parse_args(argv)
 
-    # Create receiver instance
-    receiver = AudioStreamReceiver()
-    
+    async def ingest():
+        # Build the manager inside the loop so its locks bind to it
+        manager = IngestManager(args.output_dir, args.connects, args.live_transcription,
+                                codec=args.codec)
+        print("\nReady for recording... Use serial monitor to start/stop")
+        await manager.run()
     try:
-        print(f"Attempting to connect to {DEVICE_NAME} at {address}...")
-        async with BleakClient(address, timeout=20.0) as client:
-            print(f"Connected to {DEVICE_NAME}")
-            
-            # Get services (for debugging)
-            services = await client.get_services()
-            print("\nAvailable services and characteristics:")
-            for service in services:
-                print(f"Service: {service.uuid}")
-                for char in service.characteristics:
-                    print(f"  Characteristic: {char.uuid}")
-                    print(f"    Properties: {char.properties}")
-            
-            # Start notification handler
-            print(f"\nStarting notifications for characteristic: {CHARACTERISTIC_UUID}")
-            await client.start_notify(
-                CHARACTERISTIC_UUID, 
-                receiver.notification_handler
-            )
-            
-            # Start the stream status checker
-            status_checker = asyncio.create_task(receiver.check_stream_status())
-            
-            print("\nReady for recording... Use serial monitor to start/stop")
-            try:
-                while True:
-                    await asyncio.sleep(1)
-            except asyncio.CancelledError:
-                status_checker.cancel()
-                
+        asyncio.run(ingest())
     except KeyboardInterrupt:
-        print("\nConnection terminated by user")
-    except Exception as e:
-        print(f"\nError: {e}")
-        print("If you're seeing a timeout error, try running the script again.")
-    finally:
-        # Save any remaining audio data
-        if receiver.audio_data:
-            receiver.save_wav_file()
+        print("\nIngest terminated by user")
 
 if __name__ == "__main__":
     # For macOS, you might need to run with sudo
-    asyncio.run(main())
+    main()
@@ -0,0 +1,382 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+CATALOG_FILE = "catalog.db"
+SCHEMA_VERSION = 2
+STAMP_FORMAT = "%Y%m%d_%H%M%S"
+# ble_recording_<stamp>[_<device tag>].wav and sdcard_recording_<stamp>[_<device tag>].wav,
+# or their .flac/.opus archives
+RECORDING_PATTERN = re.compile(r'^(ble|sdcard)_recording_(\d{8}_\d{6})(?:_([0-9A-Fa-f]+))?\.(?:wav|flac|opus)$')
+TRANSCRIPT_LINE = re.compile(r'^\[(.+?)\] \((\d+(?:\.\d+)?)s - (\d+(?:\.\d+)?)s\): ?(.*)$')
+STAT_COLUMNS = ('frames', 'drops', 'out_of_order', 'late', 'invalid_size')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    device_tag TEXT NOT NULL,           -- Last 6 hex digits of the address, as in file names
+    stamp TEXT NOT NULL,                -- Timestamp shared by the session's BLE and SD files
+    device TEXT,                        -- Full BLE address when known
+    started REAL NOT NULL,
+    ended REAL,
+    duration REAL,
+    ble_file TEXT,
+    ble_sha256 TEXT,
+    sdcard_file TEXT,
+    sdcard_sha256 TEXT,
+    frames INTEGER,
+    drops INTEGER,
+    out_of_order INTEGER,
+    late INTEGER,
+    invalid_size INTEGER,
+    stats TEXT,                         -- Every frame counter as JSON
+    merged_file TEXT,                   -- Gap-free recording built by align.py
+    sd_offset REAL,                     -- Seconds into the SD file where the BLE stream starts
+    drift_ppm REAL,
+    repaired_frames INTEGER,
+    UNIQUE (device_tag, stamp)
+);
+CREATE INDEX IF NOT EXISTS sessions_device_started ON sessions (device_tag, started);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE INDEX IF NOT EXISTS sessions_ble_file ON sessions (ble_file);
+CREATE INDEX IF NOT EXISTS sessions_sdcard_file ON sessions (sdcard_file);
+
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER REFERENCES sessions (id) ON DELETE CASCADE,
+    audio_file TEXT NOT NULL UNIQUE,
+    transcript_file TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transcripts_session ON transcripts (session_id);
+
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    transcript_id INTEGER NOT NULL REFERENCES transcripts (id) ON DELETE CASCADE,
+    session_id INTEGER,
+    speaker TEXT NOT NULL,
+    start_time REAL NOT NULL,           -- Seconds from the start of the recording
+    end_time REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_speaker ON turns (speaker, session_id);
+CREATE INDEX IF NOT EXISTS turns_transcript ON turns (transcript_id, start_time);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, start_time);
+
+-- Full-text index over turn text, kept in step with turns by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5 (text, content='turns', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS turns_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# Columns added after a schema version, for catalogs created before it
+MIGRATIONS = {
+    2: ("ALTER TABLE sessions ADD COLUMN merged_file TEXT",
+        "ALTER TABLE sessions ADD COLUMN sd_offset REAL",
+        "ALTER TABLE sessions ADD COLUMN drift_ppm REAL",
+        "ALTER TABLE sessions ADD COLUMN repaired_frames INTEGER"),
+}
+
+def device_tag(address):
+    """Short device id used in file names: last 6 hex digits of the address"""
+    return address.replace(':', '')[-6:].upper() if address else ""
+
+def stamp_time(stamp):
+    return datetime.strptime(stamp, STAMP_FORMAT).timestamp()
+
+def parse_recording_name(path):
+    """(kind, stamp, device_tag) from a recording's file name, or None"""
+    match = RECORDING_PATTERN.match(os.path.basename(path))
+    if not match:
+        return None
+    kind, stamp, tag = match.groups()
+    return kind, stamp, (tag or "").upper()
+
+def parse_time(value):
+    """Epoch seconds from a number or an ISO date/time string"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def read_transcript(path):
+    """Turns from a transcript.txt-format file as (start, end, speaker, text)"""
+    turns = []
+    with open(path) as f:
+        for line in f:
+            match = TRANSCRIPT_LINE.match(line.rstrip("\n"))
+            if match:
+                speaker, start, end, text = match.groups()
+                turns.append((float(start), float(end), speaker, text))
+    return turns
+
+class Catalog:
+    """SQLite index of recording sessions, their files and their transcripts
+
+    A session is keyed by (device tag, timestamp), the same pair that names
+    its ble_recording_* and sdcard_recording_* files, so the two copies
+    pair up without listing directories. One connection is shared by all
+    threads and serialized with a lock; WAL mode lets other processes
+    (e.g. the transcription daemon) read while the ingest writes.
+    """
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("PRAGMA foreign_keys=ON")
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            existing = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'sessions'").fetchone()
+            if existing:
+                for step in range(version + 1, SCHEMA_VERSION + 1):
+                    for statement in MIGRATIONS.get(step, ()):
+                        self.db.execute(statement)
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def execute(self, sql, params=()):
+        with self.lock, self.db:
+            return self.db.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+    # --- Sessions -----------------------------------------------------------
+
+    def start_session(self, tag, stamp, started, device=None, ble_file=None):
+        """Record a session as soon as it begins; returns its id"""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO sessions (device_tag, stamp, device, started, ble_file) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (device_tag, stamp) DO UPDATE SET "
+                "device = coalesce(excluded.device, device), "
+                "ble_file = coalesce(excluded.ble_file, ble_file)",
+                (tag.upper(), stamp, device, started, ble_file and os.path.abspath(ble_file)))
+            return self.db.execute("SELECT id FROM sessions WHERE device_tag = ? AND stamp = ?",
+                                   (tag.upper(), stamp)).fetchone()[0]
+
+    def finish_session(self, tag, stamp, ended, duration, stats=None, ble_sha256=None):
+        """Store the end time, duration and frame statistics of a session"""
+        stats = dict(stats or {})
+        self.execute(
+            "UPDATE sessions SET ended = ?, duration = ?, ble_sha256 = coalesce(?, ble_sha256), "
+            "frames = ?, drops = ?, out_of_order = ?, late = ?, invalid_size = ?, stats = ? "
+            "WHERE device_tag = ? AND stamp = ?",
+            (ended, duration, ble_sha256, *(stats.get(column) for column in STAT_COLUMNS),
+             json.dumps(stats), tag.upper(), stamp))
+
+    def drop_session(self, tag, stamp):
+        """Forget a session that produced no audio"""
+        self.execute("DELETE FROM sessions WHERE device_tag = ? AND stamp = ?", (tag.upper(), stamp))
+
+    def attach_sdcard(self, tag, stamp, path, sha256=None):
+        """Pair a downloaded SD card file with its BLE session"""
+        self.start_session(tag, stamp, stamp_time(stamp))
+        self.execute("UPDATE sessions SET sdcard_file = ?, sdcard_sha256 = ? "
+                     "WHERE device_tag = ? AND stamp = ?",
+                     (os.path.abspath(path), sha256, tag.upper(), stamp))
+
+    def record_alignment(self, tag, stamp, merged_file, sd_offset, drift_ppm, repaired_frames):
+        """Store the result of aligning a session's BLE and SD captures"""
+        self.execute("UPDATE sessions SET merged_file = ?, sd_offset = ?, drift_ppm = ?, "
+                     "repaired_frames = ? WHERE device_tag = ? AND stamp = ?",
+                     (os.path.abspath(merged_file), sd_offset, drift_ppm, repaired_frames,
+                      tag.upper(), stamp))
+
+    def move_file(self, old, new):
+        """Point every reference to a recording at its new path, e.g. its archive"""
+        old, new = os.path.abspath(old), os.path.abspath(new)
+        with self.lock, self.db:
+            for column in ('ble_file', 'sdcard_file', 'merged_file'):
+                self.db.execute(f"UPDATE sessions SET {column} = ? WHERE {column} = ?", (new, old))
+            # A transcript made from the archive itself supersedes the WAV's
+            self.db.execute("UPDATE OR REPLACE transcripts SET audio_file = ? WHERE audio_file = ?", (new, old))
+
+    def session_for_file(self, path):
+        """The session a BLE or SD card recording belongs to, or None"""
+        path = os.path.abspath(path)
+        rows = self.query("SELECT * FROM sessions WHERE ble_file = ? OR sdcard_file = ?", (path, path))
+        if rows:
+            return rows[0]
+        parsed = parse_recording_name(path)
+        if parsed:
+            _, stamp, tag = parsed
+            rows = self.query("SELECT * FROM sessions WHERE device_tag = ? AND stamp = ?", (tag, stamp))
+        return rows[0] if rows else None
+
+    # --- Transcripts --------------------------------------------------------
+
+    def add_transcript(self, audio_file, transcript_file, turns, texts):
+        """Store diarized turns ((start, end, speaker) with their texts) for a recording
+
+        Replaces any earlier transcript of the same audio file.
+        """
+        audio_file = os.path.abspath(audio_file)
+        session = self.session_for_file(audio_file)
+        if session is None:
+            parsed = parse_recording_name(audio_file)
+            if parsed:
+                kind, stamp, tag = parsed
+                self.register_file(audio_file, kind, stamp, tag)
+                session = self.session_for_file(audio_file)
+        session_id = session['id'] if session else None
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM transcripts WHERE audio_file = ?", (audio_file,))
+            transcript_id = self.db.execute(
+                "INSERT INTO transcripts (session_id, audio_file, transcript_file, created) "
+                "VALUES (?, ?, ?, ?)",
+                (session_id, audio_file, transcript_file and os.path.abspath(transcript_file),
+                 time.time())).lastrowid
+            self.db.executemany(
+                "INSERT INTO turns (transcript_id, session_id, speaker, start_time, end_time, text) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(transcript_id, session_id, speaker, float(start), float(end), text.strip())
+                 for (start, end, speaker), text in zip(turns, texts)])
+        return transcript_id
+
+    # --- Queries ------------------------------------------------------------
+
+    def filters(self, device=None, since=None, until=None, table="sessions"):
+        clauses, params = [], []
+        if device:
+            clauses.append(f"{table}.device_tag = ?")
+            params.append(device_tag(device))
+        if since is not None:
+            clauses.append(f"{table}.started >= ?")
+            params.append(parse_time(since))
+        if until is not None:
+            clauses.append(f"{table}.started < ?")
+            params.append(parse_time(until))
+        return clauses, params
+
+    def find_sessions(self, device=None, since=None, until=None, speaker=None, limit=100):
+        """Sessions by device and start-time range, newest first"""
+        clauses, params = self.filters(device, since, until)
+        if speaker:
+            clauses.append("EXISTS (SELECT 1 FROM turns WHERE turns.session_id = sessions.id "
+                           "AND turns.speaker = ?)")
+            params.append(speaker)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self.query(f"SELECT * FROM sessions {where} ORDER BY started DESC LIMIT ?",
+                          (*params, limit))
+
+    def search(self, text, device=None, speaker=None, since=None, until=None, limit=50):
+        """Full-text search over transcript turns, best matches first
+
+        `text` uses FTS5 query syntax (words, "phrases", prefix*, AND/OR/NOT).
+        """
+        clauses, params = self.filters(device, since, until)
+        if speaker:
+            clauses.append("turns.speaker = ?")
+            params.append(speaker)
+        where = "".join(f" AND {clause}" for clause in clauses)
+        return self.query(
+            "SELECT turns.speaker, turns.start_time, turns.end_time, turns.text, "
+            "snippet(turns_fts, 0, '[', ']', '...', 12) AS snippet, "
+            "transcripts.audio_file, sessions.id AS session_id, sessions.device_tag, "
+            "sessions.started "
+            "FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid "
+            "JOIN transcripts ON transcripts.id = turns.transcript_id "
+            "LEFT JOIN sessions ON sessions.id = turns.session_id "
+            f"WHERE turns_fts MATCH ?{where} ORDER BY bm25(turns_fts) LIMIT ?",
+            (text, *params, limit))
+
+    def turns(self, session_id):
+        return self.query("SELECT speaker, start_time, end_time, text FROM turns "
+                          "WHERE session_id = ? ORDER BY start_time", (session_id,))
+
+    # --- Backfill -----------------------------------------------------------
+
+    def register_file(self, path, kind, stamp, tag):
+        """Catalog a recording found on disk (no frame statistics)"""
+        if kind == "sdcard":
+            self.attach_sdcard(tag, stamp, path)
+            return
+        started = stamp_time(stamp)
+        self.start_session(tag, stamp, started, ble_file=path)
+        from longaudio import open_audio
+        try:
+            duration = open_audio(path).duration
+        except (ImportError, OSError, ValueError):
+            return
+        self.execute("UPDATE sessions SET duration = coalesce(duration, ?), "
+                     "ended = coalesce(ended, ?) WHERE device_tag = ? AND stamp = ?",
+                     (duration, started + duration, tag, stamp))
+
+    def import_directory(self, directory, transcript_suffix=".transcript.txt"):
+        """Catalog existing recordings and their transcripts; returns the file count"""
+        count = 0
+        for name in sorted(os.listdir(directory)):
+            parsed = parse_recording_name(name)
+            if not parsed:
+                continue
+            path = os.path.abspath(os.path.join(directory, name))
+            self.register_file(path, *parsed)
+            count += 1
+            transcript = os.path.splitext(path)[0] + transcript_suffix
+            if os.path.exists(transcript):
+                turns = read_transcript(transcript)
+                self.add_transcript(path, transcript, [turn[:3] for turn in turns],
+                                    [turn[3] for turn in turns])
+        return count
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp else "-"
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the recording catalog")
+    parser.add_argument('--db', default=CATALOG_FILE, help="Catalog database")
+    commands = parser.add_subparsers(dest='command', required=True)
+    scan = commands.add_parser('import', help="Catalog recordings already on disk")
+    scan.add_argument('directory', nargs='?', default=".")
+    sessions = commands.add_parser('sessions', help="List sessions")
+    search = commands.add_parser('search', help="Full-text search over transcripts")
+    search.add_argument('query')
+    for command in (sessions, search):
+        command.add_argument('--device', help="Address or 6-digit device tag")
+        command.add_argument('--since', help="ISO date/time or epoch seconds")
+        command.add_argument('--until', help="ISO date/time or epoch seconds")
+        command.add_argument('--speaker', help="Diarization label, e.g. SPEAKER_00")
+        command.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.command == 'import':
+        print(f"Cataloged {catalog.import_directory(args.directory)} recordings")
+    elif args.command == 'sessions':
+        for row in catalog.find_sessions(args.device, args.since, args.until, args.speaker, args.limit):
+            duration = f"{row['duration']:.1f}s" if row['duration'] is not None else "-"
+            print(f"{row['id']:6d} {row['device_tag'] or 'local':8s} {format_time(row['started'])} "
+                  f"{duration:>9s} drops={row['drops'] if row['drops'] is not None else '-'} "
+                  f"ble={row['ble_file'] or '-'} sd={row['sdcard_file'] or '-'}")
+    else:
+        for row in catalog.search(args.query, args.device, args.speaker, args.since, args.until,
+                                  args.limit):
+            print(f"{format_time(row['started'])} {row['device_tag'] or 'local'} "
+                  f"[{row['speaker']}] ({row['start_time']:.1f}s - {row['end_time']:.1f}s): "
+                  f"{row['snippet']}\n    {row['audio_file']}")
+    catalog.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import argparse
+import importlib
+import sys
+
+# Subcommand: (module whose main(argv) runs it, summary). Modules are only
+# imported once their command is chosen, so --help and each command pay
+# for their own dependencies alone.
+COMMANDS = {
+    'ingest': ('bluetooth', "Record every pocket unit in range over BLE and fetch its SD card copy"),
+    'download': ('download', "Download a unit's SD card recording over WiFi"),
+    'transcribe': ('diarize', "Diarize and transcribe recordings"),
+    'bench': ('bench', "Run the replay benchmarks against the saved baseline"),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pocket recorder tools; '<command> --help' lists a command's options")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for name, (_, summary) in COMMANDS.items():
+        # The command's own parser handles its arguments, --help included
+        commands.add_parser(name, help=summary, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+    if argv is None:
+        # Usage lines read "cli.py transcribe ..." rather than "cli.py ..."
+        sys.argv[0] = f"{sys.argv[0]} {args.command}"
+    return importlib.import_module(COMMANDS[args.command][0]).main(rest)
+
+if __name__ == "__main__":
+    sys.exit(main())
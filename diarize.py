@@ -1,41 +1,436 @@
 import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 
-import torch
-import whisper
-from pyannote.audio import Pipeline
-from pydub import AudioSegment
-
-# Step 1: Load diarization pipeline
-pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization", use_auth_token="")
-
-# Step 2: Apply diarization to the audio file
-diarization = pipeline("comic_con.wav")
-
-# Load the audio file using pydub
-audio = AudioSegment.from_wav("comic_con.wav")
-
-# Step 3: Initialize the Whisper model
-model = whisper.load_model("base")
-
-# Step 4: Open a text file to write the output
-with open("transcript.txt", "w") as f:
-    # Write a header
-    f.write("Transcript with Speaker Diarization\n")
-    f.write("================================\n\n")
-    
-    # Iterate through each speaker's segment, transcribe it, and write to file
-    for turn, _, speaker in diarization.itertracks(yield_label=True):
-        # Extract the corresponding audio segment
-        segment = audio[turn.start * 1000: turn.end * 1000]
-        
-        # Save this segment to a temporary file
-        segment.export("temp_segment.wav", format="wav")
-        
-        # Transcribe the segment using Whisper
-        result = model.transcribe("temp_segment.wav")
-        
-        # Write the transcription with speaker info to file
-        f.write(f"[{speaker}] ({turn.start:.1f}s - {turn.end:.1f}s): {result['text']}\n")
-
-print("Transcription complete! Check transcript.txt for the output.")
+import argparse
+import functools
+import importlib
+import importlib.metadata
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# torch, whisper and pyannote.audio take seconds to import, so they are
+# imported by the functions that need them
+from longaudio import LONG_AUDIO_SECONDS, diarize_windowed, find_audio, open_audio, pipeline_input
+from turncache import CACHE_FILE, TranscriptCache, audio_key
+from vad import SpeechDetector, gate_turns, speech_regions
+
+TRANSCRIPT_SUFFIX = ".transcript.txt"  # Next to the recording, as the transcription daemon writes them
+MODEL_NAME = "base"
+PRECISION = "float32"     # "int8" quantizes Whisper's linear layers for CPU-only hosts
+PRECISIONS = ("float32", "int8")
+PIPELINE_NAME = "pyannote/speaker-diarization"
+SAMPLE_RATE = 16000       # whisper.audio.SAMPLE_RATE, the rate Whisper works at
+N_SAMPLES = 30 * SAMPLE_RATE  # whisper.audio.N_SAMPLES, one 30 s decoding window
+
+# Turn scheduling
+WORKERS = os.cpu_count() or 1     # Transcription processes, each with its own model
+MERGE_GAP = 0.5                   # Join same-speaker turns separated by less than this (s)
+MERGE_SHORT_TURN = 2.0            # Only merge when one side is shorter than this (s)
+MAX_TURN = 30.0                   # Never merge past Whisper's 30 s window
+BUCKET_EDGES = (2.0, 5.0, 15.0, 30.0)  # Turn length buckets (s)
+BATCH_SIZE = 1                    # >1 decodes short turns together with whisper.decode
+TASK_SECONDS = 30.0               # Audio per task when packing short turns
+
+@functools.lru_cache(maxsize=None)
+def library_version(module, distribution):
+    """Installed version of a library, read from its package metadata so it isn't imported
+
+    None when the library is not installed at all, so only stand-ins for it can run.
+    """
+    try:
+        return importlib.metadata.version(distribution)
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    try:
+        return importlib.import_module(module).__version__
+    except ImportError:
+        return None
+
+def pipeline_id():
+    """Cache key part naming the diarization model; results change with the library version"""
+    return f"{PIPELINE_NAME}@{library_version('pyannote.audio', 'pyannote.audio')}"
+
+def load_audio(path):
+    """Decode the whole file once into a float32 array at 16 kHz
+
+    WAVs and FLAC/Opus archives already at 16 kHz (BLE recordings and
+    resampled SD downloads) are read directly; anything else goes through
+    Whisper's ffmpeg decoder.
+    """
+    try:
+        wav = open_audio(path)
+    except (ImportError, OSError, ValueError):
+        wav = None
+    if wav is not None and wav.rate == SAMPLE_RATE:
+        return wav.segment(0.0, wav.duration)
+    import whisper
+    return whisper.load_audio(path)
+
+def segment_audio(audio, start, end):
+    """Return the samples between start and end seconds
+
+    For a decoded array this is a zero-copy view; a WavMap or ArchiveMap
+    reads just that slice from disk.
+    """
+    if hasattr(audio, 'segment'):
+        return audio.segment(start, end)
+    return audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+
+def open_long_audio(path, threshold=LONG_AUDIO_SECONDS):
+    """Return a WavMap or ArchiveMap if the recording is longer than threshold, else None"""
+    try:
+        wav = open_audio(path)
+    except (ImportError, OSError, ValueError):
+        return None
+    return wav if wav.duration > threshold else None
+
+def collect_turns(diarization):
+    """Flatten a pyannote annotation into (start, end, speaker) tuples"""
+    return [(turn.start, turn.end, speaker)
+            for turn, _, speaker in diarization.itertracks(yield_label=True)]
+
+def merge_turns(turns, max_gap=MERGE_GAP, short_turn=MERGE_SHORT_TURN, max_turn=MAX_TURN):
+    """Merge adjacent short turns from the same speaker"""
+    merged = []
+    for start, end, speaker in turns:
+        if merged:
+            prev_start, prev_end, prev_speaker = merged[-1]
+            if (speaker == prev_speaker
+                    and start - prev_end <= max_gap
+                    and min(prev_end - prev_start, end - start) < short_turn
+                    and end - prev_start <= max_turn):
+                merged[-1] = (prev_start, max(end, prev_end), speaker)
+                continue
+        merged.append((start, end, speaker))
+    return merged
+
+def plan_tasks(turns, task_seconds=TASK_SECONDS, bucket_edges=BUCKET_EDGES):
+    """Group turn indices into tasks, longest buckets first
+
+    Turns are bucketed by length so a task (and a decode batch) holds turns
+    of similar size. Short turns are packed together up to task_seconds of
+    audio to amortize IPC; long buckets go first so the pool drains evenly.
+    """
+    buckets = [[] for _ in range(len(bucket_edges) + 1)]
+    for index, (start, end, _) in enumerate(turns):
+        duration = end - start
+        bucket = sum(duration > edge for edge in bucket_edges)
+        buckets[bucket].append(index)
+
+    tasks = []
+    for bucket in reversed(buckets):
+        bucket.sort(key=lambda i: turns[i][1] - turns[i][0], reverse=True)
+        task, seconds = [], 0.0
+        for index in bucket:
+            duration = turns[index][1] - turns[index][0]
+            if task and seconds + duration > task_seconds:
+                tasks.append(task)
+                task, seconds = [], 0.0
+            task.append(index)
+            seconds += duration
+        if task:
+            tasks.append(task)
+    return tasks
+
+def quantize_model(model):
+    """Dynamic int8 quantization of every linear layer, in place
+
+    Weights are stored as int8 and activations are quantized on the fly
+    per batch, which speeds up the attention and MLP matmuls that dominate
+    CPU inference. Whisper's Linear subclass only casts its weights to the
+    input dtype, but quantize_dynamic matches exact module types, so the
+    layers are presented as plain nn.Linear first.
+    """
+    import torch
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear):
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def load_model(model_name=MODEL_NAME, precision=PRECISION):
+    """Load a Whisper model for inference at the given precision
+
+    int8 models are quantized for and kept on the CPU.
+    """
+    import whisper
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+    if precision == "int8":
+        return quantize_model(whisper.load_model(model_name, device="cpu"))
+    return whisper.load_model(model_name)
+
+def worker_threads(workers, threads=None):
+    """Torch threads per worker: as asked, or the cores split between workers"""
+    return threads or max(1, (os.cpu_count() or 1) // workers)
+
+_worker_model = None
+
+def init_worker(model_name, threads, precision=PRECISION):
+    """Pool initializer: pin the thread count and load the model once"""
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    _worker_model = load_model(model_name, precision)
+
+def transcribe_segments(model, segments, batch_size=BATCH_SIZE):
+    """Transcribe a list of float32 segments, batching short ones if enabled"""
+    texts = [None] * len(segments)
+    batchable = [i for i, s in enumerate(segments)
+                 if batch_size > 1 and len(s) <= N_SAMPLES]
+    if batchable:
+        import torch
+        import whisper
+    for offset in range(0, len(batchable), max(batch_size, 1)):
+        batch = batchable[offset:offset + batch_size]
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(segments[i]), model.dims.n_mels)
+            for i in batch
+        ]).to(model.device)
+        results = whisper.decode(model, mels, whisper.DecodingOptions(fp16=False))
+        for i, result in zip(batch, results):
+            # Match transcribe()'s leading space
+            texts[i] = " " + result.text if result.text else ""
+    for i, segment in enumerate(segments):
+        if texts[i] is None:
+            texts[i] = model.transcribe(segment)['text']
+    return texts
+
+def transcribe_task(task_id, segments, batch_size):
+    """Pool task: transcribe with this worker's preloaded model"""
+    return task_id, transcribe_segments(_worker_model, segments, batch_size)
+
+def turn_key(segment, model_name, batch_size, precision=PRECISION):
+    """Cache key of one turn's text; batched decoding and int8 give slightly different text"""
+    batched = batch_size > 1 and len(segment) <= N_SAMPLES
+    model = f"{model_name}@{library_version('whisper', 'openai-whisper')}"
+    return audio_key('turn', segment, model=model, batched=batched, precision=precision)
+
+def transcribe_turns(audio, turns, model_name=MODEL_NAME, workers=WORKERS, batch_size=BATCH_SIZE,
+                     model=None, cache=None, precision=PRECISION, threads=None):
+    """Transcribe every turn, in parallel when workers > 1; returns texts in turn order
+
+    Passing an already loaded `model` transcribes in-process with it;
+    model_name and precision must then describe that model. Otherwise each
+    worker loads model_name at `precision` and runs `threads` torch threads
+    (default: the cores split between workers). With a TranscriptCache,
+    turns whose audio was transcribed before by the same model are served
+    from it and only the rest are decoded.
+    """
+    texts = [None] * len(turns)
+    keys = {}
+    if cache is not None:
+        keys = {i: turn_key(segment_audio(audio, start, end), model_name, batch_size, precision)
+                for i, (start, end, _) in enumerate(turns)}
+        found = cache.get_many('turn', keys.values())
+        texts = [found.get(keys[i]) for i in range(len(turns))]
+    pending = [i for i, text in enumerate(texts) if text is None]
+    tasks = [[pending[k] for k in task] for task in plan_tasks([turns[i] for i in pending])]
+    if tasks:
+        run_tasks(audio, turns, tasks, texts, model_name, workers, batch_size, model, precision, threads)
+    if cache is not None and pending:
+        cache.put_many('turn', {keys[i]: texts[i] for i in pending})
+    return texts
+
+def run_tasks(audio, turns, tasks, texts, model_name, workers, batch_size, model, precision=PRECISION,
+              threads=None):
+    """Transcribe the turns of every task into texts, in parallel when workers > 1"""
+    if workers <= 1 or model is not None:
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        model = model or load_model(model_name, precision)
+        for task in tasks:
+            segments = [segment_audio(audio, *turns[i][:2]) for i in task]
+            for i, text in zip(task, transcribe_segments(model, segments, batch_size)):
+                texts[i] = text
+        return
+
+    # Split the cores between workers so they don't oversubscribe each other
+    threads = worker_threads(workers, threads)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker,
+                             initargs=(model_name, threads, precision)) as pool:
+        # Each task carries only its own slices, and only a couple of tasks
+        # per worker are in flight, so memory doesn't grow with the recording
+        pending = set()
+        for task_id, task in enumerate(tasks):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect_results(done, tasks, texts)
+            segments = [segment_audio(audio, *turns[i][:2]) for i in task]
+            pending.add(pool.submit(transcribe_task, task_id, segments, batch_size))
+        collect_results(wait(pending)[0], tasks, texts)
+
+def collect_results(futures, tasks, texts):
+    """Store finished task results at their turn indices"""
+    for future in futures:
+        task_id, task_texts = future.result()
+        for i, text in zip(tasks[task_id], task_texts):
+            texts[i] = text
+
+def load_pipeline():
+    """Load the pyannote speaker diarization pipeline"""
+    from pyannote.audio import Pipeline
+    return Pipeline.from_pretrained(PIPELINE_NAME, use_auth_token="")
+
+class LazyPipeline:
+    """Loads the diarization pipeline on first use, so fully cached runs never load it"""
+
+    def __init__(self):
+        self.pipeline = None
+
+    def __call__(self, audio):
+        if self.pipeline is None:
+            self.pipeline = load_pipeline()
+        return self.pipeline(audio)
+
+def diarize_file(pipeline, audio, cache=None):
+    """Diarize a whole decoded file; with a cache, unchanged audio is never diarized twice"""
+    key = None
+    if cache is not None:
+        key = audio_key('diarization', audio, pipeline=pipeline_id())
+        turns = cache.get('diarization', key)
+        if turns is not None:
+            return [tuple(turn) for turn in turns]
+    # Hand over the decoded samples so pyannote needn't decode the file again
+    turns = collect_turns(pipeline(pipeline_input(audio)))
+    if key is not None:
+        cache.put('diarization', key, turns)
+    return turns
+
+def write_transcript(path, turns, texts):
+    """Write speaker-labelled turns in the transcript.txt format"""
+    with open(path, "w") as f:
+        # Write a header
+        f.write("Transcript with Speaker Diarization\n")
+        f.write("================================\n\n")
+
+        # Write the transcription with speaker info to file, in turn order
+        for (start, end, speaker), text in zip(turns, texts):
+            f.write(f"[{speaker}] ({start:.1f}s - {end:.1f}s): {text}\n")
+
+def process_file(audio_file, transcript_file, pipeline=None, model=None, workers=WORKERS,
+                 long_audio=None, catalog=None, cache=None, model_name=MODEL_NAME, vad=True,
+                 precision=PRECISION, threads=None):
+    """Diarize and transcribe one recording; returns a summary dict
+
+    Long WAV files (or any WAV when long_audio is True) are memory-mapped
+    and diarized in overlapping windows so peak memory stays flat; FLAC
+    and Opus archives are decoded a window at a time the same way, and a
+    .wav path that was archived is followed to its archive. With a
+    catalog.Catalog the turns are also indexed for search. With a
+    turncache.TranscriptCache every file takes the windowed path (short
+    ones as a single window), so re-running a file (or a longer copy of
+    it) only diarizes windows and transcribes turns whose audio is new.
+    long_audio=False keeps a file in memory regardless.
+
+    Unless vad is False, turns are trimmed to the speech a
+    vad.SpeechDetector finds in them (pass one to tune its thresholds) and
+    turns without speech are dropped before Whisper sees them.
+
+    Whisper runs at `precision` (see load_model) with `threads` torch
+    threads per worker; a passed-in model must match model_name and
+    precision, since they key the cache.
+    """
+    # Step 1: Load diarization pipeline when first needed (unless the caller keeps one warm)
+    pipeline = pipeline or LazyPipeline()
+    audio_file = find_audio(audio_file)
+
+    # Cached runs window every file so a grown recording keeps its earlier windows
+    wav = open_long_audio(audio_file, 0.0 if long_audio or cache is not None else LONG_AUDIO_SECONDS)
+    if long_audio is False:
+        wav = None
+    if wav is not None:
+        # Step 2: Diarize window by window; turns read their own slices later
+        print(f"Windowed mode: {wav.duration / 3600:.2f}h at {wav.rate} Hz")
+        # The pipeline version only matters as part of a cache key
+        turns = diarize_windowed(pipeline, wav, cache=cache,
+                                 pipeline_id=pipeline_id() if cache is not None else "")
+        audio = wav
+    else:
+        # Decode the audio file once; every turn is a slice of this array
+        audio = load_audio(audio_file)
+
+        # Step 2: Apply diarization to the audio file
+        turns = diarize_file(pipeline, audio, cache)
+
+    # Step 3: Drop and trim non-speech, merge fragmented turns and transcribe
+    # them across the worker pool
+    diarized = sum(end - start for start, end, _ in turns)
+    vad_start = time.time()
+    if vad:
+        detector = vad if isinstance(vad, SpeechDetector) else None
+        turns = gate_turns(turns, speech_regions(audio, detector))
+    vad_elapsed = time.time() - vad_start
+    turns = merge_turns(turns)
+    start_time = time.time()
+    texts = transcribe_turns(audio, turns, model_name, workers=workers, model=model, cache=cache,
+                             precision=precision, threads=threads)
+    elapsed = time.time() - start_time
+    speech = sum(end - start for start, end, _ in turns)
+
+    # Step 4: Write the transcript
+    write_transcript(transcript_file, turns, texts)
+    if catalog is not None:
+        catalog.add_transcript(audio_file, transcript_file, turns, texts)
+    return {
+        'turns': len(turns),
+        'speech_seconds': speech,
+        'skipped_seconds': diarized - speech,
+        'audio_seconds': len(audio) / SAMPLE_RATE,
+        'vad_seconds': vad_elapsed,
+        'transcribe_seconds': elapsed,
+        'transcript': transcript_file
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diarize and transcribe recordings into speaker-labelled transcripts")
+    parser.add_argument('audio', nargs='+', help="Recordings (WAV, FLAC, Opus or anything ffmpeg decodes)")
+    parser.add_argument('-o', '--output', help=f"Transcript file for a single recording "
+                                               f"(default: next to it, ending in {TRANSCRIPT_SUFFIX})")
+    parser.add_argument('--model', default=MODEL_NAME, help="Whisper model size")
+    parser.add_argument('--precision', default=PRECISION, choices=PRECISIONS,
+                        help="Whisper inference precision; int8 quantizes for CPU-only hosts")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Transcription processes")
+    parser.add_argument('--threads', type=int, help="Torch threads per worker (default: the cores split between them)")
+    parser.add_argument('--long-audio', action='store_true', default=None,
+                        help="Diarize in windows from disk whatever the length")
+    parser.add_argument('--no-vad', action='store_true', help="Transcribe diarized turns without speech gating")
+    parser.add_argument('--no-cache', action='store_true', help="Do not reuse or store earlier results")
+    parser.add_argument('--catalog', help="Index the transcripts in this catalog database")
+    args = parser.parse_args(argv)
+    if args.output and len(args.audio) > 1:
+        parser.error("--output needs a single recording")
+    missing = [path for path in args.audio if not os.path.exists(find_audio(path))]
+    if missing:
+        parser.error(f"No such recording: {', '.join(missing)}")
+
+    cache = None if args.no_cache else TranscriptCache(CACHE_FILE)
+    catalog = None
+    if args.catalog:
+        from catalog import Catalog
+        catalog = Catalog(args.catalog)
+    # One pipeline for every file, loaded by the first one that isn't cached
+    pipeline = LazyPipeline()
+    for audio_file in args.audio:
+        transcript_file = args.output or os.path.splitext(audio_file)[0] + TRANSCRIPT_SUFFIX
+        summary = process_file(audio_file, transcript_file, pipeline, workers=args.workers,
+                               long_audio=args.long_audio, catalog=catalog, cache=cache,
+                               model_name=args.model, vad=not args.no_vad, precision=args.precision,
+                               threads=args.threads)
+        speech, elapsed = summary['speech_seconds'], summary['transcribe_seconds']
+        print(f"Skipped {summary['skipped_seconds']:.1f}s of non-speech in diarized turns "
+              f"(voice activity detection took {summary['vad_seconds']:.1f}s)")
+        print(f"Transcribed {summary['turns']} turns ({speech:.1f}s of speech) in {elapsed:.1f}s "
+              f"with {args.workers} workers at {args.precision}: {speech / max(elapsed, 1e-9):.1f}x real time")
+        print(f"Transcription complete! Check {transcript_file} for the output.")
+    if cache is not None:
+        cache.close()
+    if catalog is not None:
+        catalog.close()
+
+if __name__ == "__main__":
+    main()
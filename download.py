@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+import metrics
+from wavsink import DiskWriter
+
+CHUNK_SIZE = 32768        # 32KB to match the ESP32 server's chunk size
+MAX_ATTEMPTS = 20         # Failed requests tolerated before giving up
+RETRY_DELAY = 1.0         # Seconds between failed requests
+CHECKPOINT_INTERVAL = 0.5 # Seconds between saves of the range table
+MAX_QUEUED_CHUNKS = 64    # Chunks waiting for the disk thread before the download waits for it
+PARALLEL_RANGES = 1       # The ESP32 WebServer serves one client at a time
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+DIGEST_SUFFIX = ".sha256"
+NATIVE_SUFFIX = ".native"   # Suffix of the native-rate download while it is being resampled
+DEVICE_URL = "http://192.168.4.1/file"  # Where a pocket unit on its own access point serves the SD recording
+THROUGHPUT_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)  # Mbps
+
+DOWNLOADS = metrics.counter('download_total', "Finished SD card downloads by result")
+DOWNLOAD_BYTES = metrics.counter('download_bytes_total', "Payload bytes received over WiFi")
+DOWNLOAD_RETRIES = metrics.counter('download_interruptions_total', "Requests that failed mid-transfer")
+DOWNLOAD_PROGRESS = metrics.gauge('download_progress_ratio', "Fraction of the current download on disk")
+DOWNLOAD_THROUGHPUT = metrics.histogram('download_throughput_mbps', "Average speed of each finished download",
+                                        THROUGHPUT_BUCKETS)
+
+class DownloadError(Exception):
+    """Raised when a download cannot be completed or fails verification"""
+
+def parse_content_range(value):
+    """Parse 'bytes start-end/total' into (start, end, total)"""
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', value or '')
+    if not match:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), (int(total) if total != '*' else None)
+
+def expected_digest(headers):
+    """Return the SHA-256 hex digest advertised by the server, if any"""
+    if 'X-Content-SHA256' in headers:
+        return headers['X-Content-SHA256'].strip().lower()
+    for part in headers.get('Digest', '').split(','):
+        algo, _, value = part.strip().partition('=')
+        if algo.lower() == 'sha-256' and value:
+            return base64.b64decode(value).hex()
+    return None
+
+def response_validator(headers):
+    """Return the ETag, or failing that Last-Modified, that identifies this version of the file"""
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+def file_sha256(filename, block_size=1024 * 1024):
+    """Compute the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResumableDownloader:
+    """Download a file over HTTP into a .part file that survives dropped connections
+
+    Progress is tracked as a table of byte ranges in a .part.json sidecar,
+    so a later run (or a retry after a WiFi drop) continues where the last
+    one stopped. When the server answers Range requests with 206, the file
+    can be split into several ranges fetched in parallel. A server that
+    ignores Range (plain 200) is handled by restarting from byte zero.
+    The server's ETag (or Last-Modified) is kept with the range table and
+    sent back as If-Range, so a different recording behind the same URL
+    is never spliced onto an old .part. With `require_digest` a server
+    that sends no SHA-256 digest is refused instead of trusted unverified.
+    Chunks are written, fed to the sink and checkpointed on a DiskWriter
+    thread so the event loop only moves bytes off the socket.
+    """
+
+    def __init__(self, url, filename, chunk_size=CHUNK_SIZE, max_attempts=MAX_ATTEMPTS,
+                 parallel=PARALLEL_RANGES, timeout=None, sha256=None, sink=None, require_digest=False,
+                 disk=None):
+        self.url = url
+        self.filename = filename
+        self.part_filename = filename + PART_SUFFIX
+        self.state_filename = filename + STATE_SUFFIX
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.parallel = max(1, parallel)
+        self.timeout = timeout  # aiohttp.ClientTimeout; None gives 10 s connect and read timeouts
+        self.sha256 = sha256
+        self.require_digest = require_digest
+        self.validator = None  # ETag or Last-Modified of the file being fetched
+        self.sink = sink  # Optional: sees write(offset, chunk), then finish(filename, size)
+        self.disk = disk  # Shared DiskWriter; None runs a private one for this download
+        self.total_size = None
+        self.accepts_ranges = False
+        self.ranges = []  # [start, end, next_offset], end exclusive
+        self.written = []  # Per range, the offset the disk thread has written up to
+        self.write_error = None
+        self.last_checkpoint = 0
+        self.failures = 0
+        self.received_size = 0
+        self.start_time = None
+        self.first_byte_time = None  # time.monotonic() of the first payload byte
+        self.last_progress_time = 0
+
+    def load_state(self):
+        """Restore the range table left by a previous run"""
+        if not (os.path.exists(self.part_filename) and os.path.exists(self.state_filename)):
+            return False
+        try:
+            with open(self.state_filename) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get('url') != self.url:
+            return False
+        if state.get('validator') != self.validator:
+            print(f"{self.url} now serves a different file; discarding the partial download")
+            return False
+        self.total_size = state['total_size']
+        self.ranges = state['ranges']
+        self.written = [offset for _, _, offset in self.ranges]
+        self.sha256 = self.sha256 or state.get('sha256')
+        return True
+
+    def save_state(self):
+        """Persist the range table, as far as it is on disk, next to the .part file"""
+        state = {
+            'url': self.url,
+            'total_size': self.total_size,
+            'ranges': [[start, end, written] for (start, end, _), written in zip(self.ranges, self.written)],
+            'sha256': self.sha256,
+            'validator': self.validator
+        }
+        tmp = self.state_filename + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_filename)
+
+    def reset(self, total_size):
+        """Start from scratch with an empty .part of the given size"""
+        self.total_size = total_size
+        self.ranges = []
+        with open(self.part_filename, 'wb') as f:
+            f.truncate(total_size)
+        self.plan_ranges(1)
+
+    def plan_ranges(self, count):
+        """Split the outstanding bytes into up to `count` ranges"""
+        pending = [(offset, end) for _, end, offset in self.ranges if offset < end]
+        if not self.ranges:
+            pending = [(0, self.total_size)]
+        ranges = []
+        share = max(self.chunk_size, -(-sum(e - s for s, e in pending) // count))
+        for start, end in pending:
+            while end - start > share and len(ranges) + 1 < count:
+                ranges.append([start, start + share, start])
+                start += share
+            ranges.append([start, end, start])
+        self.ranges = ranges
+        self.written = [offset for _, _, offset in ranges]
+        self.save_state()
+
+    @property
+    def remaining(self):
+        return sum(end - offset for _, end, offset in self.ranges)
+
+    async def probe(self, session):
+        """Learn the file size, Range support, digest and validator with a one-byte request"""
+        async with session.get(self.url, headers={'Range': 'bytes=0-0'}) as response:
+            if response.status == 206:
+                total = parse_content_range(response.headers.get('Content-Range'))
+                self.accepts_ranges = True
+                total_size = total[2] if total else None
+            elif response.status == 200:
+                total_size = int(response.headers.get('Content-Length', 0)) or None
+            else:
+                raise DownloadError(f"Server returned {response.status}")
+            if not total_size:
+                raise DownloadError("Server did not report the file size")
+            self.sha256 = self.sha256 or expected_digest(response.headers)
+            if self.require_digest and not self.sha256:
+                raise DownloadError("Server sent no SHA-256 digest to verify the download against")
+            self.validator = response_validator(response.headers)
+            if response.status == 200:
+                # Don't pull the whole body just to learn its size
+                response.close()
+            return total_size
+
+    def store(self, fd, index, offset, chunk):
+        """Disk thread: write one chunk, feed the sink and checkpoint now and then"""
+        try:
+            os.pwrite(fd, chunk, offset)
+            if self.sink is not None:
+                self.sink.write(offset, chunk)
+        except Exception as e:
+            self.write_error = e
+            raise
+        self.written[index] = offset + len(chunk)
+        current_time = time.time()
+        if current_time - self.last_checkpoint >= CHECKPOINT_INTERVAL:
+            self.last_checkpoint = current_time
+            self.save_state()
+
+    def report_progress(self, force=False):
+        """Publish progress every half second"""
+        current_time = time.time()
+        if not force and current_time - self.last_progress_time < 0.5:
+            return
+        self.last_progress_time = current_time
+        elapsed = max(current_time - self.start_time, 1e-6)
+        done = self.total_size - self.remaining
+        mbps = self.received_size / elapsed / 1024 / 1024 * 8
+        eta = self.remaining / (self.received_size / elapsed) if self.received_size else 0
+        DOWNLOAD_PROGRESS.set(done / self.total_size)
+        metrics.CONSOLE.emit("download", f"Progress: {done / self.total_size * 100:.1f}% "
+                                         f"Speed: {mbps:.1f} Mbps "
+                                         f"ETA: {eta:.1f}s", force=True, end='\r')
+
+    async def fetch_range(self, session, index, fd):
+        """Fetch one range until it is complete, retrying on failure"""
+        import aiohttp
+        entry = self.ranges[index]
+        while entry[2] < entry[1]:
+            headers = {}
+            if self.accepts_ranges or entry[2] > 0:
+                headers['Range'] = f"bytes={entry[2]}-{entry[1] - 1}"
+                if self.validator:
+                    # Get the whole new file rather than a piece of it if it changed
+                    headers['If-Range'] = self.validator
+            try:
+                async with session.get(self.url, headers=headers) as response:
+                    if response.status == 200 and response_validator(response.headers) != self.validator:
+                        # The next run probes the new validator and starts over
+                        raise DownloadError(f"{self.url} changed during the download")
+                    if response.status == 200:
+                        if entry[0] != 0 or entry[2] != 0:
+                            # Server ignored Range; only a full restart can continue
+                            if len(self.ranges) > 1:
+                                raise DownloadError("Server stopped honouring Range requests")
+                            entry[2] = 0
+                    elif response.status != 206:
+                        raise DownloadError(f"Server returned {response.status}")
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        chunk = chunk[:entry[1] - entry[2]]
+                        if not chunk:
+                            break
+                        if self.first_byte_time is None:
+                            self.first_byte_time = time.monotonic()
+                        if self.write_error:
+                            raise DownloadError(f"Could not write {self.part_filename}: {self.write_error}")
+                        self.disk.post(self.store, fd, index, entry[2], chunk)
+                        entry[2] += len(chunk)
+                        self.received_size += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk))
+                        self.report_progress()
+                        if self.disk.pending > MAX_QUEUED_CHUNKS:
+                            # The disk is behind; don't buffer the whole file in memory
+                            await asyncio.wrap_future(self.disk.barrier())
+                    if entry[2] < entry[1]:
+                        raise aiohttp.ClientPayloadError("Connection closed early")
+            except DownloadError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                self.failures += 1
+                DOWNLOAD_RETRIES.inc()
+                print(f"\nTransfer interrupted at {entry[2]}/{entry[1]} bytes: {e}")
+                if self.failures >= self.max_attempts:
+                    raise DownloadError(f"Giving up after {self.failures} failed requests")
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                self.disk.post(self.save_state)
+
+    def verify(self):
+        """Check the finished file against the expected digest"""
+        digest = file_sha256(self.part_filename)
+        if self.sha256 and digest != self.sha256:
+            raise DownloadError(f"SHA-256 mismatch: expected {self.sha256}, got {digest}")
+        return digest
+
+    async def run(self, session=None):
+        """Download to self.filename and return its SHA-256 hex digest"""
+        own_session = session is None
+        own_disk = self.disk is None
+        if own_disk:
+            self.disk = DiskWriter(name="download-writer")
+        if own_session:
+            import aiohttp
+            timeout = self.timeout or aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+            session = aiohttp.ClientSession(timeout=timeout)
+        try:
+            total_size = await self.probe(session)
+            if self.load_state() and self.total_size == total_size:
+                print(f"Resuming {self.filename}: {self.remaining/1024/1024:.1f} MB left")
+            else:
+                self.reset(total_size)
+            if self.accepts_ranges and self.parallel > 1:
+                self.plan_ranges(self.parallel)
+
+            print(f"\nDownloading {self.total_size/1024/1024:.1f} MB to {self.filename}")
+            self.start_time = time.time()
+            fd = os.open(self.part_filename, os.O_WRONLY)
+            try:
+                await asyncio.gather(*(self.fetch_range(session, index, fd)
+                                       for index in range(len(self.ranges))))
+            finally:
+                # Let queued chunks and the last checkpoint land before the fd goes
+                await asyncio.wrap_future(self.disk.barrier())
+                os.close(fd)
+            if self.write_error:
+                raise DownloadError(f"Could not write {self.part_filename}: {self.write_error}")
+            self.report_progress(force=True)
+
+            loop = asyncio.get_running_loop()
+            try:
+                digest = await loop.run_in_executor(None, self.verify)
+            except DownloadError:
+                # Corrupt data cannot be resumed; start clean next time
+                os.remove(self.part_filename)
+                os.remove(self.state_filename)
+                raise
+
+            os.replace(self.part_filename, self.filename)
+            os.remove(self.state_filename)
+            with open(self.filename + DIGEST_SUFFIX, 'w') as f:
+                f.write(f"{digest}  {os.path.basename(self.filename)}\n")
+            if self.sink is not None:
+                await loop.run_in_executor(None, self.sink.finish, self.filename, self.total_size)
+
+            total_time = time.time() - self.start_time
+            mbps = self.received_size / max(total_time, 1e-6) / 1024 / 1024 * 8
+            DOWNLOADS.inc(result="ok")
+            DOWNLOAD_THROUGHPUT.observe(mbps)
+            metrics.CONSOLE.emit("download done", "\n".join([
+                f"\n\nTransfer Complete:",
+                f"Total size: {self.total_size/1024/1024:.2f} MB",
+                f"Time: {total_time:.2f} seconds",
+                f"Average speed: {mbps:.2f} Mbps",
+                f"Failed requests: {self.failures}",
+                f"SHA-256: {digest}" + (" (verified)" if self.sha256 else "")
+            ]), force=True)
+            return digest
+        except Exception:
+            DOWNLOADS.inc(result="failed")
+            raise
+        finally:
+            if own_session:
+                await session.close()
+            if own_disk:
+                self.disk.stop()
+                self.disk = None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download a pocket unit's SD card recording over WiFi, "
+                                                 "resuming across dropped connections")
+    parser.add_argument('url', nargs='?', default=DEVICE_URL)
+    parser.add_argument('-o', '--output', help="Output WAV (default: sdcard_recording_<now>.wav)")
+    parser.add_argument('--native', action='store_true',
+                        help="Keep the card's native sample rate instead of resampling to 16 kHz")
+    parser.add_argument('--parallel', type=int, default=PARALLEL_RANGES, help="Byte ranges fetched at once")
+    parser.add_argument('--join', metavar='SSID',
+                        help="Join this network (the unit's access point) first and rejoin the current one after")
+    parser.add_argument('--password', help="Password for --join")
+    parser.add_argument('--no-digest', action='store_true',
+                        help="Accept a server that sends no SHA-256 digest, like the stock firmware")
+    args = parser.parse_args(argv)
+    output = args.output or time.strftime("sdcard_recording_%Y%m%d_%H%M%S.wav")
+
+    async def fetch():
+        from netcontrol import WiFiHandover
+        url = urlsplit(args.url)
+        handover = WiFiHandover(args.join, args.password, url.hostname, url.port or 80) if args.join else None
+        downloader = None
+        try:
+            if handover and not await handover.connect():
+                raise DownloadError(f"{args.url} did not answer on {args.join}")
+            if args.native:
+                downloader = ResumableDownloader(args.url, output, parallel=args.parallel,
+                                                 require_digest=not args.no_digest)
+                await downloader.run()
+                return
+            from resample import ResamplingWavSink
+            downloader = ResumableDownloader(args.url, output + NATIVE_SUFFIX, parallel=args.parallel,
+                                             sink=ResamplingWavSink(output), require_digest=not args.no_digest)
+            await downloader.run()
+            os.remove(downloader.filename)
+            os.remove(downloader.filename + DIGEST_SUFFIX)
+        finally:
+            if handover:
+                if downloader and downloader.first_byte_time is not None:
+                    print(f"Time to first byte: {handover.first_byte(downloader.first_byte_time):.2f}s")
+                await handover.restore()
+
+    try:
+        asyncio.run(fetch())
+    except (DownloadError, OSError) as e:
+        print(f"Download failed: {e}")
+        return 1
+    print(f"\nFile saved successfully: {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import asyncio
+import random
+import time
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from audiocodec import CODEC_PCM16, AdpcmEncoder, encode_frame
+from framedecoder import SAMPLES_PER_FRAME
+
+FRAME_INTERVAL = 0.01     # Seconds between notifications, as sent by the firmware
+YIELD_EVERY = 50          # Frames replayed between loop yields when running unthrottled
+ADVERTISE_INTERVAL = 0.1  # Seconds between advertisements of an unconnected unit
+
+FakeBLEDevice = namedtuple('FakeBLEDevice', 'address name')
+FakeAdvertisement = namedtuple('FakeAdvertisement', 'local_name service_uuids')
+
+def make_frames(blocks, codec=CODEC_PCM16):
+    """Encode (frames, samples) int16 blocks as notifications in one codec"""
+    adpcm = AdpcmEncoder()
+    return [encode_frame(i, block, codec, adpcm) for i, block in enumerate(blocks)]
+
+def synthetic_pcm(seconds, samples_per_frame=SAMPLES_PER_FRAME, sample_rate=16000, seed=0):
+    """(frames, samples) int16 blocks of a 440 Hz tone with a little noise"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate) // samples_per_frame * samples_per_frame
+    t = np.arange(total) / sample_rate
+    pcm = 8000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 200, total)
+    return np.clip(pcm, -32768, 32767).astype(np.int16).reshape(-1, samples_per_frame)
+
+def synthetic_frames(seconds, samples_per_frame=SAMPLES_PER_FRAME, sample_rate=16000, seed=0,
+                     codec=CODEC_PCM16):
+    """Notifications carrying synthetic_pcm() audio"""
+    return make_frames(synthetic_pcm(seconds, samples_per_frame, sample_rate, seed), codec)
+
+def wav_frames(path, samples_per_frame=SAMPLES_PER_FRAME, codec=CODEC_PCM16):
+    """Notifications replaying a recorded 16-bit mono WAV (e.g. an earlier BLE recording)"""
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1:
+            raise ValueError(f"{path} must be 16-bit mono")
+        pcm = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+    usable = len(pcm) - len(pcm) % samples_per_frame
+    return make_frames(pcm[:usable].reshape(-1, samples_per_frame), codec)
+
+def impair(frames, loss=0.0, reorder=0.0, max_reorder=4, jitter=0.0,
+           frame_interval=FRAME_INTERVAL, seed=None):
+    """Turn frames into a send schedule of (send_time, index, packet)
+
+    Each frame is lost with probability `loss`, held back by 1..max_reorder
+    frame intervals with probability `reorder`, and delayed by a uniform
+    0..jitter seconds. The first frame always arrives so the receiver's
+    timeline starts at index 0.
+    """
+    rng = random.Random(seed)
+    schedule = []
+    for index, packet in enumerate(frames):
+        if index and rng.random() < loss:
+            continue
+        send_time = index * frame_interval
+        if index and rng.random() < reorder:
+            send_time += rng.randint(1, max_reorder) * frame_interval
+        if jitter:
+            send_time += rng.uniform(0, jitter)
+        schedule.append((send_time, index, packet))
+    schedule.sort(key=lambda entry: entry[0])
+    return schedule
+
+class FakeBleakClient:
+    """Stand-in for bleak.BleakClient that replays a notification schedule
+
+    Takes the same constructor arguments as BleakClient plus a schedule
+    from impair(). After start_notify() the schedule is delivered to the
+    handler at `rate` times real time (rate=0 replays as fast as the
+    handler keeps up), then the client reports a disconnect. Send times
+    are kept per frame index for latency measurements.
+    """
+
+    def __init__(self, address, schedule=(), rate=1.0, timeout=20.0, disconnected_callback=None,
+                 **kwargs):
+        # Like BleakClient, accepts a BLEDevice from the scanner or a bare address
+        self.address = getattr(address, 'address', address)
+        self.schedule = schedule
+        self.rate = rate
+        self.timeout = timeout
+        self.disconnected_callback = disconnected_callback
+        self.connected = False
+        self.replay_task = None
+        self.started_at = None    # time.perf_counter() when the replay began
+        self.finished_at = None
+        self.finished = asyncio.Event()
+        self.sent = 0
+
+    @property
+    def is_connected(self):
+        return self.connected
+
+    def due_time(self, index, frame_interval=FRAME_INTERVAL):
+        """perf_counter() time at which frame `index` was captured on the device"""
+        if not self.rate:
+            return self.started_at
+        return self.started_at + index * frame_interval / self.rate
+
+    async def connect(self, **kwargs):
+        self.connected = True
+        return True
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        self.replay_task = asyncio.create_task(self.replay(char_specifier, callback))
+
+    async def stop_notify(self, char_specifier):
+        if self.replay_task:
+            self.replay_task.cancel()
+
+    async def read_gatt_char(self, char_specifier, **kwargs):
+        if not self.connected:
+            raise ConnectionError("Not connected")
+        return bytearray()
+
+    async def replay(self, sender, callback):
+        self.started_at = time.perf_counter()
+        try:
+            for send_time, _, packet in self.schedule:
+                if self.rate:
+                    delay = self.started_at + send_time / self.rate - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.sent % YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
+                callback(sender, bytearray(packet))
+                self.sent += 1
+        finally:
+            self.finished_at = time.perf_counter()
+            self.finished.set()
+            await self.disconnect()
+
+    async def disconnect(self):
+        if not self.connected:
+            return True
+        self.connected = False
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+class FakeUnit:
+    """A pocket unit recording `frames` that comes and goes over BLE
+
+    Recording starts with the first connection and then runs on the
+    unit's own clock whether or not anyone is connected, like the
+    firmware. Each connection lasts the next of `connections` seconds and
+    streams the frames recorded during it, then the link drops. While
+    unconnected the unit advertises, and stops for good once every
+    connection is used up. Pass unit.client as a BleakClient class.
+    """
+
+    def __init__(self, address, frames, connections, name="ESP32WAV", service_uuids=(),
+                 connect_delay=0.0, discover_delay=0.0):
+        self.device = FakeBLEDevice(address, name)
+        self.advertisement = FakeAdvertisement(name, list(service_uuids))
+        self.frames = frames
+        self.connections = list(connections)
+        self.connect_delay = connect_delay    # Seconds a connection takes to set up
+        self.discover_delay = discover_delay  # Seconds after it starts advertising until a scan sees it
+        self.clients = []
+        self.recording_started = None
+        self.advertising_since = time.perf_counter()
+
+    @property
+    def advertising(self):
+        return bool(self.connections) and not (self.clients and self.clients[-1].is_connected)
+
+    def client(self, address, **kwargs):
+        client = FakeUnitClient(self, address, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def next_schedule(self):
+        """Frames recorded during the next connection, from where the unit's clock is now"""
+        now = time.perf_counter()
+        if self.recording_started is None:
+            self.recording_started = now
+        first = int((now - self.recording_started) / FRAME_INTERVAL)
+        count = int(self.connections.pop(0) / FRAME_INTERVAL)
+        return [(index * FRAME_INTERVAL, first + index, packet)
+                for index, packet in enumerate(self.frames[first:first + count])]
+
+class FakeUnitClient(FakeBleakClient):
+    """FakeBleakClient for one connection to a FakeUnit"""
+
+    def __init__(self, unit, address, **kwargs):
+        super().__init__(address, **kwargs)
+        self.unit = unit
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.unit.connect_delay)
+        if not self.unit.connections:
+            raise ConnectionError(f"{self.address} is out of reach")
+        return await super().connect(**kwargs)
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        self.schedule = self.unit.next_schedule()
+        await super().start_notify(char_specifier, callback, **kwargs)
+
+    async def disconnect(self):
+        if self.connected:
+            self.unit.advertising_since = time.perf_counter()
+        return await super().disconnect()
+
+class FakeBleakScanner:
+    """Stand-in for bleak.BleakScanner reporting FakeUnit advertisements
+
+    Bind the units with functools.partial(FakeBleakScanner, units=[...]).
+    """
+
+    def __init__(self, detection_callback=None, service_uuids=None, units=(), **kwargs):
+        self.detection_callback = detection_callback
+        self.service_uuids = set(service_uuids or ())
+        self.units = units
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.advertise())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def sees(self, unit):
+        if not unit.advertising or time.perf_counter() - unit.advertising_since < unit.discover_delay:
+            return False
+        return not self.service_uuids or bool(self.service_uuids & set(unit.advertisement.service_uuids))
+
+    async def advertise(self):
+        while True:
+            for unit in self.units:
+                if self.sees(unit):
+                    self.detection_callback(unit.device, unit.advertisement)
+            await asyncio.sleep(ADVERTISE_INTERVAL)
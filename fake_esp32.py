@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import time
+
+from aiohttp import web
+
+CHUNK_SIZE = 32768
+
+class FakeESP32Server:
+    """Local stand-in for the ESP32 soft-AP HTTP server
+
+    Serves the same /, /test and /file endpoints as bluetooth.ino. Each
+    chunk of /file can be dropped at random to mimic flaky WiFi, or every
+    response cut after `drop_after` bytes; Range support can be switched
+    off to match the stock firmware, and `bandwidth` (bytes/s) paces each
+    response like a real soft-AP link. Like the firmware, the digest
+    doubles as the ETag and a stale If-Range gets the whole file.
+    """
+
+    def __init__(self, filename, drop_rate=0.0, support_ranges=True, send_digest=True, seed=None,
+                 bandwidth=None, drop_after=None):
+        self.filename = filename
+        self.drop_rate = drop_rate
+        self.drop_after = drop_after
+        self.bandwidth = bandwidth
+        self.support_ranges = support_ranges
+        self.send_digest = send_digest
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.drops = 0
+        self.served = []  # (start, end) of every /file response, end exclusive
+        self.stat = None
+        self.sha256 = None
+
+    def digest(self):
+        """SHA-256 of the file, recomputed when it is replaced"""
+        stat = os.stat(self.filename)
+        if (stat.st_mtime_ns, stat.st_size) != self.stat:
+            with open(self.filename, 'rb') as f:
+                self.sha256 = hashlib.sha256(f.read()).hexdigest()
+            self.stat = (stat.st_mtime_ns, stat.st_size)
+        return self.sha256
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/', self.handle_root)
+        app.router.add_get('/test', self.handle_test)
+        app.router.add_get('/file', self.handle_file)
+        return app
+
+    async def handle_root(self, request):
+        return web.Response(text="<h1>ESP32 Audio Server</h1>", content_type='text/html')
+
+    async def handle_test(self, request):
+        return web.Response(text="Server is running")
+
+    def parse_range(self, header, size):
+        """Return (start, end) for a single 'bytes=a-b' range, end exclusive"""
+        if not header or not header.startswith('bytes='):
+            return None
+        first, _, last = header[6:].partition('-')
+        if not first:
+            return None
+        start = int(first)
+        end = int(last) + 1 if last else size
+        if start >= size:
+            return None
+        return start, min(end, size)
+
+    async def handle_file(self, request):
+        self.requests += 1
+        size = os.path.getsize(self.filename)
+        byte_range = self.parse_range(request.headers.get('Range'), size) if self.support_ranges else None
+        etag = f'"{self.digest()}"' if self.send_digest else None
+        if byte_range and 'If-Range' in request.headers and request.headers['If-Range'] != etag:
+            byte_range = None
+
+        status = 200
+        start, end = 0, size
+        headers = {'Content-Type': 'audio/wav'}
+        if byte_range:
+            status = 206
+            start, end = byte_range
+            headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+            headers['Accept-Ranges'] = 'bytes'
+        headers['Content-Length'] = str(end - start)
+        if etag:
+            headers['X-Content-SHA256'] = self.sha256
+            headers['ETag'] = etag
+        self.served.append((start, end))
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        started = time.monotonic()
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while offset < end:
+                chunk = f.read(min(CHUNK_SIZE, end - offset))
+                if not chunk:
+                    break
+                if (self.drop_rate and self.random.random() < self.drop_rate
+                        or self.drop_after is not None and offset - start >= self.drop_after):
+                    # Simulate the AP going away mid-transfer
+                    self.drops += 1
+                    request.transport.close()
+                    return response
+                await response.write(chunk)
+                offset += len(chunk)
+                if self.bandwidth:
+                    # Hold the average rate of this response at the link speed
+                    ahead = (offset - start) / self.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        await response.write_eof()
+        return response
+
+async def serve(server, host='127.0.0.1', port=8080):
+    """Start the fake server and return its AppRunner"""
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+async def main():
+    parser = argparse.ArgumentParser(description="Serve a WAV file like the ESP32 does")
+    parser.add_argument('filename')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help="Probability of dropping the connection on each 32KB chunk")
+    parser.add_argument('--no-ranges', action='store_true',
+                        help="Ignore Range headers like the stock firmware")
+    parser.add_argument('--bandwidth-mbps', type=float,
+                        help="Cap each response at this many megabits per second")
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_mbps * 1e6 / 8 if args.bandwidth_mbps else None
+    server = FakeESP32Server(args.filename, args.drop_rate, not args.no_ranges, bandwidth=bandwidth)
+    runner = await serve(server, args.host, args.port)
+    print(f"Serving {args.filename} at http://{args.host}:{args.port}/file")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,248 @@
+import numpy as np
+
+from audiocodec import (CODEC_MULAW, CODEC_OPUS, CODEC_PCM16, CodecError, OpusFrameDecoder,
+                        adpcm_decode, mulaw_decode, payload_size)
+
+HEADER_SIZE = 3           # frame_count (uint16 LE) + codec byte (see audiocodec)
+SAMPLES_PER_FRAME = 160   # Match ESP32's BLE_FRAME_SIZE
+BATCH_FRAMES = 50         # Notifications parsed per NumPy batch (0.5 s at 100 fps)
+MAX_GAP_FRAMES = 500      # Larger sequence jumps are treated as a counter reset
+GAP_FILL_MODES = ('silence', 'interpolate')
+
+class FrameDecoder:
+    """Batch BLE frame decoder that rebuilds a gap-free audio timeline
+
+    Notifications are copied into a fixed-stride ring buffer with no
+    per-packet parsing. Each flush parses the 16-bit frame counters of the
+    whole batch in NumPy, unwraps them into absolute sequence numbers and
+    places every payload at its slot in the output, so frames that were lost
+    become exactly one frame of silence (or interpolated fill) each and the
+    output stays aligned with wall-clock time. Compressed payloads are
+    decoded per batch according to each frame's codec byte.
+    """
+
+    def __init__(self, samples_per_frame=SAMPLES_PER_FRAME, batch_frames=BATCH_FRAMES,
+                 fill='silence', max_gap_frames=MAX_GAP_FRAMES):
+        if fill not in GAP_FILL_MODES:
+            raise ValueError(f"fill must be one of {GAP_FILL_MODES}")
+        self.samples_per_frame = samples_per_frame
+        self.frame_bytes = HEADER_SIZE + samples_per_frame * 2
+        self.batch_frames = batch_frames
+        self.fill = fill
+        self.max_gap_frames = max_gap_frames
+        self.allowed_gap = 0      # Larger forward jump accepted once, see expect_gap()
+        self.ring = bytearray(self.frame_bytes * batch_frames)
+        self.lengths = np.zeros(batch_frames, dtype=np.int64)  # Received size of each slot
+        self.count = 0
+        self.opus = None          # Stateful Opus decoder, created on the first Opus frame
+        self.codec_error = None   # Last reason a codec could not be decoded
+        self.last_raw = None      # Counter of the last frame in arrival order
+        self.last_abs = None      # Its unwrapped sequence number
+        self.next_seq = None      # Absolute sequence of the next frame to emit
+        self.first_seq = None     # Sequence of the first emitted frame (output frame 0)
+        self.last_sample = 0      # Last emitted sample, anchors interpolation
+        self.gaps = []            # [start, end) output frame ranges that were filled in
+        self.stats = {
+            'decoded': 0,
+            'drops': 0,           # Frames lost and filled in
+            'out_of_order': 0,
+            'late': 0,            # Frames that arrived after their slot was emitted
+            'duplicates': 0,
+            'invalid_size': 0,
+            'unsupported': 0,     # Frames in a codec we cannot decode, filled with silence
+            'resyncs': 0
+        }
+
+    def push(self, data):
+        """Copy one notification into the ring; returns True when a batch is ready
+
+        Sizes are only checked per codec in decode_batch(); every notification
+        keeps its slot so the timeline stays exact.
+        """
+        offset = self.count * self.frame_bytes
+        size = len(data)
+        if size > self.frame_bytes:
+            data = data[:self.frame_bytes]
+        self.ring[offset:offset + len(data)] = data
+        self.lengths[self.count] = size
+        self.count += 1
+        return self.count >= self.batch_frames
+
+    def unwrap(self, raw):
+        """Convert 16-bit frame counters into absolute sequence numbers"""
+        previous = np.empty_like(raw)
+        previous[1:] = raw[:-1]
+        previous[0] = raw[0] if self.last_raw is None else self.last_raw
+        # Signed distance from the previous frame, modulo 2^16
+        delta = ((raw - previous + 0x8000) & 0xFFFF) - 0x8000
+        if self.last_raw is None:
+            delta[0] = 0
+            base = int(raw[0])
+        else:
+            base = self.last_abs
+        jumps = np.abs(delta) > self.max_gap_frames
+        if self.allowed_gap:
+            jumps[0] = not -self.max_gap_frames <= delta[0] <= self.allowed_gap
+            self.allowed_gap = 0
+        if jumps.any():
+            # The device restarted or we missed far too much to fill: resync
+            self.stats['resyncs'] += int(jumps.sum())
+            delta[jumps] = 1
+        self.stats['out_of_order'] += int((delta < 0).sum())
+        seq = base + np.cumsum(delta)
+        self.last_raw = int(raw[-1])
+        self.last_abs = int(seq[-1])
+        return seq
+
+    def decode_batch(self):
+        """Parse the buffered notifications; returns (sequence numbers, payloads)"""
+        n = self.count
+        self.count = 0
+        frames = np.frombuffer(self.ring, dtype=np.uint8, count=n * self.frame_bytes)
+        frames = frames.reshape(n, self.frame_bytes)
+        raw = frames[:, 0].astype(np.int64) | (frames[:, 1].astype(np.int64) << 8)
+        seq = self.unwrap(raw)
+        body = frames[:, HEADER_SIZE:]
+        lengths = self.lengths[:n] - HEADER_SIZE
+        codecs = frames[:, 2]
+        if not codecs.any():
+            # Raw PCM from stock firmware: no per-codec dispatch
+            payload = self.decode_pcm(body, lengths)
+        else:
+            payload = np.zeros((n, self.samples_per_frame), dtype=np.int16)
+            for codec in np.unique(codecs).tolist():
+                rows = np.flatnonzero(codecs == codec)
+                try:
+                    payload[rows] = self.decode_codec(codec, body[rows], lengths[rows])
+                except CodecError as e:
+                    self.stats['unsupported'] += len(rows)
+                    self.codec_error = str(e)
+        self.stats['decoded'] += n
+        return seq, payload
+
+    def decode_pcm(self, body, lengths):
+        """Raw 16-bit payloads; wrong-sized frames are zero-padded or cut"""
+        payload = body.copy()
+        invalid = lengths != payload.shape[1]
+        if invalid.any():
+            self.stats['invalid_size'] += int(invalid.sum())
+            payload[np.arange(payload.shape[1])[None, :] >= lengths[:, None]] = 0
+        return payload.view('<i2')
+
+    def decode_codec(self, codec, body, lengths):
+        """Decode the frames of one codec into (frames, samples_per_frame) int16"""
+        if codec == CODEC_PCM16:
+            return self.decode_pcm(body, lengths)
+        size = payload_size(codec, self.samples_per_frame)
+        if codec == CODEC_OPUS:
+            if self.opus is None:
+                self.opus = OpusFrameDecoder(self.samples_per_frame)
+            pcm = np.zeros((len(body), self.samples_per_frame), dtype=np.int16)
+            for i, (frame, length) in enumerate(zip(body, lengths)):
+                decoded = self.opus.decode(frame[:length])
+                if decoded is None:
+                    self.stats['invalid_size'] += 1
+                else:
+                    pcm[i] = decoded
+            return pcm
+        if codec == CODEC_MULAW:
+            pcm = mulaw_decode(body[:, :size])
+        else:  # CODEC_IMA_ADPCM
+            pcm = adpcm_decode(body[:, :size], self.samples_per_frame)
+        # A truncated compressed frame cannot be decoded; it becomes silence
+        invalid = lengths != size
+        if invalid.any():
+            self.stats['invalid_size'] += int(invalid.sum())
+            pcm[invalid] = 0
+        return pcm
+
+    def place(self, seq, payload, until=None):
+        """Lay frames onto the timeline from next_seq up to `until` (exclusive)
+
+        Returns the emitted PCM as int16 plus the frames that lie beyond
+        `until`, which the caller may hold for a later call.
+        """
+        if self.next_seq is None:
+            self.next_seq = int(seq.min()) if len(seq) else 0
+            self.first_seq = self.next_seq
+        late = seq < self.next_seq
+        if late.any():
+            self.stats['late'] += int(late.sum())
+            seq, payload = seq[~late], payload[~late]
+        if until is None:
+            until = int(seq.max()) + 1 if len(seq) else self.next_seq
+        held = seq >= until
+        held_seq, held_payload = seq[held], payload[held]
+        seq, payload = seq[~held], payload[~held]
+
+        slots = until - self.next_seq
+        if slots <= 0:
+            return np.zeros(0, dtype=np.int16), held_seq, held_payload
+        out = np.zeros((slots, self.samples_per_frame), dtype=np.int16)
+        filled = np.zeros(slots, dtype=bool)
+        index = seq - self.next_seq
+        unique = np.unique(index)
+        self.stats['duplicates'] += len(index) - len(unique)
+        out[index] = payload
+        filled[index] = True
+        missing = slots - len(unique)
+        if missing:
+            self.stats['drops'] += missing
+            self.record_gaps(np.flatnonzero(~filled) + (self.next_seq - self.first_seq))
+            if self.fill == 'interpolate':
+                self.interpolate(out, filled)
+
+        self.next_seq = until
+        out = out.reshape(-1)
+        self.last_sample = int(out[-1])
+        return out, held_seq, held_payload
+
+    def record_gaps(self, frames):
+        """Add filled output frames to self.gaps as merged [start, end) runs"""
+        breaks = np.flatnonzero(np.diff(frames) != 1)
+        starts = frames[np.concatenate(([0], breaks + 1))].tolist()
+        ends = (frames[np.concatenate((breaks, [len(frames) - 1]))] + 1).tolist()
+        for start, end in zip(starts, ends):
+            if self.gaps and self.gaps[-1][1] == start:
+                self.gaps[-1][1] = end
+            else:
+                self.gaps.append([start, end])
+
+    def interpolate(self, out, filled):
+        """Fill missing frames with a linear ramp between their neighbours"""
+        flat = out.reshape(-1)
+        known = np.repeat(filled, self.samples_per_frame)
+        positions = np.arange(flat.size)
+        xp = np.concatenate(([-1], positions[known]))
+        fp = np.concatenate(([self.last_sample], flat[known]))
+        flat[~known] = np.interp(positions[~known], xp, fp).astype(np.int16)
+
+    def expect_gap(self, frames):
+        """Accept a forward jump of up to `frames` at the start of the next batch
+
+        Used when the link was down for a while: the device kept counting,
+        so the jump is real time that must be filled rather than a reset.
+        """
+        self.allowed_gap = frames
+
+    def flush(self):
+        """Decode everything buffered and return contiguous int16 PCM"""
+        if not self.count:
+            return np.zeros(0, dtype=np.int16)
+        seq, payload = self.decode_batch()
+        pcm, _, _ = self.place(seq, payload)
+        return pcm
+
+    def reset(self):
+        """Forget sequence state, e.g. at the start of a new session"""
+        self.count = 0
+        self.last_raw = None
+        self.last_abs = None
+        self.next_seq = None
+        self.first_seq = None
+        self.allowed_gap = 0
+        self.last_sample = 0
+        self.gaps = []
+        self.opus = None
+        for key in self.stats:
+            self.stats[key] = 0
@@ -0,0 +1,90 @@
+import numpy as np
+
+JITTER_LATENCY_FRAMES = 20          # 200 ms reorder window at 100 frames/second
+JITTER_RELEASE_FRAMES = 5           # Release every 50 ms instead of once per decoder batch
+DEPTH_BINS = (1, 2, 4, 8, 16, 32, 64)  # Lower edges of the reorder-depth histogram
+
+class JitterBuffer:
+    """Reassemble out-of-order BLE frames within a fixed latency window
+
+    Sits on top of a FrameDecoder. Decoded frames are held until the
+    highest sequence number seen is `latency_frames` ahead of them, then
+    released in sequence order as contiguous PCM. A frame that shows up
+    after its slot was released is discarded and counted as late by the
+    decoder; slots still empty when released are filled as lost. Call
+    flush() once `due` so audio leaves within `release_frames` of its
+    deadline rather than in decoder-batch lumps.
+    """
+
+    def __init__(self, decoder, latency_frames=JITTER_LATENCY_FRAMES, release_frames=JITTER_RELEASE_FRAMES):
+        self.decoder = decoder
+        self.latency_frames = latency_frames
+        self.release_frames = max(1, release_frames)
+        self.reset()
+
+    def reset(self):
+        """Drop held frames and statistics, e.g. at the start of a new session"""
+        self.held_seq = np.zeros(0, dtype=np.int64)
+        self.held_payload = np.zeros((0, self.decoder.samples_per_frame), dtype=np.int16)
+        self.highest = None
+        self.depth_histogram = np.zeros(len(DEPTH_BINS), dtype=np.int64)
+        self.stats = {
+            'reordered': 0,            # Frames that arrived behind a later frame
+            'reorder_depth_total': 0,  # Sum of how many frames behind they were
+            'max_reorder_depth': 0
+        }
+
+    def track_reorder(self, seq):
+        """Measure how far behind the newest frame each arrival was"""
+        start = seq[0] if self.highest is None else self.highest
+        prior = np.maximum.accumulate(np.concatenate(([start], seq)))
+        depth = prior[:-1] - seq
+        self.highest = int(prior[-1])
+        depth = depth[depth > 0]
+        if depth.size:
+            self.stats['reordered'] += int(depth.size)
+            self.stats['reorder_depth_total'] += int(depth.sum())
+            self.stats['max_reorder_depth'] = max(self.stats['max_reorder_depth'], int(depth.max()))
+            bins = np.searchsorted(DEPTH_BINS, depth, side='right') - 1
+            self.depth_histogram += np.bincount(bins, minlength=len(DEPTH_BINS))
+
+    @property
+    def due(self):
+        """True once enough frames arrived since the last flush that some have passed the window"""
+        return self.decoder.count >= self.release_frames
+
+    def flush(self):
+        """Decode the buffered batch and release frames older than the window"""
+        if not self.decoder.count:
+            return np.zeros(0, dtype=np.int16)
+        seq, payload = self.decoder.decode_batch()
+        self.track_reorder(seq)
+        seq = np.concatenate((self.held_seq, seq))
+        payload = np.concatenate((self.held_payload, payload))
+        until = self.highest - self.latency_frames + 1
+        pcm, self.held_seq, self.held_payload = self.decoder.place(seq, payload, until)
+        return pcm
+
+    def drain(self):
+        """Release everything, including frames still inside the window"""
+        pcm = self.flush()
+        if not self.held_seq.size:
+            return pcm
+        rest, self.held_seq, self.held_payload = self.decoder.place(self.held_seq, self.held_payload)
+        return np.concatenate((pcm, rest))
+
+    @property
+    def mean_reorder_depth(self):
+        if not self.stats['reordered']:
+            return 0.0
+        return self.stats['reorder_depth_total'] / self.stats['reordered']
+
+    def format_histogram(self):
+        """Render the reorder-depth histogram as 'lo-hi:count' pairs"""
+        parts = []
+        for i, count in enumerate(self.depth_histogram):
+            lo = DEPTH_BINS[i]
+            hi = f"{DEPTH_BINS[i + 1] - 1}" if i + 1 < len(DEPTH_BINS) else ""
+            label = str(lo) if hi == str(lo) else f"{lo}-{hi}"
+            parts.append(f"{label}:{count}")
+        return " ".join(parts)
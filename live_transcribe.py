@@ -0,0 +1,324 @@
+import itertools
+import multiprocessing
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from vad import MIN_SPEECH, SpeechDetector
+
+SAMPLE_RATE = 16000
+SILENCE_DBFS = -45.0      # Frames quieter than this always count as pause
+MIN_CHUNK = 2.0           # Never cut a chunk shorter than this many seconds
+MAX_CHUNK = 15.0          # Always cut by this length, pause or not
+PAUSE = 0.4               # Seconds of quiet that mark a cut point
+OVERLAP = 0.5             # Seconds of audio repeated at the start of the next chunk
+PARTIAL_INTERVAL = 1.5    # Seconds of new audio between partial transcripts
+MAX_BACKLOG = 8           # Final chunks queued before warning about falling behind
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+TRANSCRIPTION_RTF = metrics.histogram('transcription_rtf', "Processing time over audio time per chunk or job",
+                                      RTF_BUCKETS)
+
+class PauseChunker:
+    """Cut a live 16 kHz int16 stream into overlapping chunks at pauses
+
+    feed() returns (kind, start, end, audio) tuples where kind is 'partial'
+    for a preview of the chunk still being recorded and 'final' for a
+    completed chunk. start/end are seconds from the start of the stream and
+    audio is float32 in [-1, 1]. Pauses and speech are told apart by a
+    vad.SpeechDetector, so chunks holding only silence or noise are
+    dropped and never reach Whisper.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, min_chunk=MIN_CHUNK, max_chunk=MAX_CHUNK,
+                 pause=PAUSE, overlap=OVERLAP, partial_interval=PARTIAL_INTERVAL,
+                 silence_dbfs=SILENCE_DBFS, min_speech=MIN_SPEECH, detector=None):
+        self.sample_rate = sample_rate
+        self.detector = detector or SpeechDetector(sample_rate, min_dbfs=silence_dbfs)
+        self.window = self.detector.frame
+        self.min_speech = max(1, round(min_speech / self.detector.frame_seconds))
+        self.min_chunk = int(min_chunk * sample_rate)
+        self.max_chunk = int(max_chunk * sample_rate)
+        self.pause = int(pause * sample_rate)
+        self.overlap = int(overlap * sample_rate)
+        self.partial_interval = int(partial_interval * sample_rate)
+        self.reset()
+
+    def reset(self):
+        """Start a new stream timeline"""
+        self.parts = []
+        self.length = 0
+        self.start = 0            # Stream sample index of the buffer's first sample
+        self.silent_run = 0       # Quiet samples at the end of the buffer
+        self.speech_frames = 0    # Speech frames since the last cut
+        self.voiced = False
+        self.last_partial = 0
+        self.detector.reset()
+
+    def measure(self, pcm):
+        """Update the trailing non-speech count from whole detector frames"""
+        speech = self.detector.classify(pcm)
+        if not len(speech):
+            return
+        if speech.any():
+            self.speech_frames += int(speech.sum())
+            self.voiced = self.speech_frames >= self.min_speech
+            last_speech = len(speech) - 1 - int(np.argmax(speech[::-1]))
+            self.silent_run = (len(speech) - 1 - last_speech) * self.window
+        else:
+            self.silent_run += len(speech) * self.window
+
+    def audio(self, end=None):
+        """Return the buffered audio up to `end` samples as float32"""
+        pcm = np.concatenate(self.parts) if len(self.parts) > 1 else self.parts[0]
+        self.parts = [pcm]
+        return pcm[:end].astype(np.float32) / 32768.0
+
+    def span(self, samples):
+        return self.start / self.sample_rate, (self.start + samples) / self.sample_rate
+
+    def cut(self, at):
+        """Emit the first `at` samples as a final chunk and keep the overlap"""
+        chunk = None
+        if self.voiced:
+            chunk = ('final',) + self.span(at) + (self.audio(at),)
+        keep = max(0, at - self.overlap)
+        pcm = self.parts[0][keep:] if self.parts else np.zeros(0, dtype=np.int16)
+        self.parts = [pcm] if len(pcm) else []
+        self.start += keep
+        self.length = len(pcm)
+        self.silent_run = min(self.silent_run, self.length)
+        # The overlap was already transcribed; wait for new speech
+        self.voiced = False
+        self.speech_frames = 0
+        self.last_partial = self.length
+        return chunk
+
+    def feed(self, pcm):
+        """Add int16 PCM and return any chunks that became ready"""
+        if not len(pcm):
+            return []
+        self.parts.append(pcm)
+        self.length += len(pcm)
+        self.measure(pcm)
+        chunks = []
+        if self.length >= self.min_chunk and self.silent_run >= self.pause:
+            # Cut in the middle of the pause so neither side loses a word edge
+            self.audio()
+            chunks.append(self.cut(self.length - self.silent_run // 2))
+        elif self.length >= self.max_chunk:
+            self.audio()
+            chunks.append(self.cut(self.length))
+        elif self.voiced and self.length - self.last_partial >= self.partial_interval:
+            self.last_partial = self.length
+            chunks.append(('partial',) + self.span(self.length) + (self.audio(),))
+        return [chunk for chunk in chunks if chunk]
+
+    def finish(self):
+        """Flush whatever is buffered as a final chunk"""
+        chunk = None
+        if self.length:
+            self.audio()
+            chunk = self.cut(self.length)
+        self.reset()
+        return [chunk] if chunk else []
+
+def words(text):
+    return [re.sub(r'[^\w]', '', w).lower() for w in text.split()]
+
+def strip_overlap(previous, text, max_words=8):
+    """Drop words at the start of `text` that repeat the end of `previous`"""
+    prev_words, new_words = words(previous), text.split()
+    normalized = words(text)
+    for n in range(min(max_words, len(prev_words), len(new_words)), 0, -1):
+        if prev_words[-n:] == normalized[:n]:
+            return " ".join(new_words[n:])
+    return text
+
+def transcription_worker(jobs, results, model_name, language):
+    """Worker process: load Whisper once and transcribe chunks as they arrive
+
+    A model that cannot load is reported as ('failed', None, message) before
+    the process exits; a chunk that fails as ('error', job_id, message).
+    """
+    try:
+        import whisper
+        model = whisper.load_model(model_name)
+    except Exception as e:
+        results.put(('failed', None, f"{type(e).__name__}: {e}"))
+        return
+    results.put(('ready', None, None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, audio, prompt = job
+        try:
+            result = model.transcribe(audio, language=language, fp16=False,
+                                      initial_prompt=prompt or None,
+                                      condition_on_previous_text=False)
+        except Exception as e:
+            results.put(('error', job_id, f"{type(e).__name__}: {e}"))
+            continue
+        results.put(('result', job_id, result['text'].strip()))
+
+class TranscriptionWorker:
+    """Whisper in a separate process, shared by every live stream
+
+    Inference never runs on the BLE event loop: chunks are pickled into a
+    multiprocessing queue and results come back on a reader thread that
+    hands them to the submitting LiveTranscriber. A chunk that fails is
+    delivered as None; once the process has died every waiting callback
+    gets None and further chunks are refused.
+    """
+
+    def __init__(self, model_name="base", language=None):
+        self.model_name = model_name
+        self.language = language
+        self.job_ids = itertools.count()
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.process = None
+        self.exited = False  # Set by the reader once the process is gone
+
+    def start(self):
+        self.exited = False
+        context = multiprocessing.get_context('spawn')
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(
+            target=transcription_worker,
+            args=(self.jobs, self.results, self.model_name, self.language),
+            daemon=True
+        )
+        self.process.start()
+        self.reader = threading.Thread(target=self.read_results, daemon=True)
+        self.reader.start()
+
+    @property
+    def pending(self):
+        return len(self.callbacks)
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def submit(self, audio, prompt, callback):
+        """Queue a chunk; `callback(text)` runs on the reader thread
+
+        Returns False, without queueing, when the worker is not running.
+        """
+        if not self.alive:
+            return False
+        job_id = next(self.job_ids)
+        with self.lock:
+            if self.exited:
+                return False
+            self.callbacks[job_id] = callback
+        self.jobs.put((job_id, audio, prompt))
+        return True
+
+    def read_results(self):
+        while True:
+            try:
+                kind, job_id, text = self.results.get(timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    print(f"Live transcription worker exited (code {self.process.exitcode}); "
+                          f"dropping {self.pending} queued chunks")
+                    break
+                continue
+            if kind == 'ready':
+                print(f"Live transcription model '{self.model_name}' loaded")
+                continue
+            if kind == 'failed':
+                print(f"Live transcription disabled: could not load '{self.model_name}': {text}")
+                continue
+            if kind == 'error':
+                print(f"Live transcription failed for a chunk: {text}")
+                text = None
+            with self.lock:
+                callback = self.callbacks.pop(job_id, None)
+            if callback:
+                callback(text)
+        # Nothing will answer the chunks still waiting; settle their owners' backlogs
+        # and don't let exit block on flushing them into a pipe nobody reads
+        self.jobs.cancel_join_thread()
+        with self.lock:
+            self.exited = True
+            callbacks, self.callbacks = list(self.callbacks.values()), {}
+        for callback in callbacks:
+            callback(None)
+
+    def stop(self):
+        if self.process and self.process.is_alive():
+            self.jobs.put(None)
+            self.process.join(timeout=10)
+
+def print_line(label, kind, start, end, text):
+    tag = "..." if kind == 'partial' else ""
+    print(f"[{label}] ({start:.1f}s - {end:.1f}s){tag} {text}")
+
+class LiveTranscriber:
+    """Per-stream PCM consumer that turns a receiver's audio into transcript lines
+
+    Register an instance in AudioStreamReceiver.pcm_consumers. Feeding is
+    cheap NumPy work on the caller's thread; partials are skipped while the
+    worker is busy so they never delay final lines.
+    """
+
+    def __init__(self, worker, label="live", on_line=print_line, **chunker_options):
+        self.worker = worker
+        self.label = label
+        self.on_line = on_line
+        self.chunker = PauseChunker(**chunker_options)
+        self.previous_text = ""
+        self.finals_pending = 0
+        # deliver() runs on the worker's reader thread, submit() on the caller's
+        self.lock = threading.Lock()
+
+    def __call__(self, pcm):
+        for chunk in self.chunker.feed(pcm):
+            self.submit(*chunk)
+
+    def submit(self, kind, start, end, audio):
+        if kind == 'partial' and self.worker.pending:
+            return
+        submitted = time.monotonic()
+
+        def deliver(text):
+            if kind == 'final':
+                with self.lock:
+                    self.finals_pending -= 1
+                    if text:
+                        text = strip_overlap(self.previous_text, text)
+                        self.previous_text = text or self.previous_text
+                if text is not None:
+                    TRANSCRIPTION_RTF.observe((time.monotonic() - submitted) / max(end - start, 1e-3),
+                                              mode="live")
+            if text:
+                self.on_line(self.label, kind, start, end, text)
+
+        with self.lock:
+            prompt = self.previous_text[-200:]
+            if kind == 'final':
+                self.finals_pending += 1
+                backlog = self.finals_pending
+        if not self.worker.submit(audio, prompt, deliver):
+            if kind == 'final':
+                with self.lock:
+                    self.finals_pending -= 1
+            return
+        if kind == 'final' and backlog > MAX_BACKLOG:
+            print(f"[{self.label}] Live transcription is {backlog} chunks behind")
+
+    def end_session(self):
+        """Transcribe the tail of the session and restart the timeline"""
+        for chunk in self.chunker.finish():
+            self.submit(*chunk)
+        with self.lock:
+            self.previous_text = ""
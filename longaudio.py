@@ -0,0 +1,251 @@
+import itertools
+import os
+import struct
+
+import numpy as np
+
+from resample import PolyphaseDecimator
+from turncache import audio_key
+
+SAMPLE_RATE = 16000       # Rate handed to pyannote and Whisper
+WINDOW = 600.0            # Seconds of audio diarized at a time
+OVERLAP = 60.0            # Seconds shared by consecutive windows for label stitching
+MIN_MATCH = 1.0           # Seconds of co-speech needed to tie two labels together
+LONG_AUDIO_SECONDS = 1800.0  # Files longer than this use the windowed path
+ARCHIVE_EXTENSIONS = ('.flac', '.opus')  # Written by archive.py in place of a recording's WAV
+
+def soundfile_module():
+    """Import soundfile, which reads and writes the FLAC and Opus archives"""
+    try:
+        import soundfile
+    except ImportError:
+        raise ImportError("FLAC and Opus archives need the soundfile package (pip install soundfile)") from None
+    return soundfile
+
+def to_model_rate(block, rate, scale=1.0):
+    """Mix (samples, channels) to mono float32 at SAMPLE_RATE"""
+    audio = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0].astype(np.float32)
+    audio *= scale
+    if rate != SAMPLE_RATE and rate % SAMPLE_RATE == 0:
+        decimator = PolyphaseDecimator(rate // SAMPLE_RATE)
+        audio = np.concatenate((decimator.process(audio), decimator.flush())).astype(np.float32)
+    elif rate != SAMPLE_RATE:
+        import torch
+        import torchaudio
+        audio = torchaudio.functional.resample(torch.from_numpy(audio), rate, SAMPLE_RATE).numpy()
+    return audio
+
+class WavMap:
+    """Memory-mapped view of a PCM WAV file
+
+    Nothing is read until a slice is requested, so a day of 48 kHz audio
+    costs address space rather than RAM. Slices come back as mono float32
+    at SAMPLE_RATE, ready for pyannote or Whisper.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            riff = f.read(12)
+            if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+                raise ValueError(f"{path} is not a WAV file")
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{path} has no data chunk")
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHIIHH', f.read(16))
+                    f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    data_offset = f.tell()
+                    break
+                else:
+                    f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+        if fmt is None:
+            raise ValueError(f"{path} has no fmt chunk")
+        audio_format, self.channels, self.rate, _, _, bits = fmt
+        if audio_format == 1 and bits == 16:
+            dtype, self.scale = np.dtype('<i2'), 1 / 32768.0
+        elif audio_format == 3 and bits == 32:
+            dtype, self.scale = np.dtype('<f4'), 1.0
+        else:
+            raise ValueError(f"Unsupported WAV format {audio_format}/{bits}-bit in {path}")
+
+        # Recordings cut short by a crash may carry a zero or stale data size
+        available = os.path.getsize(path) - data_offset
+        if chunk_size == 0 or chunk_size > available:
+            chunk_size = available
+        frames = chunk_size // (dtype.itemsize * self.channels)
+        self.samples = np.memmap(path, dtype=dtype, mode='r', offset=data_offset,
+                                 shape=(frames, self.channels))
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.rate
+
+    def __len__(self):
+        """Length in samples at SAMPLE_RATE"""
+        return int(self.duration * SAMPLE_RATE)
+
+    def segment(self, start, end):
+        """Return seconds [start, end) as mono float32 at SAMPLE_RATE"""
+        first = max(0, int(start * self.rate))
+        last = min(len(self.samples), int(end * self.rate))
+        return to_model_rate(self.samples[first:last], self.rate, self.scale)
+
+class ArchiveMap:
+    """Seekable reader for a FLAC or Opus archive with WavMap's interface
+
+    Only the requested slice is decoded: both formats seek to a sample,
+    so a turn deep into a long archive costs about as much as one at the
+    start. The file is opened per read, which keeps the object cheap to
+    pass to worker processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            info = soundfile_module().info(path)
+        except RuntimeError as e:
+            raise ValueError(f"{path} is not a readable archive: {e}") from None
+        self.rate = info.samplerate
+        self.channels = info.channels
+        self.frames = info.frames
+
+    @property
+    def duration(self):
+        return self.frames / self.rate
+
+    def __len__(self):
+        """Length in samples at SAMPLE_RATE"""
+        return int(self.duration * SAMPLE_RATE)
+
+    def segment(self, start, end):
+        """Return seconds [start, end) as mono float32 at SAMPLE_RATE"""
+        first = max(0, int(start * self.rate))
+        last = min(self.frames, int(end * self.rate))
+        with soundfile_module().SoundFile(self.path) as f:
+            f.seek(first)
+            block = f.read(max(0, last - first), dtype='float32', always_2d=True)
+        return to_model_rate(block, self.rate)
+
+def find_audio(path):
+    """The file holding a recording: path itself, or its archive once the WAV was replaced"""
+    if os.path.exists(path):
+        return path
+    stem = os.path.splitext(path)[0]
+    for extension in ARCHIVE_EXTENSIONS:
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return path
+
+def open_audio(path):
+    """WavMap or ArchiveMap for a recording, following it into its archive"""
+    path = find_audio(path)
+    if os.path.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS:
+        return ArchiveMap(path)
+    return WavMap(path)
+
+def clip_turns(turns, start, end):
+    """Clip (start, end, label) turns to [start, end), dropping empty ones"""
+    clipped = []
+    for s, e, label in turns:
+        s, e = max(s, start), min(e, end)
+        if e > s:
+            clipped.append((s, e, label))
+    return clipped
+
+def match_speakers(previous, current, start, end, min_match=MIN_MATCH):
+    """Map labels in `current` to labels in `previous` by co-speech in [start, end)"""
+    previous = clip_turns(previous, start, end)
+    current = clip_turns(current, start, end)
+    overlap = {}
+    for ps, pe, plabel in previous:
+        for cs, ce, clabel in current:
+            shared = min(pe, ce) - max(ps, cs)
+            if shared > 0:
+                overlap[(plabel, clabel)] = overlap.get((plabel, clabel), 0.0) + shared
+    # Greedy assignment, strongest agreement first
+    mapping, used = {}, set()
+    for (plabel, clabel), shared in sorted(overlap.items(), key=lambda item: -item[1]):
+        if shared < min_match or clabel in mapping or plabel in used:
+            continue
+        mapping[clabel] = plabel
+        used.add(plabel)
+    return mapping
+
+def pipeline_input(samples, rate=SAMPLE_RATE):
+    """pyannote's in-memory input for float32 samples
+
+    pyannote takes a (channel, time) torch tensor. Without torch installed
+    only a stub pipeline can run, so the samples stay a NumPy array.
+    """
+    try:
+        import torch
+    except ImportError:
+        return {"waveform": samples[None], "sample_rate": rate}
+    return {"waveform": torch.from_numpy(samples)[None], "sample_rate": rate}
+
+def diarize_windowed(pipeline, wav, window=WINDOW, overlap=OVERLAP, cache=None, pipeline_id=""):
+    """Diarize a long recording in overlapping windows with stitched labels
+
+    Each window is diarized independently; its local speaker labels are
+    matched to global ones by how much they co-occur in the region shared
+    with the previous window. Turns are cut over at the middle of that
+    region. Returns (start, end, speaker) tuples in time order.
+
+    Windows start at fixed multiples of window - overlap, so when the file
+    has only grown, every window but the last is found in a
+    turncache.TranscriptCache and only new audio goes through the pipeline.
+    """
+    labels = (f"SPEAKER_{n:02d}" for n in itertools.count())
+    turns = []
+    previous = None
+    start = 0.0
+    while start < wav.duration:
+        end = min(start + window, wav.duration)
+        samples = wav.segment(start, end)
+        key = audio_key('window', samples, pipeline=pipeline_id) if cache is not None else None
+        relative = cache.get('window', key) if key else None
+        if relative is None:
+            annotation = pipeline(pipeline_input(samples))
+            relative = [(turn.start, turn.end, label)
+                        for turn, _, label in annotation.itertracks(yield_label=True)]
+            if key:
+                cache.put('window', key, relative)
+        local = [(s + start, e + start, label) for s, e, label in relative]
+
+        mapping = {}
+        if previous is not None:
+            mapping = match_speakers(previous, local, start, start + overlap)
+        for _, _, label in local:
+            if label not in mapping:
+                mapping[label] = next(labels)
+        current = [(s, e, mapping[label]) for s, e, label in local]
+
+        # Hand over from the previous window in the middle of the overlap
+        seam = start + overlap / 2 if previous is not None else start
+        # Only turns from the previous window can reach past the seam
+        i = len(turns)
+        while i > 0 and turns[i - 1][0] >= seam - window:
+            i -= 1
+        tail = clip_turns(turns[i:], 0.0, seam)
+        # Rejoin turns the seam split in two
+        open_at_seam = {label: k for k, (s, e, label) in enumerate(tail) if e == seam}
+        for s, e, label in clip_turns(current, seam, end):
+            k = open_at_seam.pop(label, None) if s == seam else None
+            if k is not None:
+                tail[k] = (tail[k][0], e, label)
+            else:
+                tail.append((s, e, label))
+        del turns[i:]
+        turns.extend(sorted(tail, key=lambda turn: turn[0]))
+
+        print(f"Diarized {end / 3600:.2f}h of {wav.duration / 3600:.2f}h")
+        previous = current
+        if end >= wav.duration:
+            break
+        start += window - overlap
+    return turns
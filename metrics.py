@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108       # Prometheus scrape port for the ingest process
+EXPORT_INTERVAL = 10.0    # Seconds between JSON-lines snapshots
+CONSOLE_INTERVAL = 5.0    # Seconds between repeats of the same console message
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """Yield (suffix, label_key, extra_labels, value) for exposition"""
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(key, extra)} {format_value(value)}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self.values.items()]
+
+class Counter(Metric):
+    """Monotonic total, optionally split by labels"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Mirror a total that is already counted elsewhere"""
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def get(self, **labels):
+        return self.values.get(label_key(labels), 0)
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+class Histogram(Metric):
+    """Bucketed distribution with Prometheus' cumulative `le` semantics"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self.edges = np.array(self.buckets)
+
+    def entry(self, key):
+        # [per-bucket counts (last is +Inf), sum, count]
+        if key not in self.values:
+            self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        return self.values[key]
+
+    def observe(self, value, **labels):
+        with self.lock:
+            counts, total, count = entry = self.entry(label_key(labels))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] = total + value
+            entry[2] = count + 1
+
+    def observe_many(self, values, **labels):
+        """Record an array of observations in one vectorized step"""
+        values = np.asarray(values, dtype=np.float64)
+        if not values.size:
+            return
+        hits = np.bincount(np.searchsorted(self.edges, values, side='left'),
+                           minlength=len(self.buckets) + 1)
+        with self.lock:
+            entry = self.entry(label_key(labels))
+            for i, n in enumerate(hits.tolist()):
+                entry[0][i] += n
+            entry[1] += float(values.sum())
+            entry[2] += int(values.size)
+
+    def cumulative(self, counts):
+        running, result = 0, []
+        for edge, n in zip(self.buckets + (float('inf'),), counts):
+            running += n
+            result.append((edge, running))
+        return result
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        for key, counts, total, count in items:
+            for edge, running in self.cumulative(counts):
+                yield "_bucket", key, (('le', format_value(float(edge))),), running
+            yield "_sum", key, (), total
+            yield "_count", key, (), count
+
+    def snapshot(self):
+        with self.lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        return [{
+            'labels': dict(key),
+            'buckets': {format_value(float(edge)): running for edge, running in self.cumulative(counts)},
+            'sum': total,
+            'count': count
+        } for key, counts, total, count in items]
+
+class Registry:
+    """Named collection of metrics; creating an existing name returns it"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, cls, name, help, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, *args)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help):
+        return self.register(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self.register(Gauge, name, help)
+
+    def histogram(self, name, help, buckets):
+        return self.register(Histogram, name, help, buckets)
+
+    def render_prometheus(self):
+        """Text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {
+            name: {'type': metric.kind, 'samples': metric.snapshot()}
+            for name, metric in list(self.metrics.items())
+        }
+
+REGISTRY = Registry()
+
+def counter(name, help):
+    return REGISTRY.counter(name, help)
+
+def gauge(name, help):
+    return REGISTRY.gauge(name, help)
+
+def histogram(name, help, buckets):
+    return REGISTRY.histogram(name, help, buckets)
+
+class ConsoleSink:
+    """Optional human-readable output; each key prints at most once per interval
+
+    Messages may be callables so the text is only built when it will be
+    shown. Pass force=True for one-off reports such as session summaries.
+    """
+
+    def __init__(self, interval=CONSOLE_INTERVAL, enabled=True, stream=None):
+        self.interval = interval
+        self.enabled = enabled
+        self.stream = stream
+        self.last_emit = {}
+
+    def emit(self, key, message, force=False, end="\n"):
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if not force and now - self.last_emit.get(key, float('-inf')) < self.interval:
+            return False
+        self.last_emit[key] = now
+        print(message() if callable(message) else message, end=end,
+              file=self.stream or sys.stdout, flush=end != "\n")
+        return True
+
+CONSOLE = ConsoleSink()
+
+async def serve_metrics(registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+    """Expose /metrics for Prometheus; returns the aiohttp AppRunner"""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render_prometheus(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+class JsonLinesExporter:
+    """Append a timestamped snapshot of every metric to a file as one JSON line"""
+
+    def __init__(self, path, registry=REGISTRY, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+
+    def write(self):
+        line = json.dumps({'time': time.time(), 'metrics': self.registry.snapshot()})
+        with open(self.path, 'a') as f:
+            f.write(line + "\n")
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.write()
+        finally:
+            # One last snapshot on shutdown so short runs are not lost
+            self.write()
@@ -0,0 +1,286 @@
+import asyncio
+import platform
+import time
+
+import metrics
+
+POLL_INTERVAL = 0.2       # Seconds between readiness checks
+JOIN_TIMEOUT = 20.0       # Seconds to wait for the OS to report the new network
+READY_TIMEOUT = 15.0      # Seconds to wait for the ESP32's HTTP server to answer
+COMMAND_TIMEOUT = 30.0    # Seconds before a network tool is considered hung
+HANDOVER_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30)
+
+HANDOVER_SECONDS = metrics.histogram('wifi_handover_seconds', "Time from handover start until the ESP32 answers",
+                                     HANDOVER_BUCKETS)
+FIRST_BYTE_SECONDS = metrics.histogram('wifi_time_to_first_byte_seconds',
+                                       "Time from handover start until the first byte of the download",
+                                       HANDOVER_BUCKETS)
+HANDOVER_FAILURES = metrics.counter('wifi_handover_failures_total', "Handovers that timed out by stage")
+
+class NetworkError(Exception):
+    """Raised when the network backend cannot complete an operation"""
+
+async def run_command(*args, timeout=COMMAND_TIMEOUT):
+    """Run a command without blocking the event loop, return (code, stdout, stderr)"""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise NetworkError(f"{args[0]} timed out after {timeout:.0f}s")
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+async def check_command(*args, timeout=COMMAND_TIMEOUT):
+    """Run a command and raise NetworkError if it fails"""
+    code, stdout, stderr = await run_command(*args, timeout=timeout)
+    if code != 0:
+        raise NetworkError(f"{' '.join(args[:3])} failed: {(stderr or stdout).strip()}")
+    return stdout
+
+class NetworkBackend:
+    """Interface for switching the host between WiFi networks"""
+
+    async def current_network(self):
+        """Return the SSID the host is associated with, or None"""
+        raise NotImplementedError
+
+    async def connect(self, ssid, password):
+        """Ask the OS to join `ssid`; returns once the request is issued"""
+        raise NotImplementedError
+
+    async def restore(self, ssid):
+        """Rejoin a previously used network"""
+        await self.connect(ssid, None)
+
+    async def reset(self):
+        """Recover a wedged interface before retrying; optional"""
+
+class NetworksetupBackend(NetworkBackend):
+    """macOS backend built on networksetup"""
+
+    def __init__(self, interface='en0'):
+        self.interface = interface
+
+    async def current_network(self):
+        code, stdout, _ = await run_command('networksetup', '-getairportnetwork', self.interface)
+        if code != 0 or ': ' not in stdout:
+            return None
+        return stdout.strip().split(': ')[-1]
+
+    async def connect(self, ssid, password):
+        args = ['networksetup', '-setairportnetwork', self.interface, ssid]
+        if password:
+            args.append(password)
+        await check_command(*args)
+
+    async def reset(self):
+        # Cycling power makes the interface rescan for the ESP32's AP
+        await check_command('networksetup', '-setairportpower', self.interface, 'off')
+        await check_command('networksetup', '-setairportpower', self.interface, 'on')
+
+class NmcliBackend(NetworkBackend):
+    """Linux backend built on NetworkManager's nmcli
+
+    Profiles are often not named after their SSID ("Wired connection 1",
+    "MyWifi 1" after a re-join), so the profile active before a join is
+    remembered by UUID and brought back up by it.
+    """
+
+    def __init__(self):
+        self.profiles = {}  # SSID -> UUID of the profile that was active on it
+
+    async def active_wifi_profile(self):
+        """UUID of the active WiFi connection profile, or None"""
+        code, stdout, _ = await run_command('nmcli', '-t', '-f', 'UUID,TYPE', 'connection', 'show', '--active')
+        if code != 0:
+            return None
+        for line in stdout.splitlines():
+            uuid, _, kind = line.partition(':')
+            if kind == '802-11-wireless':
+                return uuid
+        return None
+
+    async def current_network(self):
+        code, stdout, _ = await run_command('nmcli', '-t', '-f', 'ACTIVE,SSID', 'device', 'wifi')
+        if code != 0:
+            return None
+        for line in stdout.splitlines():
+            active, _, ssid = line.partition(':')
+            if active == 'yes':
+                return ssid
+        return None
+
+    async def connect(self, ssid, password):
+        current = await self.current_network()
+        if current and current != ssid:
+            uuid = await self.active_wifi_profile()
+            if uuid:
+                self.profiles[current] = uuid
+        args = ['nmcli', 'device', 'wifi', 'connect', ssid]
+        if password:
+            args += ['password', password]
+        await check_command(*args)
+
+    async def restore(self, ssid):
+        # Saved profiles carry their own credentials
+        uuid = self.profiles.pop(ssid, None)
+        if uuid:
+            await check_command('nmcli', 'connection', 'up', 'uuid', uuid)
+        else:
+            await check_command('nmcli', 'connection', 'up', 'id', ssid)
+
+    async def reset(self):
+        await check_command('nmcli', 'device', 'wifi', 'rescan')
+
+class ManualBackend(NetworkBackend):
+    """Fallback for platforms without a supported tool: ask the user"""
+
+    def __init__(self):
+        self.network = None
+
+    async def current_network(self):
+        return self.network
+
+    async def connect(self, ssid, password):
+        print(f"Please connect manually to {ssid}" + (f" with password {password}" if password else ""))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, input, "Press Enter when connected...")
+        self.network = ssid
+
+class FakeBackend(NetworkBackend):
+    """In-process backend for tests: joins after a configurable delay"""
+
+    def __init__(self, network="HomeWiFi", join_delay=0.0, fail_connects=0):
+        self.network = network
+        self.join_delay = join_delay
+        self.fail_connects = fail_connects
+        self.calls = []
+
+    async def current_network(self):
+        return self.network
+
+    async def connect(self, ssid, password):
+        self.calls.append(('connect', ssid))
+        if self.fail_connects > 0:
+            self.fail_connects -= 1
+            raise NetworkError(f"Could not join {ssid}")
+        self.network = None
+        asyncio.get_running_loop().call_later(self.join_delay, setattr, self, 'network', ssid)
+
+    async def reset(self):
+        self.calls.append(('reset',))
+
+def default_backend():
+    """Pick the network backend for this platform"""
+    system = platform.system()
+    if system == "Darwin":
+        return NetworksetupBackend()
+    if system == "Linux":
+        return NmcliBackend()
+    return ManualBackend()
+
+async def wait_until(check, timeout, interval=POLL_INTERVAL):
+    """Poll an async predicate until it is true or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if await check():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(interval)
+
+async def port_open(host, port, timeout=1.0):
+    """Check whether a TCP connection to host:port succeeds"""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+async def http_ok(url, timeout=2.0):
+    """Check whether a GET on url returns 200"""
+    import aiohttp
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+            async with session.get(url) as response:
+                return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+class WiFiHandover:
+    """Move the host onto the ESP32's AP and back without blocking the event loop
+
+    Every step polls for readiness instead of sleeping for a fixed time, so
+    the handover finishes as soon as the AP is joined and the HTTP server
+    answers.
+    """
+
+    def __init__(self, ssid, password, host, port=80, backend=None,
+                 join_timeout=JOIN_TIMEOUT, ready_timeout=READY_TIMEOUT):
+        self.ssid = ssid
+        self.password = password
+        self.host = host
+        self.port = port
+        self.backend = backend or default_backend()
+        self.join_timeout = join_timeout
+        self.ready_timeout = ready_timeout
+        self.original_network = None
+        self.started_at = None
+        self.handover_time = None
+
+    async def is_joined(self):
+        return await self.backend.current_network() == self.ssid
+
+    async def is_ready(self):
+        return await port_open(self.host, self.port) and await http_ok(f"http://{self.host}:{self.port}/test")
+
+    async def connect(self, reset=False):
+        """Join the ESP32 AP and wait until its HTTP server answers"""
+        self.started_at = time.monotonic()
+        current = await self.backend.current_network()
+        if current != self.ssid:
+            if current:
+                self.original_network = current
+                print(f"Current WiFi network: {current}")
+            if reset:
+                print("Resetting WiFi interface...")
+                await self.backend.reset()
+            print(f"Joining {self.ssid}...")
+            await self.backend.connect(self.ssid, self.password)
+            if not await wait_until(self.is_joined, self.join_timeout):
+                print(f"Timed out waiting to join {self.ssid}")
+                HANDOVER_FAILURES.inc(stage="join")
+                return False
+
+        if not await wait_until(self.is_ready, self.ready_timeout):
+            print(f"Joined {self.ssid} but http://{self.host}:{self.port} is not answering")
+            HANDOVER_FAILURES.inc(stage="ready")
+            return False
+
+        self.handover_time = time.monotonic() - self.started_at
+        HANDOVER_SECONDS.observe(self.handover_time)
+        print(f"ESP32 server ready after {self.handover_time:.2f}s")
+        return True
+
+    def first_byte(self, first_byte_time):
+        """Record when a download's first byte arrived (time.monotonic()); returns the time to first byte"""
+        ttfb = first_byte_time - self.started_at
+        FIRST_BYTE_SECONDS.observe(ttfb)
+        return ttfb
+
+    async def restore(self):
+        """Rejoin the network the host was on before the handover"""
+        if not self.original_network:
+            return
+        try:
+            await self.backend.restore(self.original_network)
+            print(f"Restored original WiFi connection to: {self.original_network}")
+            self.original_network = None
+        except NetworkError as e:
+            print(f"Failed to restore original WiFi: {e}")
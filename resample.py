@@ -0,0 +1,213 @@
+import struct
+
+import numpy as np
+
+from wavsink import StreamingWavWriter, WAV_HEADER_SIZE
+
+HALF_TAPS = 20            # Filter length is 6 * HALF_TAPS + 1 for a 3:1 decimator
+KAISER_BETA = 8.6         # Window shape; about -60 dB at the output Nyquist frequency
+PASSBAND = 0.875          # Cutoff as a fraction of the output Nyquist frequency
+READ_BLOCK = 1 << 20      # Bytes per block when resampling a finished file
+
+def design_lowpass(down, half_taps=HALF_TAPS, beta=KAISER_BETA, passband=PASSBAND):
+    """Kaiser-windowed sinc low-pass for decimating by `down`
+
+    Odd length with (length - 1) divisible by 2 * down, so the group delay
+    is a whole number of output samples.
+    """
+    length = 2 * down * half_taps + 1
+    cutoff = passband / (2 * down)  # Normalized to the input rate
+    n = np.arange(length) - (length - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    return taps / taps.sum()
+
+class PolyphaseDecimator:
+    """Streaming integer-factor decimator built from polyphase branches
+
+    The low-pass filter h is split into `down` phases h_p[j] = h[down*j + p]
+    and the input into matching phases x_p[n] = x[down*n - p], so each
+    output sample costs len(h) / down multiply-adds and no discarded
+    samples are ever computed. Blocks of any size can be fed; output is
+    delay-compensated so sample m lines up with input sample down * m.
+    """
+
+    def __init__(self, down=3, taps=None):
+        self.down = down
+        taps = design_lowpass(down) if taps is None else np.asarray(taps, dtype=np.float64)
+        self.delay = (len(taps) - 1) // 2  # Input samples of group delay
+        # Pad to a whole number of taps per phase
+        padded = np.zeros(-(-len(taps) // down) * down)
+        padded[:len(taps)] = taps
+        self.taps_per_phase = len(padded) // down
+        self.phases = [padded[p::down] for p in range(down)]
+        self.reset()
+
+    def reset(self):
+        span = self.down * self.taps_per_phase
+        # Buffer starts at the earliest input index the next output needs
+        self.buffer = np.zeros(span - 1)
+        self.next_output = 0
+        self.inputs = 0
+        self.skip = self.delay // self.down  # Outputs swallowed to cancel the delay
+        self.emitted = 0
+
+    def process(self, block):
+        """Feed input samples; returns the output samples now available"""
+        block = np.asarray(block, dtype=np.float64)
+        self.inputs += len(block)
+        self.buffer = np.concatenate((self.buffer, block))
+        down, taps = self.down, self.taps_per_phase
+        # Output m needs inputs down*m - (span - 1) .. down*m
+        count = (len(self.buffer) - (down * taps - 1) + down - 1) // down
+        if count <= 0:
+            return np.zeros(0)
+        length = count + taps - 1
+        out = np.zeros(count)
+        for p, h in enumerate(self.phases):
+            # x_p[n] = x[down*n - p], starting from the buffer's base index
+            x = self.buffer[down - 1 - p::down][:length]
+            out += np.convolve(x, h, mode='valid')[:count]
+        self.buffer = self.buffer[down * count:]
+        self.next_output += count
+        if self.skip:
+            dropped = min(self.skip, len(out))
+            out = out[dropped:]
+            self.skip -= dropped
+        self.emitted += len(out)
+        return out
+
+    def flush(self):
+        """Push the filter tail out; total output is ceil(inputs / down)"""
+        target = -(-self.inputs // self.down)
+        inputs = self.inputs
+        out = self.process(np.zeros(self.delay + self.down * self.taps_per_phase))
+        self.inputs = inputs
+        out = out[:max(0, target - (self.emitted - len(out)))]
+        self.emitted = target
+        return out
+
+def to_int16(samples):
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+def parse_wav_header(header):
+    """Read (channels, sample_rate, bits) from a canonical 44-byte header"""
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE' or header[36:40] != b'data':
+        return None
+    audio_format, channels, sample_rate = struct.unpack_from('<HHI', header, 20)
+    bits = struct.unpack_from('<H', header, 34)[0]
+    if audio_format != 1 or bits != 16:
+        return None
+    return channels, sample_rate, bits
+
+class ResamplingWavSink:
+    """Resample a WAV file to target_rate while its bytes are still arriving
+
+    Attach to a ResumableDownloader as its sink. As long as bytes arrive in
+    order from offset zero they are decoded, decimated and written straight
+    to `filename`. If the stream goes out of order (parallel ranges or a
+    resumed download) the sink stops and finish() makes one block-wise pass
+    over the finished file instead.
+    """
+
+    def __init__(self, filename, target_rate=16000):
+        self.filename = filename
+        self.target_rate = target_rate
+        self.writer = None
+        self.reset()
+
+    def discard(self):
+        """Drop a half-written output; the next writer truncates it"""
+        if self.writer and not self.writer.closed:
+            self.writer.file.close()
+        self.writer = None
+
+    def reset(self):
+        """Start over, e.g. when the server restarts the transfer from zero"""
+        self.discard()
+        self.expected = 0
+        self.in_order = True
+        self.header = bytearray()
+        self.carry = b''
+        self.decimator = None
+        self.channels = 1
+
+    def start(self):
+        info = parse_wav_header(bytes(self.header[:WAV_HEADER_SIZE]))
+        if info is None:
+            self.in_order = False
+            return
+        self.channels, rate, _ = info
+        if rate % self.target_rate:
+            self.in_order = False
+            return
+        down = rate // self.target_rate
+        self.decimator = PolyphaseDecimator(down) if down > 1 else None
+        self.writer = StreamingWavWriter(self.filename, self.target_rate)
+
+    def write(self, offset, chunk):
+        if not self.in_order:
+            return
+        if offset == 0 and self.expected:
+            self.reset()
+        if offset != self.expected:
+            self.in_order = False
+            return
+        self.expected += len(chunk)
+        if self.writer is None:
+            self.header.extend(chunk)
+            if len(self.header) < WAV_HEADER_SIZE:
+                return
+            chunk = bytes(self.header[WAV_HEADER_SIZE:])
+            self.start()
+            if not self.in_order:
+                return
+        self.consume(chunk)
+
+    def consume(self, chunk):
+        data = self.carry + chunk
+        frame_bytes = 2 * self.channels
+        usable = len(data) - len(data) % frame_bytes
+        self.carry = data[usable:]
+        if not usable:
+            return
+        samples = np.frombuffer(data[:usable], dtype='<i2')
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        if self.decimator:
+            samples = to_int16(self.decimator.process(samples))
+        self.writer.write(samples.astype('<i2').tobytes())
+
+    def close(self, total_size):
+        """Finish the streamed output; False if it did not see every byte in order"""
+        if not self.in_order or self.expected != total_size or self.writer is None:
+            self.discard()
+            return False
+        if self.decimator:
+            self.writer.write(to_int16(self.decimator.flush()).tobytes())
+        self.writer.close()
+        return True
+
+    def finish(self, source, total_size):
+        """Called by the downloader once `source` is complete and verified
+
+        Falls back to one block-wise pass over `source` when the streamed
+        output could not be completed.
+        """
+        if not self.close(total_size):
+            print(f"Resampling {source} after the download (transfer was not sequential)")
+            self.reset()
+            resample_wav_file(source, self.filename, self.target_rate, self)
+
+def resample_wav_file(source, destination, target_rate=16000, sink=None):
+    """Block-wise resample of a finished WAV file"""
+    sink = sink or ResamplingWavSink(destination, target_rate)
+    offset = 0
+    with open(source, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block:
+                break
+            sink.write(offset, block)
+            offset += len(block)
+    if not sink.close(offset):
+        raise ValueError(f"Cannot resample {source} to {target_rate} Hz")
@@ -0,0 +1,118 @@
+import os
+import re
+
+import numpy as np
+import pytest
+
+import audiocodec
+from audiocodec import AdpcmEncoder, adpcm_decode, mulaw_decode, mulaw_encode
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bluetooth.ino")
+SAMPLES_PER_FRAME = 160
+
+@pytest.fixture(scope='module')
+def firmware():
+    with open(FIRMWARE) as f:
+        return f.read()
+
+def c_array(source, name):
+    body = re.search(rf'{name}\[\d*\]\s*=\s*\{{([^}}]*)\}}', source).group(1)
+    return [int(value, 0) for value in body.replace("\n", " ").split(",") if value.strip()]
+
+def c_define(source, name):
+    return int(re.search(rf'#define {name}\s+(\S+)', source).group(1), 0)
+
+def speech_like(seconds=1.0, rate=16000):
+    """Tones with a rising envelope and noise, spanning quiet to near full scale"""
+    t = np.arange(int(seconds * rate)) / rate
+    signal = np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 1230 * t)
+    signal *= np.linspace(0.01, 1.0, len(t)) * 20000
+    signal += np.random.default_rng(0).normal(0, 200, len(t))
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+def firmware_mulaw_encode(sample, bias, clip):
+    """mulaw_encode() from bluetooth.ino, line for line"""
+    sign = 0
+    if sample < 0:
+        sample, sign = -sample, 0x80
+    sample = min(sample, clip) + bias
+    exponent, mask = 7, 0x4000
+    while exponent > 0 and not sample & mask:
+        exponent -= 1
+        mask >>= 1
+    mantissa = (sample >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+def firmware_adpcm_encode(frames, steps, shifts):
+    """adpcm_encode_frame() from bluetooth.ino, line for line, over consecutive frames"""
+    predictor, index = 0, 0
+    encoded = []
+    for pcm in frames:
+        out = bytearray((predictor & 0xFF, (predictor >> 8) & 0xFF, index, 0)) + bytes(len(pcm) // 2)
+        for i, sample in enumerate(pcm.tolist()):
+            step = steps[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code, diff = 8, -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                delta += step >> 2
+            predictor = max(-32768, min(32767, predictor - delta if code & 8 else predictor + delta))
+            index = max(0, min(88, index + shifts[code & 7]))
+            out[4 + i // 2] |= code << 4 if i & 1 else code
+        encoded.append(bytes(out))
+    return encoded
+
+def test_tables_match_the_firmware(firmware):
+    assert c_array(firmware, 'adpcm_steps') == audiocodec.ADPCM_STEPS.tolist()
+    assert c_array(firmware, 'adpcm_index_shift') * 2 == audiocodec.ADPCM_INDEX_SHIFT.tolist()
+    assert c_define(firmware, 'MULAW_BIAS') == audiocodec.MULAW_BIAS
+    assert c_define(firmware, 'MULAW_CLIP') == audiocodec.MULAW_CLIP
+    assert c_define(firmware, 'ADPCM_HEADER_SIZE') == audiocodec.ADPCM_HEADER_SIZE
+
+def test_mulaw_encoder_matches_the_firmware(firmware):
+    bias, clip = c_define(firmware, 'MULAW_BIAS'), c_define(firmware, 'MULAW_CLIP')
+    every_sample = np.arange(-32768, 32768, dtype=np.int16)
+    expected = [firmware_mulaw_encode(sample, bias, clip) for sample in every_sample.tolist()]
+    assert mulaw_encode(every_sample).tolist() == expected
+
+def test_mulaw_round_trip_is_within_one_quantization_step():
+    pcm = np.arange(-32768, 32768, dtype=np.int32)
+    decoded = mulaw_decode(mulaw_encode(pcm)).astype(np.int32)
+    clipped = np.clip(pcm, -audiocodec.MULAW_CLIP, audiocodec.MULAW_CLIP)
+    # In segment e one mantissa step is 2^(e+3); the error never exceeds it
+    step = 2 ** (np.floor(np.log2(np.abs(clipped) + audiocodec.MULAW_BIAS)).astype(int) - 4)
+    assert (np.abs(decoded - clipped) <= step).all()
+    # Decoding is exact for values the table produces
+    assert np.array_equal(mulaw_decode(mulaw_encode(audiocodec.MULAW_TABLE)), audiocodec.MULAW_TABLE)
+
+def test_adpcm_encoder_matches_the_firmware(firmware):
+    frames = speech_like(0.2).reshape(-1, SAMPLES_PER_FRAME)
+    encoder = AdpcmEncoder()
+    ours = [encoder.encode(frame) for frame in frames]
+    assert ours == firmware_adpcm_encode(frames, c_array(firmware, 'adpcm_steps'),
+                                         c_array(firmware, 'adpcm_index_shift'))
+
+def test_adpcm_round_trip():
+    pcm = speech_like()
+    frames = pcm.reshape(-1, SAMPLES_PER_FRAME)
+    encoder = AdpcmEncoder()
+    payload = np.frombuffer(b''.join(encoder.encode(frame) for frame in frames), dtype=np.uint8)
+    decoded = adpcm_decode(payload.reshape(len(frames), -1), SAMPLES_PER_FRAME).reshape(-1)
+
+    error = decoded.astype(np.float64) - pcm
+    snr = 10 * np.log10(np.sum(pcm.astype(np.float64) ** 2) / np.sum(error ** 2))
+    assert snr > 25  # About 33 dB for this signal
+    # Frames carry their own state, so one decodes the same without its predecessors
+    alone = adpcm_decode(payload.reshape(len(frames), -1)[-1:], SAMPLES_PER_FRAME)
+    assert np.array_equal(alone[0], decoded[-SAMPLES_PER_FRAME:])
@@ -0,0 +1,64 @@
+import pytest
+
+from catalog import Catalog, stamp_time
+
+KITCHEN, OFFICE = "A1B2C3", "D4E5F6"
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    yield catalog
+    catalog.close()
+
+def add_recording(catalog, tmp_path, tag, stamp, turns):
+    """Catalog a BLE session and its transcript; turns are (speaker, text)"""
+    audio = str(tmp_path / f"ble_recording_{stamp}_{tag}.wav")
+    catalog.start_session(tag, stamp, stamp_time(stamp), ble_file=audio)
+    catalog.add_transcript(audio, None, [(10.0 * i, 10.0 * i + 8, speaker) for i, (speaker, _) in enumerate(turns)],
+                           [text for _, text in turns])
+    return audio
+
+@pytest.fixture
+def recordings(catalog, tmp_path):
+    return [
+        add_recording(catalog, tmp_path, KITCHEN, "20260101_090000", [
+            ("SPEAKER_00", "Did anyone order the replacement battery?"),
+            ("SPEAKER_01", "The battery order ships on Monday, battery warranty included."),
+            ("SPEAKER_00", "Great, then the prototype demo stays on schedule."),
+        ]),
+        add_recording(catalog, tmp_path, OFFICE, "20260102_140000", [
+            ("SPEAKER_00", "Budget review for the battery supplier."),
+            ("SPEAKER_01", "Let's move the demo to Thursday."),
+        ]),
+    ]
+
+def texts(results):
+    return [row['text'] for row in results]
+
+def test_search_ranks_the_best_match_first(catalog, recordings):
+    results = catalog.search("battery")
+
+    assert len(results) == 3
+    # Two mentions beat one
+    assert results[0]['text'].startswith("The battery order ships")
+    assert "[battery]" in results[0]['snippet']
+    assert results[0]['audio_file'] == recordings[0]
+    assert results[0]['device_tag'] == KITCHEN
+
+def test_search_supports_phrases_prefixes_and_operators(catalog, recordings):
+    assert texts(catalog.search('"prototype demo"')) == ["Great, then the prototype demo stays on schedule."]
+    assert len(catalog.search("sched*")) == 1
+    assert texts(catalog.search("demo NOT prototype")) == ["Let's move the demo to Thursday."]
+    assert catalog.search("spaceship") == []
+
+def test_search_filters_by_device_speaker_and_time(catalog, recordings):
+    assert {row['device_tag'] for row in catalog.search("battery", device="D4:E5:F6")} == {OFFICE}
+    assert texts(catalog.search("demo", speaker="SPEAKER_01")) == ["Let's move the demo to Thursday."]
+    assert len(catalog.search("battery", since="2026-01-02")) == 1
+    assert len(catalog.search("battery", until="2026-01-02")) == 2
+
+def test_a_new_transcript_replaces_the_indexed_turns(catalog, recordings):
+    catalog.add_transcript(recordings[1], None, [(0.0, 5.0, "SPEAKER_00")], ["Budget review for the charger supplier."])
+
+    assert {row['device_tag'] for row in catalog.search("battery")} == {KITCHEN}
+    assert texts(catalog.search("charger")) == ["Budget review for the charger supplier."]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import socket
+
+import numpy as np
+import pytest
+
+import download as download_module
+from download import CHUNK_SIZE, STATE_SUFFIX, DownloadError, ResumableDownloader
+from fake_esp32 import FakeESP32Server, serve
+
+SIZE = 10 * CHUNK_SIZE + 1234  # Not a whole number of chunks
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(download_module, 'RETRY_DELAY', 0.0)
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / "sdcard.wav"
+    path.write_bytes(np.random.default_rng(0).integers(0, 256, SIZE, dtype=np.uint8).tobytes())
+    return str(path)
+
+@pytest.fixture
+def port():
+    # One port for every server in a test: the URL is part of the resume state
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def run_with_server(server, port, scenario):
+    """Run scenario(url) against `server` on a local port"""
+    async def main():
+        runner = await serve(server, port=port)
+        try:
+            return await scenario(f"http://127.0.0.1:{port}/file")
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+def download(server, port, output, **options):
+    async def scenario(url):
+        downloader = ResumableDownloader(url, output, **options)
+        await downloader.run()
+        return downloader
+    return run_with_server(server, port, scenario)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_download_survives_dropped_connections(recording, port, tmp_path):
+    server = FakeESP32Server(recording, drop_rate=0.3, seed=1)
+    output = str(tmp_path / "out.wav")
+    downloader = download(server, port, output, require_digest=True)
+
+    assert server.drops > 0
+    assert downloader.failures > 0
+    assert read(output) == read(recording)
+    assert not os.path.exists(output + STATE_SUFFIX)
+
+def test_download_resumes_from_the_part_file(recording, port, tmp_path):
+    output = str(tmp_path / "out.wav")
+    with pytest.raises(DownloadError):
+        download(FakeESP32Server(recording, drop_after=3 * CHUNK_SIZE), port, output, max_attempts=1)
+    with open(output + STATE_SUFFIX) as f:
+        assert json.load(f)['ranges'] == [[0, SIZE, 3 * CHUNK_SIZE]]
+
+    server = FakeESP32Server(recording)
+    downloader = download(server, port, output)
+    # After the one-byte probe, only the missing tail is requested
+    assert server.served == [(0, 1), (3 * CHUNK_SIZE, SIZE)]
+    assert downloader.received_size == SIZE - 3 * CHUNK_SIZE
+    assert read(output) == read(recording)
+
+def test_download_restarts_when_the_recording_changed(recording, port, tmp_path):
+    output = str(tmp_path / "out.wav")
+    with pytest.raises(DownloadError):
+        download(FakeESP32Server(recording, drop_after=3 * CHUNK_SIZE), port, output, max_attempts=1)
+
+    # A new recording of the same length behind the same URL
+    with open(recording, 'wb') as f:
+        f.write(bytes(SIZE))
+    os.utime(recording, ns=(0, 0))
+    server = FakeESP32Server(recording)
+    downloader = download(server, port, output)
+    assert server.served == [(0, 1), (0, SIZE)]
+    assert downloader.received_size == SIZE
+    assert read(output) == bytes(SIZE)
+
+def test_digest_mismatch_raises(recording, port, tmp_path):
+    output = str(tmp_path / "out.wav")
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        download(FakeESP32Server(recording, send_digest=False), port, output, sha256="0" * 64)
+    # Corrupt data is not kept for a later resume
+    assert not os.path.exists(output)
+    assert not os.path.exists(output + STATE_SUFFIX)
+
+def test_missing_digest_is_refused_when_required(recording, port, tmp_path):
+    with pytest.raises(DownloadError, match="no SHA-256 digest"):
+        download(FakeESP32Server(recording, send_digest=False), port, str(tmp_path / "out.wav"),
+                 require_digest=True)
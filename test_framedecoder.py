@@ -0,0 +1,66 @@
+import numpy as np
+
+from framedecoder import SAMPLES_PER_FRAME, FrameDecoder
+
+def frame(counter, value):
+    """A PCM notification whose samples all equal `value`"""
+    counter &= 0xFFFF
+    return bytes((counter & 0xFF, counter >> 8, 0)) + np.full(SAMPLES_PER_FRAME, value, dtype='<i2').tobytes()
+
+def decode(decoder, frames):
+    """Push frames through the decoder batch by batch; returns one value per output frame"""
+    pcm = []
+    for data in frames:
+        if decoder.push(data):
+            pcm.append(decoder.flush())
+    pcm.append(decoder.flush())
+    frames = np.concatenate(pcm).reshape(-1, SAMPLES_PER_FRAME)
+    assert (frames == frames[:, :1]).all()
+    return frames[:, 0].tolist()
+
+def test_sequence_wraps_at_65535():
+    decoder = FrameDecoder(batch_frames=4)
+    # 65530..65535 then 0..5, split over batches so the wrap crosses a flush
+    values = decode(decoder, [frame(65530 + i, i) for i in range(12)])
+
+    assert values == list(range(12))
+    assert decoder.stats['drops'] == 0
+    assert decoder.stats['resyncs'] == 0
+    assert decoder.gaps == []
+
+def test_lost_frames_are_filled_with_silence():
+    decoder = FrameDecoder(batch_frames=4)
+    values = decode(decoder, [frame(seq, value) for value, seq in enumerate((65533, 65534, 65535, 2, 3), 1)])
+
+    # 0 and 1 were lost across the wrap: one frame of silence each
+    assert values == [1, 2, 3, 0, 0, 4, 5]
+    assert decoder.stats['drops'] == 2
+    assert decoder.gaps == [[3, 5]]
+
+def test_lost_frames_can_be_interpolated():
+    decoder = FrameDecoder(fill='interpolate')
+    decoder.push(frame(0, 100))
+    decoder.push(frame(3, 400))
+    pcm = decoder.flush()
+
+    gap = pcm[SAMPLES_PER_FRAME:3 * SAMPLES_PER_FRAME]
+    assert decoder.stats['drops'] == 2
+    assert 100 <= gap.min() and gap.max() <= 400
+    assert (np.diff(gap) >= 0).all() and gap[-1] > gap[0]
+
+def test_out_of_order_frames_are_put_back_in_sequence():
+    decoder = FrameDecoder()
+    values = decode(decoder, [frame(seq, seq) for seq in (10, 12, 11, 13, 13)])
+
+    assert values == [10, 11, 12, 13]
+    assert decoder.stats['out_of_order'] == 1
+    assert decoder.stats['duplicates'] == 1
+    assert decoder.stats['drops'] == 0
+
+def test_a_huge_jump_resyncs_instead_of_filling():
+    decoder = FrameDecoder()
+    values = decode(decoder, [frame(seq, 1) for seq in (0, 1, 30000, 30001)])
+
+    assert values == [1, 1, 1, 1]
+    assert decoder.stats['resyncs'] == 1
+    assert decoder.stats['drops'] == 0
@@ -0,0 +1,51 @@
+import numpy as np
+
+from framedecoder import SAMPLES_PER_FRAME, FrameDecoder
+from jitterbuffer import JitterBuffer
+from test_framedecoder import frame
+
+def feed(jitter, frames):
+    """Push frames, flushing whenever the buffer says a release is due; returns one value per frame"""
+    pcm = []
+    for data in frames:
+        if jitter.decoder.push(data) or jitter.due:
+            pcm.append(jitter.flush())
+    return values(pcm)
+
+def values(pcm):
+    frames = np.concatenate(pcm).reshape(-1, SAMPLES_PER_FRAME) if pcm else np.zeros((0, SAMPLES_PER_FRAME))
+    return frames[:, 0].tolist()
+
+def test_frames_are_reordered_within_the_window():
+    jitter = JitterBuffer(FrameDecoder(), latency_frames=4, release_frames=1)
+    order = [0, 1, 3, 2, 4, 7, 5, 6, 8, 9, 10]
+    released = feed(jitter, [frame(seq, seq) for seq in order])
+    released += values([jitter.drain()])
+
+    assert released == list(range(11))
+    assert jitter.decoder.stats['drops'] == 0
+    assert jitter.stats['reordered'] == 3
+    assert jitter.stats['max_reorder_depth'] == 2
+
+def test_a_frame_behind_the_window_is_dropped_as_late():
+    jitter = JitterBuffer(FrameDecoder(), latency_frames=2, release_frames=1)
+    # Frame 2 is missing until long after its slot was released
+    released = feed(jitter, [frame(seq, seq + 1) for seq in (0, 1, 3, 4, 5, 6, 2, 7)])
+    released += values([jitter.drain()])
+
+    assert released == [1, 2, 0, 4, 5, 6, 7, 8]
+    assert jitter.decoder.stats['drops'] == 1
+    assert jitter.decoder.stats['late'] == 1
+
+def test_release_is_due_every_release_frames():
+    jitter = JitterBuffer(FrameDecoder(), latency_frames=20, release_frames=5)
+    released = []
+    for seq in range(25):
+        jitter.decoder.push(frame(seq, seq))
+        assert jitter.due == ((seq + 1) % 5 == 0)
+        if jitter.due:
+            released.append(len(values([jitter.flush()])))
+
+    # Nothing leaves until frames are 20 behind the newest, then 5 at a time
+    assert released == [0, 0, 0, 0, 5]
+    assert len(values([jitter.drain()])) == 20
@@ -0,0 +1,92 @@
+import asyncio
+import wave
+
+import pytest
+
+import netcontrol
+from fake_esp32 import FakeESP32Server, serve
+from netcontrol import FakeBackend, WiFiHandover
+
+SSID = "ESP32_Audio"
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / "sdcard.wav"
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(bytes(3200))
+    return str(path)
+
+def run_with_server(recording, scenario):
+    """Run scenario(port) with a fake ESP32 answering on a free local port"""
+    async def main():
+        runner = await serve(FakeESP32Server(recording), port=0)
+        try:
+            return await scenario(runner.addresses[0][1])
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+def test_connect_waits_for_join_and_server(recording):
+    backend = FakeBackend(join_delay=0.3)
+
+    async def scenario(port):
+        handover = WiFiHandover(SSID, "secret", "127.0.0.1", port, backend=backend)
+        assert await handover.connect()
+        return handover
+
+    handover = run_with_server(recording, scenario)
+    assert backend.network == SSID
+    assert backend.calls == [('connect', SSID)]
+    assert handover.original_network == "HomeWiFi"
+    assert 0.3 <= handover.handover_time < 0.3 + 3 * netcontrol.POLL_INTERVAL
+
+def test_connect_skips_join_when_already_on_the_ap(recording):
+    backend = FakeBackend(network=SSID)
+
+    async def scenario(port):
+        return await WiFiHandover(SSID, "secret", "127.0.0.1", port, backend=backend).connect()
+
+    assert run_with_server(recording, scenario)
+    assert backend.calls == []
+
+def test_connect_times_out_when_the_ap_never_joins(recording):
+    backend = FakeBackend(join_delay=5.0)
+    failures = netcontrol.HANDOVER_FAILURES.get(stage="join")
+
+    async def scenario(port):
+        handover = WiFiHandover(SSID, "secret", "127.0.0.1", port, backend=backend, join_timeout=0.5)
+        return await handover.connect(reset=True)
+
+    assert not run_with_server(recording, scenario)
+    assert backend.calls == [('reset',), ('connect', SSID)]
+    assert netcontrol.HANDOVER_FAILURES.get(stage="join") == failures + 1
+
+def test_connect_times_out_when_the_server_never_answers():
+    backend = FakeBackend()
+    failures = netcontrol.HANDOVER_FAILURES.get(stage="ready")
+
+    async def scenario():
+        # Nothing listens on the discard port
+        handover = WiFiHandover(SSID, "secret", "127.0.0.1", 9, backend=backend, ready_timeout=0.5)
+        return await handover.connect()
+
+    assert not asyncio.run(scenario())
+    assert backend.network == SSID
+    assert netcontrol.HANDOVER_FAILURES.get(stage="ready") == failures + 1
+
+def test_restore_rejoins_the_original_network_once(recording):
+    backend = FakeBackend()
+
+    async def scenario(port):
+        handover = WiFiHandover(SSID, "secret", "127.0.0.1", port, backend=backend)
+        assert await handover.connect()
+        await handover.restore()
+        await asyncio.sleep(0)  # FakeBackend joins on the next loop turn
+        await handover.restore()  # Nothing left to restore
+
+    run_with_server(recording, scenario)
+    assert backend.calls == [('connect', SSID), ('connect', "HomeWiFi")]
+    assert backend.network == "HomeWiFi"
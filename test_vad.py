@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from vad import PADDING, gate_turns, speech_regions
+
+RATE = 16000
+
+def voiced(seconds):
+    """A harmonic tone at about -23 dBFS, peaky and inside the speech band"""
+    t = np.arange(int(seconds * RATE)) / RATE
+    return 0.1 * sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((440, 880, 1320), 1))
+
+def noise(seconds, level, seed=0):
+    return np.random.default_rng(seed).normal(0, level, int(seconds * RATE))
+
+def audio(*parts):
+    return np.concatenate(parts).astype(np.float32)
+
+def test_speech_regions_find_voice_and_ignore_noise():
+    regions = speech_regions(audio(noise(1.0, 1e-4), voiced(1.5), noise(1.0, 1e-4),
+                                   noise(1.0, 0.1, seed=1), noise(0.5, 1e-4)))
+
+    assert regions == [(pytest.approx(1.0 - PADDING), pytest.approx(2.5 + PADDING))]
+
+def test_speech_regions_drop_short_bursts():
+    assert speech_regions(audio(noise(0.5, 1e-4), voiced(0.1), noise(1.0, 1e-4))) == []
+
+def test_gate_turns_trims_turns_to_their_speech():
+    turns = [(0.0, 5.0, "SPEAKER_00"), (5.0, 9.0, "SPEAKER_01")]
+    regions = [(1.0, 2.0), (2.5, 4.0), (6.0, 7.5)]
+
+    assert gate_turns(turns, regions) == [(1.0, 4.0, "SPEAKER_00"), (6.0, 7.5, "SPEAKER_01")]
+
+def test_gate_turns_clips_speech_to_the_turn():
+    assert gate_turns([(1.5, 3.0, "A")], [(1.0, 2.0), (2.5, 4.0)]) == [(1.5, 3.0, "A")]
+
+def test_gate_turns_drops_turns_with_too_little_speech():
+    turns = [(0.0, 5.0, "A"), (5.0, 10.0, "B"), (10.0, 12.0, "C")]
+    regions = [(1.0, 1.2), (6.0, 7.0)]
+
+    assert gate_turns(turns, regions, min_turn_speech=0.3) == [(6.0, 7.0, "B")]
+    assert gate_turns(turns, []) == []
+
+def test_gate_turns_splits_at_long_pauses():
+    regions = [(0.0, 1.0), (2.5, 3.0), (6.0, 7.0)]
+
+    # 1.5 s of silence is bridged, 3 s splits the turn
+    assert gate_turns([(0.0, 8.0, "A")], regions, max_pause=2.0) == [(0.0, 3.0, "A"), (6.0, 7.0, "A")]
@@ -0,0 +1,47 @@
+import wave
+
+import numpy as np
+import pytest
+
+from wavsink import WAV_HEADER_SIZE, StreamingWavWriter, needs_recovery, recover_wav
+
+def crashed_recording(path, pcm, sample_rate=16000, channels=1, tail=b''):
+    """Leave a file the way a crash mid-session does: zero sizes in the header"""
+    writer = StreamingWavWriter(str(path), sample_rate, channels=channels, block_size=1024)
+    writer.write(pcm.tobytes())
+    writer.flush()
+    writer.file.write(tail)  # A sample frame cut short by the crash
+    writer.file.close()
+    return str(path)
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        return f.getnchannels(), f.getframerate(), np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+
+def test_recover_wav_restores_the_header_sizes(tmp_path):
+    pcm = np.arange(-5000, 5000, dtype=np.int16)
+    path = crashed_recording(tmp_path / "crash.wav", pcm)
+    assert needs_recovery(path)
+
+    assert recover_wav(path) == pcm.nbytes
+    assert not needs_recovery(path)
+    channels, rate, samples = read_wav(path)
+    assert (channels, rate) == (1, 16000)
+    assert np.array_equal(samples, pcm)
+
+def test_recover_wav_drops_a_partial_sample_frame(tmp_path):
+    stereo = np.arange(3000, dtype=np.int16)
+    path = crashed_recording(tmp_path / "crash.wav", stereo, sample_rate=8000, channels=2, tail=b'\x01\x02\x03')
+
+    assert recover_wav(path) == stereo.nbytes
+    assert (tmp_path / "crash.wav").stat().st_size == WAV_HEADER_SIZE + stereo.nbytes
+    channels, rate, samples = read_wav(path)
+    assert (channels, rate) == (2, 8000)
+    assert np.array_equal(samples, stereo)
+
+def test_recover_wav_rejects_a_truncated_header(tmp_path):
+    path = crashed_recording(tmp_path / "crash.wav", np.zeros(100, dtype=np.int16))
+    with open(path, 'r+b') as f:
+        f.truncate(WAV_HEADER_SIZE - 4)
+    with pytest.raises(ValueError):
+        recover_wav(path)
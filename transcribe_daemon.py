@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from catalog import CATALOG_FILE, Catalog
+from live_transcribe import TRANSCRIPTION_RTF
+from turncache import CACHE_FILE, MAX_CACHE_BYTES, TranscriptCache
+from wavsink import needs_recovery
+
+WATCH_DIR = "."
+# Archives (archive.py) keep their WAV's mtime, so a transcribed recording stays transcribed
+WATCH_PATTERNS = ("ble_recording_*.wav", "sdcard_recording_*.wav",
+                  "ble_recording_*.flac", "sdcard_recording_*.flac",
+                  "ble_recording_*.opus", "sdcard_recording_*.opus")
+SOCKET_NAME = "transcribe.sock"
+POLL_INTERVAL = 2.0       # Seconds between directory scans
+CONCURRENCY = 1           # Jobs running at once; each slot keeps its own models
+MAX_QUEUED = 32           # Queue depth before submissions are refused
+PRIORITY_SDCARD = 10      # Lower runs first; SD files are complete and full quality
+PRIORITY_BLE = 20
+PRIORITY_DEFAULT = 15
+MODELS_PER_SLOT = 2       # Whisper models a slot keeps loaded for per-job model choices
+
+JOBS = metrics.counter('transcription_jobs_total', "Finished daemon jobs by result")
+QUEUE_DEPTH = metrics.gauge('transcription_queue_depth', "Jobs waiting for a slot")
+
+def transcript_path(audio_path):
+    """Where the daemon writes the transcript for a recording"""
+    return os.path.splitext(audio_path)[0] + ".transcript.txt"
+
+def default_priority(path):
+    name = os.path.basename(path)
+    if name.startswith("sdcard_recording_"):
+        return PRIORITY_SDCARD
+    if name.startswith("ble_recording_"):
+        return PRIORITY_BLE
+    return PRIORITY_DEFAULT
+
+class Job:
+    def __init__(self, job_id, path, priority, model=None, precision=None):
+        self.id = job_id
+        self.path = path
+        self.priority = priority
+        self.model = model            # None runs the daemon's default model and precision
+        self.precision = precision
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.summary = None
+
+    def __lt__(self, other):
+        return (self.priority, self.id) < (other.priority, other.id)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'path': self.path,
+            'priority': self.priority,
+            'model': self.model,
+            'precision': self.precision,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+            'summary': self.summary
+        }
+
+class ModelSlot:
+    """One job slot: a thread that keeps its own pipeline and Whisper models warm
+
+    The default model is loaded up front; jobs asking for another size or
+    precision load it on first use, and the slot keeps the MODELS_PER_SLOT
+    most recently used ones.
+    """
+
+    def __init__(self, model_name, precision="float32", threads=None):
+        self.model_name = model_name
+        self.precision = precision
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pipeline = None
+        self.models = OrderedDict()
+
+    def load(self):
+        # Heavy imports stay out of the submit/status client path
+        import diarize
+        start = time.time()
+        self.pipeline = diarize.load_pipeline()
+        self.model_for(self.model_name, self.precision)
+        print(f"Models loaded in {time.time() - start:.1f}s")
+
+    def model_for(self, model_name, precision):
+        import diarize
+        key = (model_name, precision)
+        if key in self.models:
+            self.models.move_to_end(key)
+        else:
+            start = time.time()
+            self.models[key] = diarize.load_model(model_name, precision)
+            print(f"Loaded Whisper {model_name} ({precision}) in {time.time() - start:.1f}s")
+            while len(self.models) > MODELS_PER_SLOT:
+                self.models.popitem(last=False)
+        return self.models[key]
+
+    def run(self, path, catalog=None, cache=None, vad=True, model_name=None, precision=None):
+        import diarize
+        model_name = model_name or self.model_name
+        precision = precision or self.precision
+        return diarize.process_file(path, transcript_path(path), self.pipeline,
+                                    self.model_for(model_name, precision), catalog=catalog, cache=cache,
+                                    model_name=model_name, vad=vad, precision=precision,
+                                    threads=self.threads)
+
+class TranscriptionDaemon:
+    """Long-lived diarization + transcription service with a priority job queue
+
+    Watches a directory for finished recordings from bluetooth.py and also
+    accepts jobs over a local Unix socket (JSON lines). Jobs run in
+    CONCURRENCY slots, each holding preloaded models. When MAX_QUEUED jobs
+    are waiting, new submissions are refused and the watcher holds back
+    until there is room. Finished transcripts are indexed in the watched
+    directory's catalog (the same one bluetooth.py records sessions in).
+    Diarization and turn texts go into a shared transcript cache, so a
+    re-submitted or longer copy of a recording only costs its new audio.
+    """
+
+    def __init__(self, watch_dir=WATCH_DIR, concurrency=CONCURRENCY, max_queued=MAX_QUEUED,
+                 model_name="base", catalog_file=CATALOG_FILE, cache_file=CACHE_FILE,
+                 cache_bytes=MAX_CACHE_BYTES, vad=True, precision="float32", threads=None):
+        self.watch_dir = watch_dir
+        self.vad = vad
+        self.catalog = Catalog(os.path.join(watch_dir, catalog_file)) if catalog_file else None
+        self.cache = TranscriptCache(os.path.join(watch_dir, cache_file), cache_bytes) if cache_file else None
+        self.socket_path = os.path.join(watch_dir, SOCKET_NAME)
+        self.queue = asyncio.PriorityQueue(maxsize=max_queued)
+        # Slots share the process, so by default they split the cores between them
+        threads = threads or max(1, (os.cpu_count() or 1) // concurrency)
+        self.slots = [ModelSlot(model_name, precision, threads) for _ in range(concurrency)]
+        self.job_ids = itertools.count(1)
+        self.jobs = {}
+        self.known_paths = set()
+        self.sizes = {}
+
+    def submit(self, path, priority=None, model=None, precision=None):
+        """Queue a recording; returns the Job or raises asyncio.QueueFull
+
+        model and precision override the daemon's Whisper model for this job.
+        """
+        path = os.path.abspath(path)
+        if priority is None:
+            priority = default_priority(path)
+        job = Job(next(self.job_ids), path, priority, model, precision)
+        self.queue.put_nowait(job)
+        QUEUE_DEPTH.set(self.queue.qsize())
+        self.jobs[job.id] = job
+        self.known_paths.add(path)
+        print(f"Queued job {job.id}: {path} (priority {priority})")
+        return job
+
+    def is_finished_recording(self, path):
+        """A recording is ready once its header is patched and its size is stable"""
+        try:
+            size = os.path.getsize(path)
+            if needs_recovery(path):
+                return False
+        except OSError:
+            return False
+        stable = self.sizes.get(path) == size
+        self.sizes[path] = size
+        return stable
+
+    def scan(self):
+        """Queue new recordings in the watched directory"""
+        for name in sorted(os.listdir(self.watch_dir)):
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in WATCH_PATTERNS):
+                continue
+            path = os.path.abspath(os.path.join(self.watch_dir, name))
+            # An archive of a WAV already queued is the same recording
+            if path in self.known_paths or os.path.splitext(path)[0] + ".wav" in self.known_paths:
+                continue
+            transcript = transcript_path(path)
+            if os.path.exists(transcript) and os.path.getmtime(transcript) >= os.path.getmtime(path):
+                self.known_paths.add(path)
+                continue
+            if not self.is_finished_recording(path):
+                continue
+            if self.queue.full():
+                # Backpressure: leave it for a later scan
+                return
+            self.submit(path)
+
+    async def watch(self):
+        while True:
+            self.scan()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def run_slot(self, slot):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(slot.executor, slot.load)
+        while True:
+            job = await self.queue.get()
+            QUEUE_DEPTH.set(self.queue.qsize())
+            job.state = "running"
+            job.started = time.time()
+            print(f"Starting job {job.id}: {job.path}")
+            try:
+                job.summary = await loop.run_in_executor(slot.executor, slot.run, job.path, self.catalog,
+                                                         self.cache, self.vad, job.model, job.precision)
+                job.state = "done"
+                JOBS.inc(result="done")
+                if job.summary['audio_seconds']:
+                    TRANSCRIPTION_RTF.observe((time.time() - job.started) / job.summary['audio_seconds'],
+                                              mode="batch")
+                print(f"Finished job {job.id} in {time.time() - job.started:.1f}s: "
+                      f"{job.summary['transcript']}")
+            except Exception as e:
+                job.state = "failed"
+                JOBS.inc(result="failed")
+                job.error = str(e)
+                print(f"Job {job.id} failed: {e}")
+            finally:
+                job.finished = time.time()
+                self.queue.task_done()
+
+    def status(self, job_id=None):
+        if job_id is not None:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else {'error': f"No job {job_id}"}
+        states = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {
+            'queued': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'concurrency': len(self.slots),
+            'states': states,
+            'jobs': [job.to_dict() for job in self.jobs.values() if job.state in ("queued", "running")]
+        }
+
+    def handle_request(self, request):
+        command = request.get('cmd')
+        if command == 'submit':
+            try:
+                job = self.submit(request['path'], request.get('priority'), request.get('model'),
+                                  request.get('precision'))
+            except asyncio.QueueFull:
+                return {'error': "Queue full, try again later"}
+            return job.to_dict()
+        if command == 'status':
+            return self.status(request.get('job'))
+        return {'error': f"Unknown command {command!r}"}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.handle_request(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    response = {'error': f"Bad request: {e}"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, metrics_port=None):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+        print(f"Watching {os.path.abspath(self.watch_dir)}; control socket {self.socket_path}")
+        runner = None
+        if metrics_port:
+            runner = await metrics.serve_metrics(port=metrics_port)
+            print(f"Metrics at http://{metrics.METRICS_HOST}:{metrics_port}/metrics")
+        tasks = [asyncio.create_task(self.run_slot(slot)) for slot in self.slots]
+        tasks.append(asyncio.create_task(self.watch()))
+        try:
+            async with server:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if runner:
+                await runner.cleanup()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+async def send_request(socket_path, request):
+    """Send one JSON request to a running daemon and return its reply"""
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write((json.dumps(request) + "\n").encode())
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm diarization/transcription daemon")
+    parser.add_argument('--dir', default=WATCH_DIR, help="Directory with recordings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="Run the daemon")
+    serve.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    serve.add_argument('--max-queued', type=int, default=MAX_QUEUED)
+    serve.add_argument('--model', default="base")
+    serve.add_argument('--precision', default="float32",
+                       help="Whisper inference precision: float32, or int8 for quantized CPU inference")
+    serve.add_argument('--threads', type=int,
+                       help="Torch threads per slot (default: the cores split between slots)")
+    serve.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on this port")
+    serve.add_argument('--no-catalog', action='store_true', help="Do not index transcripts")
+    serve.add_argument('--no-cache', action='store_true', help="Do not reuse earlier results")
+    serve.add_argument('--cache-mb', type=float, default=MAX_CACHE_BYTES / 2**20,
+                       help="Transcript cache size before least recently used entries are evicted")
+    serve.add_argument('--no-vad', action='store_true', help="Transcribe diarized turns without speech gating")
+    submit = commands.add_parser('submit', help="Queue a recording")
+    submit.add_argument('path')
+    submit.add_argument('--priority', type=int)
+    submit.add_argument('--model', help="Whisper model size for this job")
+    submit.add_argument('--precision', help="float32 or int8 for this job")
+    status = commands.add_parser('status', help="Show queue or job status")
+    status.add_argument('job', type=int, nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        async def serve():
+            # Build the daemon inside the loop so its queue binds to it
+            daemon = TranscriptionDaemon(args.dir, args.concurrency, args.max_queued, args.model,
+                                         None if args.no_catalog else CATALOG_FILE,
+                                         None if args.no_cache else CACHE_FILE,
+                                         int(args.cache_mb * 2**20), not args.no_vad, args.precision,
+                                         args.threads)
+            await daemon.serve(args.metrics_port)
+        asyncio.run(serve())
+        return
+
+    socket_path = os.path.join(args.dir, SOCKET_NAME)
+    if args.command == 'submit':
+        request = {'cmd': 'submit', 'path': os.path.abspath(args.path), 'priority': args.priority,
+                   'model': args.model, 'precision': args.precision}
+    else:
+        request = {'cmd': 'status', 'job': args.job}
+    print(json.dumps(asyncio.run(send_request(socket_path, request)), indent=2))
+
+if __name__ == "__main__":
+    main()
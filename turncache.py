@@ -0,0 +1,157 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+CACHE_FILE = "transcript_cache.db"
+MAX_CACHE_BYTES = 256 * 2**20   # Stored keys and values before least recently used entries go
+EVICT_TO = 0.9                  # Evict down to this fraction of the limit so puts don't evict one by one
+KEY_VERSION = 1                 # Bump when the meaning of a cached value changes
+
+LOOKUPS = metrics.counter('transcript_cache_lookups_total', "Transcript cache lookups by kind and result")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,                 -- 'turn', 'diarization' or 'window'
+    value TEXT NOT NULL,                -- JSON
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+def audio_key(kind, audio, **params):
+    """Content address of a result: a hash of the samples plus whatever produced it
+
+    The position of the audio in its recording is not part of the key, so a
+    turn that moved (a recording that grew at the front) or a copy of the
+    same audio in another file still hits.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([KEY_VERSION, kind, params], sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+    return digest.hexdigest()
+
+class TranscriptCache:
+    """Persistent, size-bounded cache of diarization and transcription results
+
+    Values are JSON and keyed by audio_key(), so anything computed from the
+    same samples with the same model and settings is served from disk.
+    Every read refreshes an entry's last use; when the stored size passes
+    max_bytes the least recently used entries are dropped. Like the
+    catalog, one connection is shared by all threads behind a lock.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            self.size = self.db.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get(self, kind, key):
+        return self.get_many(kind, [key]).get(key)
+
+    def get_many(self, kind, keys):
+        """{key: value} for the keys that are cached, marking them used"""
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self.lock, self.db:
+            # Stay under SQLite's bound parameter limit
+            for offset in range(0, len(keys), 500):
+                chunk = keys[offset:offset + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, value in self.db.execute(
+                        f"SELECT key, value FROM entries WHERE key IN ({marks})", chunk):
+                    found[key] = json.loads(value)
+                self.db.execute(f"UPDATE entries SET last_used = ? WHERE key IN ({marks})",
+                                [time.time(), *chunk])
+        LOOKUPS.inc(len(found), kind=kind, result="hit")
+        LOOKUPS.inc(len(keys) - len(found), kind=kind, result="miss")
+        return found
+
+    def put(self, kind, key, value):
+        self.put_many(kind, {key: value})
+
+    def put_many(self, kind, items):
+        """Store {key: value}, then evict if the cache grew past its limit"""
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            text = json.dumps(value)
+            rows.append((key, kind, text, len(key) + len(text.encode()), now, now))
+        with self.lock, self.db:
+            for row in rows:
+                previous = self.db.execute("SELECT size FROM entries WHERE key = ?", row[:1]).fetchone()
+                self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", row)
+                self.size += row[3] - (previous[0] if previous else 0)
+            if self.size > self.max_bytes:
+                self.evict(int(self.max_bytes * EVICT_TO))
+
+    def evict(self, target):
+        """Drop least recently used entries until at most target bytes remain; lock held"""
+        # Another process may have added or evicted entries since we last looked
+        self.size = self.db.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+        cursor = self.db.execute("SELECT key, size FROM entries ORDER BY last_used")
+        victims = []
+        for key, size in cursor:
+            if self.size <= target:
+                break
+            victims.append((key,))
+            self.size -= size
+        cursor.close()
+        self.db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        return len(victims)
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM entries")
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            rows = self.db.execute("SELECT kind, count(*), sum(size) FROM entries GROUP BY kind").fetchall()
+        return {
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'entries': {kind: {'count': count, 'bytes': size} for kind, count, size in rows}
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the transcript cache")
+    parser.add_argument('--cache', default=CACHE_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="Show entries and size by kind")
+    commands.add_parser('clear', help="Remove every entry")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cache):
+        parser.error(f"No cache at {args.cache}")
+    cache = TranscriptCache(args.cache)
+    if args.command == 'clear':
+        cache.clear()
+        cache.db.execute("VACUUM")
+        print(f"Cleared {args.cache}")
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME = 0.02              # Seconds per analysis frame
+MIN_DBFS = -50.0          # Frames quieter than this are never speech
+MARGIN_DB = 6.0           # Speech must be this far above the tracked noise floor
+FLOOR_RISE_DB = 3.0       # dB per second the noise floor may rise; it falls at once
+SPEECH_BAND = (300.0, 3400.0)   # Hz holding most voiced speech energy
+MIN_BAND_RATIO = 0.5      # Share of frame energy that must fall in SPEECH_BAND
+MAX_FLATNESS = 0.45       # Spectral flatness (1 = white noise) above which a frame is noise
+MIN_SPEECH = 0.15         # Seconds; shorter bursts (clicks, bumps) are dropped
+MIN_GAP = 0.3             # Seconds; shorter pauses inside speech are bridged
+PADDING = 0.2             # Seconds kept on each side of a speech region for word edges
+MIN_TURN_SPEECH = 0.3     # Seconds of speech a diarized turn needs to be transcribed
+MAX_PAUSE = 2.0           # Seconds of non-speech that split a turn in two
+BLOCK = 60.0              # Seconds analysed at a time for long recordings
+
+class SpeechDetector:
+    """Frame-level speech / non-speech classifier for 16 kHz PCM
+
+    A frame is speech when it is loud enough over a noise floor that tracks
+    the quietest recent frames, most of its energy lies in the voice band,
+    and its spectrum is peaky rather than flat like hiss, wind or fabric
+    rustle. Everything is vectorized per call, so a call with minutes of
+    audio costs a few NumPy passes. The detector is streaming: samples left
+    over from a partial frame and the noise floor carry into the next call.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame=FRAME, min_dbfs=MIN_DBFS, margin_db=MARGIN_DB,
+                 floor_rise_db=FLOOR_RISE_DB, speech_band=SPEECH_BAND, min_band_ratio=MIN_BAND_RATIO,
+                 max_flatness=MAX_FLATNESS):
+        self.sample_rate = sample_rate
+        self.frame = int(frame * sample_rate)
+        self.min_dbfs = min_dbfs
+        self.margin_db = margin_db
+        self.rise = floor_rise_db * frame
+        self.min_band_ratio = min_band_ratio
+        self.max_flatness = max_flatness
+        freqs = np.fft.rfftfreq(self.frame, 1 / sample_rate)
+        self.band = (freqs >= speech_band[0]) & (freqs <= speech_band[1])
+        self.taper = np.hanning(self.frame).astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self.floor = None
+        self.remainder = np.zeros(0, dtype=np.float32)
+
+    @property
+    def frame_seconds(self):
+        return self.frame / self.sample_rate
+
+    def features(self, frames):
+        """(level dBFS, voice-band energy share, in-band flatness) per frame row"""
+        level = 10 * np.log10(np.einsum('ij,ij->i', frames, frames) / self.frame + 1e-10)
+        spectrum = np.fft.rfft(frames * self.taper, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2 + 1e-12
+        in_band = power[:, self.band]
+        band_energy = in_band.sum(axis=1)
+        ratio = band_energy / power[:, 1:].sum(axis=1)
+        flatness = np.exp(np.log(in_band).mean(axis=1)) / (band_energy / in_band.shape[1])
+        return level, ratio, flatness
+
+    def track_floor(self, level):
+        """Noise floor before each frame: falls to any quieter frame, rises at most self.rise per frame"""
+        steps = np.arange(len(level)) * self.rise
+        start = level[0] if self.floor is None else self.floor
+        # floor[k] = min(start + rise * k, min over j <= k of level[j] + rise * (k - j))
+        floor = np.minimum(np.minimum.accumulate(level - steps) + steps, start + steps)
+        self.floor = floor[-1] + self.rise
+        return floor
+
+    def classify(self, pcm):
+        """Speech decision for every whole frame in pcm (int16 or float in [-1, 1])"""
+        pcm = np.asarray(pcm)
+        if pcm.dtype.kind in 'iu':
+            pcm = pcm.astype(np.float32) / 32768.0
+        pcm = np.concatenate((self.remainder, pcm.astype(np.float32, copy=False)))
+        usable = len(pcm) - len(pcm) % self.frame
+        self.remainder = pcm[usable:]
+        if not usable:
+            return np.zeros(0, dtype=bool)
+        level, ratio, flatness = self.features(pcm[:usable].reshape(-1, self.frame))
+        threshold = np.maximum(self.track_floor(level) + self.margin_db, self.min_dbfs)
+        return (level >= threshold) & (ratio >= self.min_band_ratio) & (flatness <= self.max_flatness)
+
+def runs(mask):
+    """[start, end) frame index pairs of the True runs in a boolean array"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+def smooth(mask, min_speech, min_gap, padding):
+    """Bridge short pauses, drop short bursts and pad what is left (all in frames)"""
+    mask = mask.copy()
+    for start, end in runs(~mask):
+        if 0 < start and end < len(mask) and end - start < min_gap:
+            mask[start:end] = True
+    regions = [(max(0, start - padding), min(len(mask), end + padding))
+               for start, end in runs(mask) if end - start >= min_speech]
+    merged = []
+    for start, end in regions:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def speech_regions(audio, detector=None, min_speech=MIN_SPEECH, min_gap=MIN_GAP, padding=PADDING,
+                   block=BLOCK):
+    """(start, end) seconds of speech in a float32 array, longaudio.WavMap or ArchiveMap
+
+    Long audio is read BLOCK seconds at a time, so memory stays flat.
+    """
+    detector = detector or SpeechDetector()
+    detector.reset()
+    rate = detector.sample_rate
+    step = int(block * rate)
+    masks = []
+    for first in range(0, len(audio), step):
+        if hasattr(audio, 'segment'):
+            samples = audio.segment(first / rate, (first + step) / rate)
+        else:
+            samples = audio[first:first + step]
+        masks.append(detector.classify(samples))
+    mask = np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+    frame = detector.frame_seconds
+    return [(start * frame, end * frame)
+            for start, end in smooth(mask, round(min_speech / frame), round(min_gap / frame),
+                                     round(padding / frame))]
+
+def gate_turns(turns, regions, min_turn_speech=MIN_TURN_SPEECH, max_pause=MAX_PAUSE):
+    """Trim (start, end, speaker) turns to the speech inside them
+
+    Turns with less than min_turn_speech seconds of speech are dropped, the
+    rest are trimmed to their first and last speech, and a turn is split
+    where it holds more than max_pause seconds of non-speech.
+    """
+    if not regions:
+        return []
+    starts = np.array([start for start, _ in regions])
+    ends = np.array([end for _, end in regions])
+    gated = []
+    for start, end, speaker in turns:
+        first = int(np.searchsorted(ends, start, side='right'))
+        last = int(np.searchsorted(starts, end, side='left'))
+        clipped = [(max(s, start), min(e, end)) for s, e in zip(starts[first:last], ends[first:last])]
+        if sum(e - s for s, e in clipped) < min_turn_speech:
+            continue
+        pieces = []
+        for s, e in clipped:
+            if pieces and s - pieces[-1][1] <= max_pause:
+                pieces[-1][1] = e
+            else:
+                pieces.append([s, e])
+        gated.extend((float(s), float(e), speaker) for s, e in pieces)
+    return gated
+
+def main():
+    parser = argparse.ArgumentParser(description="List speech regions in a 16 kHz recording")
+    parser.add_argument('audio')
+    parser.add_argument('--margin-db', type=float, default=MARGIN_DB)
+    parser.add_argument('--min-dbfs', type=float, default=MIN_DBFS)
+    parser.add_argument('--min-band-ratio', type=float, default=MIN_BAND_RATIO)
+    parser.add_argument('--max-flatness', type=float, default=MAX_FLATNESS)
+    args = parser.parse_args()
+
+    from longaudio import open_audio
+    wav = open_audio(args.audio)
+    detector = SpeechDetector(min_dbfs=args.min_dbfs, margin_db=args.margin_db,
+                              min_band_ratio=args.min_band_ratio, max_flatness=args.max_flatness)
+    started = time.perf_counter()
+    regions = speech_regions(wav, detector)
+    elapsed = time.perf_counter() - started
+    for start, end in regions:
+        print(f"{start:9.2f}s - {end:9.2f}s")
+    speech = sum(end - start for start, end in regions)
+    print(f"{speech:.1f}s of speech in {wav.duration:.1f}s ({speech / max(wav.duration, 1e-9):.0%}), "
+          f"analysed at {wav.duration / elapsed:.0f}x real time")
+
+if __name__ == "__main__":
+    main()
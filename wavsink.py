@@ -0,0 +1,237 @@
+import os
+import queue
+import struct
+import sys
+import threading
+from concurrent.futures import Future
+
+WAV_HEADER_SIZE = 44
+BLOCK_SIZE = 64 * 1024  # Bytes of PCM buffered in RAM before hitting the disk
+
+def build_wav_header(data_size, sample_rate, sample_width, channels):
+    """Build a canonical 44-byte PCM WAV header"""
+    byte_rate = sample_rate * sample_width * channels
+    block_align = sample_width * channels
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, byte_rate, block_align, sample_width * 8,
+        b'data', data_size
+    )
+
+class StreamingWavWriter:
+    """Write PCM to a WAV file in fixed-size blocks as it arrives
+
+    Only one block is ever held in memory. The header is written with zero
+    sizes up front and patched on close, so a file left behind by a crash can
+    be repaired with recover_wav().
+    """
+
+    def __init__(self, filename, sample_rate, sample_width=2, channels=1, block_size=BLOCK_SIZE):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.data_size = 0
+        self.file = open(filename, 'wb')
+        self.file.write(build_wav_header(0, sample_rate, sample_width, channels))
+
+    @property
+    def closed(self):
+        return self.file is None
+
+    def write(self, pcm):
+        """Queue PCM bytes, flushing every full block to disk"""
+        self.data_size += len(pcm)
+        if not self.buffer and len(pcm) >= self.block_size:
+            # Already a full block (e.g. from BackgroundWavWriter); skip the copy
+            self.file.write(pcm)
+            return
+        self.buffer.extend(pcm)
+        if len(self.buffer) >= self.block_size:
+            full = len(self.buffer) - len(self.buffer) % self.block_size
+            self.file.write(self.buffer[:full])
+            del self.buffer[:full]
+
+    def flush(self):
+        """Write any buffered PCM and push it to the OS"""
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        """Flush remaining PCM and patch the RIFF and data chunk sizes"""
+        if self.file is None:
+            return
+        self.flush()
+        self.file.seek(0)
+        self.file.write(build_wav_header(self.data_size, self.sample_rate,
+                                         self.sample_width, self.channels))
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DiskWriter:
+    """One background thread that performs file I/O in submission order
+
+    submit() never blocks, so it is safe to call from a BLE notification
+    callback; the unbounded queue absorbs bursts while the disk is slow.
+    With a single thread, everything queued for one file (open, writes,
+    close, follow-up work) runs in order without locking.
+    """
+
+    def __init__(self, name="disk-writer"):
+        self.name = name
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self.jobs.qsize()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); returns a concurrent.futures.Future"""
+        future = Future()
+        self.post(fn, *args, future=future, **kwargs)
+        return future
+
+    def post(self, fn, *args, future=None, **kwargs):
+        """Queue fn(*args, **kwargs) without a Future; errors are only logged"""
+        if self.thread is None:
+            self.start()
+        self.jobs.put((future, fn, args, kwargs))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                future, fn, args, kwargs = job
+                if future and not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    print(f"Disk writer: {getattr(fn, '__name__', fn)} failed: {e}")
+                    if future:
+                        future.set_exception(e)
+                else:
+                    if future:
+                        future.set_result(result)
+            finally:
+                self.jobs.task_done()
+
+    def barrier(self):
+        """Future that resolves once everything queued before it has run"""
+        return self.submit(lambda: None)
+
+    def join(self):
+        """Block until everything submitted so far has run"""
+        self.jobs.join()
+
+    def stop(self):
+        """Run the queued work, then end the thread"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread and thread.is_alive():
+            self.jobs.put(None)
+            thread.join()
+
+class BackgroundWavWriter:
+    """StreamingWavWriter whose file I/O all happens on a DiskWriter thread
+
+    Same interface as StreamingWavWriter, but write() and close() only
+    queue work. PCM is collected into full blocks first so the thread gets
+    one job per block rather than one per small write.
+    """
+
+    def __init__(self, disk, filename, sample_rate, sample_width=2, channels=1, block_size=BLOCK_SIZE):
+        self.disk = disk
+        self.filename = filename
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.data_size = 0
+        self.closed = False
+        self.writer = None
+        disk.post(self.open, sample_rate, sample_width, channels, block_size)
+
+    def open(self, *args):
+        self.writer = StreamingWavWriter(self.filename, *args)
+
+    def write(self, pcm):
+        self.buffer.extend(pcm)
+        self.data_size += len(pcm)
+        if len(self.buffer) >= self.block_size:
+            block, self.buffer = self.buffer, bytearray()
+            self.disk.post(self.write_queued, block)
+
+    def write_queued(self, pcm):
+        # A failed open was already reported; drop the session's audio
+        if self.writer:
+            self.writer.write(pcm)
+
+    def close(self):
+        """Queue the header patch; the returned Future resolves once the file is complete"""
+        self.closed = True
+        if self.buffer:
+            block, self.buffer = self.buffer, bytearray()
+            self.disk.post(self.write_queued, block)
+        return self.disk.submit(self.close_queued)
+
+    def close_queued(self):
+        if self.writer:
+            self.writer.close()
+
+def needs_recovery(filename):
+    """Check whether a WAV file's header disagrees with its length on disk"""
+    with open(filename, 'rb') as f:
+        header = f.read(WAV_HEADER_SIZE)
+        file_size = os.fstat(f.fileno()).st_size
+    if len(header) < WAV_HEADER_SIZE or header[:4] != b'RIFF':
+        return False
+    data_size = struct.unpack_from('<I', header, 40)[0]
+    return WAV_HEADER_SIZE + data_size != file_size
+
+def recover_wav(filename):
+    """Repair the header of a WAV file truncated by a crash
+
+    Assumes the 44-byte layout written by StreamingWavWriter. Any trailing
+    partial sample frame is dropped. Returns the recovered data size in bytes.
+    """
+    with open(filename, 'r+b') as f:
+        header = f.read(WAV_HEADER_SIZE)
+        if len(header) < WAV_HEADER_SIZE or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            raise ValueError(f"{filename} is not a recoverable WAV file")
+        channels, sample_rate = struct.unpack_from('<HI', header, 22)
+        bits_per_sample = struct.unpack_from('<H', header, 34)[0]
+        block_align = channels * bits_per_sample // 8
+
+        file_size = os.fstat(f.fileno()).st_size
+        data_size = file_size - WAV_HEADER_SIZE
+        data_size -= data_size % block_align
+        f.truncate(WAV_HEADER_SIZE + data_size)
+        f.seek(0)
+        f.write(build_wav_header(data_size, sample_rate, bits_per_sample // 8, channels))
+    return data_size
+
+if __name__ == "__main__":
+    # Usage: python wavsink.py <file.wav> [...]
+    for path in sys.argv[1:]:
+        size = recover_wav(path)
+        print(f"Recovered {path}: {size/1024:.1f} KB of audio")